@@ -1,10 +1,60 @@
-from utils.gemini_client import GeminiClient
+from utils.model_router import ModelRouter, Ambiguity
 from utils.opik_logger import OpikLogger
+from utils.metrics import metrics
+from utils.logger import get_logger
+from utils.slo import get_slo
 import json
 
+log = get_logger('hrv_monitor')
+
+def assess_recovery(hrv_data):
+    """
+    Rule-based recovery assessment of one HRV reading
+    Returns deviation (% from baseline), state, intensity_adjustment (%) and concerns
+    """
+    deviation = ((hrv_data['hrv_ms'] - hrv_data['baseline_hrv']) / hrv_data['baseline_hrv'] * 100)
+
+    # Determine recovery state
+    if deviation > -5:
+        state = "OPTIMAL"
+        intensity_adjustment = 0
+        concerns = []
+    elif deviation > -15:
+        state = "GOOD"
+        intensity_adjustment = -10
+        concerns = ["Slightly elevated stress markers"]
+    elif deviation > -25:
+        state = "COMPROMISED"
+        intensity_adjustment = -30
+        concerns = []
+    else:
+        state = "POOR"
+        intensity_adjustment = -50
+        concerns = []
+
+    # Check for specific issues
+    if hrv_data['resting_hr'] > 65:
+        concerns.append("Elevated resting heart rate suggests dehydration or insufficient recovery")
+
+    if hrv_data['sleep_hours'] < 6.5:
+        concerns.append("Insufficient sleep (< 6.5 hours) significantly impairs recovery")
+        intensity_adjustment -= 10
+
+    if deviation < -20 and hrv_data['resting_hr'] > 70:
+        concerns.append("⚠️ WARNING: Possible overtraining syndrome - consider rest day")
+        intensity_adjustment = -70
+
+    return {
+        'deviation': deviation,
+        'state': state,
+        'intensity_adjustment': intensity_adjustment,
+        'concerns': concerns
+    }
+
 class HRVMonitorAgent:
     def __init__(self):
-        self.gemini = GeminiClient(model_name="gemini-2.0-flash-lite")
+        self.router = ModelRouter()
+        self.gemini = self.router.default
         self.opik = OpikLogger()
     
     def analyze_recovery(self, hrv_data):
@@ -37,13 +87,15 @@ Provide:
 4. Actionable recommendations
 """
         
-        response = self.gemini.generate_with_thinking(prompt, system_instruction)
-        
-        # FALLBACK: If Gemini API fails, use rule-based analysis
-        if not response['success']:
-            print(f"⚠️ Gemini API failed: {response.get('error', 'Unknown error')}")
-            print("📋 Using fallback rule-based analysis...")
-            response = self._fallback_analysis(hrv_data)
+        # Clear-cut days are answered by the rules; FALLBACK: rule-based analysis if
+        # Gemini fails or misses the endpoint's SLO
+        response = self.router.generate(
+            self._ambiguity(hrv_data),
+            prompt,
+            system_instruction,
+            fallback=lambda: self._fallback_analysis(hrv_data),
+            deadline_s=get_slo('hrv')
+        )
         
         if response['success']:
             # Log to Opik
@@ -56,49 +108,48 @@ Provide:
                     metadata={
                         'hrv_deviation_pct': ((hrv_data['hrv_ms'] - hrv_data['baseline_hrv']) / hrv_data['baseline_hrv'] * 100),
                         'recovery_compromised': hrv_data['hrv_ms'] < hrv_data['baseline_hrv'] * 0.9,
-                        'fallback_used': response.get('fallback', False)
+                        'fallback_used': response.get('fallback', False),
+                        'model_tier': response['tier']
                     }
                 )
             except Exception as e:
-                print(f"⚠️ Opik logging failed: {e}")
+                log.warning('opik_logging_failed', error=str(e))
         
         return response
     
-    def _fallback_analysis(self, hrv_data):
+    def _ambiguity(self, hrv_data):
         """
-        Rule-based fallback when Gemini API is unavailable
+        How far the rule-based analysis can be trusted for this reading
+        An OPTIMAL day with no concerns is fully decided by the rules
         """
         deviation = ((hrv_data['hrv_ms'] - hrv_data['baseline_hrv']) / hrv_data['baseline_hrv'] * 100)
-        
-        # Determine recovery state
-        if deviation > -5:
-            state = "OPTIMAL"
-            intensity_adjustment = 0
-            concerns = []
-        elif deviation > -15:
-            state = "GOOD"
-            intensity_adjustment = -10
-            concerns = ["Slightly elevated stress markers"]
-        elif deviation > -25:
-            state = "COMPROMISED"
-            intensity_adjustment = -30
-            concerns = []
-        else:
-            state = "POOR"
-            intensity_adjustment = -50
-            concerns = []
-        
-        # Check for specific issues
+        ambiguity = Ambiguity()
+
+        if deviation <= -5:
+            ambiguity.add(0.25, 'recovery below optimal')
+        # Within 3 points of a state boundary the rule-based state is a coin flip
+        if any(abs(deviation - boundary) < 3 for boundary in (-5, -15, -25)):
+            ambiguity.add(0.25, 'borderline recovery state')
         if hrv_data['resting_hr'] > 65:
-            concerns.append("Elevated resting heart rate suggests dehydration or insufficient recovery")
-        
+            ambiguity.add(0.1, 'elevated resting HR')
         if hrv_data['sleep_hours'] < 6.5:
-            concerns.append("Insufficient sleep (< 6.5 hours) significantly impairs recovery")
-            intensity_adjustment -= 10
-        
+            ambiguity.add(0.1, 'short sleep')
+        if deviation > -5 and (hrv_data['resting_hr'] > 65 or hrv_data['sleep_hours'] < 6.5):
+            ambiguity.add(0.3, 'HRV and other markers disagree')
         if deviation < -20 and hrv_data['resting_hr'] > 70:
-            concerns.append("⚠️ WARNING: Possible overtraining syndrome - consider rest day")
-            intensity_adjustment = -70
+            ambiguity.add(0.2, 'possible overtraining')
+        return ambiguity
+
+    @metrics.timed('hrv_monitor.fallback')
+    def _fallback_analysis(self, hrv_data):
+        """
+        Rule-based fallback when Gemini API is unavailable
+        """
+        assessment = assess_recovery(hrv_data)
+        deviation = assessment['deviation']
+        state = assessment['state']
+        intensity_adjustment = assessment['intensity_adjustment']
+        concerns = assessment['concerns']
         
         # Generate response
         analysis = f"""
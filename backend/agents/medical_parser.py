@@ -1,16 +1,19 @@
-from utils.gemini_client import GeminiClient
+from utils.model_router import ModelRouter, Ambiguity
 from utils.opik_logger import OpikLogger
+from utils.metrics import metrics
+from utils.logger import get_logger, bind_request_context
+from utils.slo import get_slo
+from utils.cache import create_cache
+from utils.document_chunker import split_sections
+from data.surgery_protocols import get_protocol_phase
+from data.interaction_graph import INTERACTION_GRAPH
+from concurrent.futures import ThreadPoolExecutor
+import re
+
+log = get_logger('medical_parser')
 
 class MedicalParserAgent:
-    def __init__(self):
-        self.gemini = GeminiClient(model_name="gemini-2.0-flash-lite")
-        self.opik = OpikLogger()
-    
-    def extract_constraints(self, medical_profile):
-        """
-        Extract actionable workout constraints from medical profile
-        """
-        system_instruction = """You are a medical constraint analyzer for fitness programming. 
+    SYSTEM_INSTRUCTION = """You are a medical constraint analyzer for fitness programming. 
 Extract specific, actionable workout restrictions from medical information.
 
 Focus on:
@@ -19,12 +22,50 @@ Focus on:
 - Contraindicated exercises (specific movements to block)
 - Recovery timeline considerations"""
 
-        prompt = f"""
+    # Constraint categories extracted from each document chunk, in display order
+    DOCUMENT_SECTIONS = [
+        ('avoid', 'MOVEMENTS TO AVOID'),
+        ('safe', 'SAFE EXERCISES'),
+        ('progression', 'PROGRESSION GUIDELINES'),
+        ('medications', 'MEDICATION CONSIDERATIONS')
+    ]
+
+    def __init__(self):
+        self.router = ModelRouter()
+        self.gemini = self.router.default
+        self.opik = OpikLogger()
+        # Phase results stay valid for the whole phase, not just the 24h response cache
+        self.phase_cache = create_cache('phases', cache_dir='.phase_cache', ttl_hours=24 * 28)
+    
+    def _build_prompt(self, medical_profile, phase=None):
+        """
+        Build the extraction prompt for a medical profile
+        With a protocol phase, the prompt describes the phase window instead of the exact
+        week so every week in the phase shares one prompt
+        """
+        if phase:
+            if phase['next_transition_week'] is not None:
+                window = f"{phase['start_week']}-{phase['next_transition_week'] - 1}"
+            else:
+                window = f"{phase['start_week']}+"
+            weeks_line = f"{window} ({phase['name']} phase)"
+        else:
+            weeks_line = medical_profile.get('weeks_post_op', 'N/A')
+
+        # Only profiles with known drug-drug interactions get the extra line (and prompt)
+        drug_interactions = INTERACTION_GRAPH.drug_interactions(medical_profile.get('medications', []))
+        interactions_line = ''
+        if drug_interactions:
+            interactions_line = '\n- Known drug interactions: ' + '; '.join(
+                f"{' + '.join(i['medications'])} ({i['severity']}): {i['message']}" for i in drug_interactions
+            )
+
+        return f"""
 Medical Profile:
 - Surgery: {medical_profile.get('surgery', 'None')}
-- Weeks Post-Op: {medical_profile.get('weeks_post_op', 'N/A')}
+- Weeks Post-Op: {weeks_line}
 - Restrictions: {', '.join(medical_profile.get('restrictions', []))}
-- Medications: {', '.join(medical_profile.get('medications', []))}
+- Medications: {', '.join(medical_profile.get('medications', []))}{interactions_line}
 
 Extract:
 1. Specific exercises/movements to AVOID
@@ -34,14 +75,120 @@ Extract:
 
 Format as clear rules for workout programming.
 """
-        
-        response = self.gemini.generate_with_thinking(prompt, system_instruction)
-        
-        # FALLBACK: If Gemini API fails
-        if not response['success']:
-            print(f"⚠️ Gemini API failed: {response.get('error', 'Unknown error')}")
-            print("📋 Using fallback medical constraint extraction...")
-            response = self._fallback_extraction(medical_profile)
+
+    def _get_phase(self, medical_profile):
+        return get_protocol_phase(medical_profile.get('surgery', ''), medical_profile.get('weeks_post_op'))
+
+    def _phase_cache_data(self, medical_profile, phase):
+        """Cache key payload shared by every week of a protocol phase"""
+        return {
+            'protocol': phase['protocol'],
+            'phase': phase['index'],
+            'surgery': medical_profile.get('surgery', ''),
+            'restrictions': medical_profile.get('restrictions', []),
+            'medications': medical_profile.get('medications', []),
+            'type': 'constraint_phase'
+        }
+
+    def cache_identity(self, medical_profile):
+        """
+        Key identifying which cached result serves a profile
+        Profiles in the same protocol phase share one identity
+        """
+        phase = self._get_phase(medical_profile)
+        if phase:
+            return self.phase_cache._get_cache_key(self._phase_cache_data(medical_profile, phase))
+        return self.gemini.cache._get_cache_key(
+            self.gemini._thinking_cache_data(self._build_prompt(medical_profile), self.SYSTEM_INSTRUCTION)
+        )
+
+    def is_cached(self, medical_profile):
+        """
+        Check whether extract_constraints would be served from cache
+        """
+        phase = self._get_phase(medical_profile)
+        if phase:
+            return self.phase_cache.get(self._phase_cache_data(medical_profile, phase)) is not None
+        return self.gemini.is_cached(self._build_prompt(medical_profile), self.SYSTEM_INSTRUCTION)
+
+    def warm_cache(self, medical_profile):
+        """
+        Fill the constraint cache for a profile ahead of time
+        Returns 'hit' (already cached), 'warmed' or 'failed'
+        """
+        if self.is_cached(medical_profile):
+            return 'hit'
+
+        response = self._generate(medical_profile)
+        return 'warmed' if response['success'] else 'failed'
+
+    def _generate(self, medical_profile, fallback=None, deadline_s=None):
+        """
+        Run the LLM extraction (see GeminiClient.generate_with_deadline for fallback/deadline_s)
+        For surgeries with a known protocol timeline the result is computed once per
+        phase and reused until the patient crosses the next transition week
+        """
+        phase = self._get_phase(medical_profile)
+        prompt = self._build_prompt(medical_profile, phase)
+        ambiguity = self._ambiguity(medical_profile, phase)
+        if not phase:
+            return self.router.generate(
+                ambiguity, prompt, self.SYSTEM_INSTRUCTION, fallback=fallback, deadline_s=deadline_s
+            )
+
+        phase_key = self._phase_cache_data(medical_profile, phase)
+        response = self.phase_cache.get(phase_key)
+        if not response:
+            # Also runs for answers that arrive after the deadline
+            def store_phase(result):
+                self.phase_cache.set(phase_key, {'success': True, 'response': result['response']})
+
+            response = self.router.generate(
+                ambiguity, prompt, self.SYSTEM_INSTRUCTION, fallback=fallback, deadline_s=deadline_s,
+                on_success=store_phase
+            )
+
+        return {**response, 'protocol_phase': self._phase_summary(phase)}
+
+    def _ambiguity(self, medical_profile, phase):
+        """
+        How much judgment the extraction needs
+        Always at least flash-lite (the rule-based extraction only knows ACL protocols);
+        medications, unfamiliar restrictions and surgeries without a protocol escalate
+        """
+        ambiguity = Ambiguity(base=0.25)
+        if not phase:
+            ambiguity.add(0.2, 'no protocol timeline')
+        for medication in medical_profile.get('medications', []):
+            ambiguity.add(0.15, f'medication: {medication}')
+        if INTERACTION_GRAPH.has_high_severity(medical_profile.get('medications', [])):
+            ambiguity.add(0.2, 'high-severity drug interaction')
+        for restriction in medical_profile.get('restrictions', []):
+            if 'pivot' not in restriction.lower() and 'jump' not in restriction.lower():
+                ambiguity.add(0.1, f'restriction: {restriction}')
+        return ambiguity
+
+    def _phase_summary(self, phase):
+        return {
+            'name': phase['name'],
+            'start_week': phase['start_week'],
+            'next_transition_week': phase['next_transition_week']
+        }
+
+    def extract_constraints(self, medical_profile):
+        """
+        Extract actionable workout constraints from medical profile
+        """
+        # FALLBACK: rule-based extraction if Gemini fails or misses the endpoint's SLO
+        response = self._generate(
+            medical_profile,
+            fallback=lambda: self._fallback_extraction(medical_profile),
+            deadline_s=get_slo('medical')
+        )
+        response = {
+            **response,
+            'drug_interactions': INTERACTION_GRAPH.drug_interactions(medical_profile.get('medications', []))
+        }
         
         if response['success']:
             try:
@@ -53,37 +200,201 @@ Format as clear rules for workout programming.
                     metadata={
                         'surgery_type': medical_profile.get('surgery'),
                         'weeks_post_op': medical_profile.get('weeks_post_op'),
-                        'fallback_used': response.get('fallback', False)
+                        'fallback_used': response.get('fallback', False),
+                        'model_tier': response.get('tier')
                     }
                 )
             except Exception as e:
-                print(f"⚠️ Opik logging failed: {e}")
+                log.warning('opik_logging_failed', error=str(e))
         
         return response
     
+    def extract_from_document(self, document_text, medical_profile=None, max_workers=4):
+        """
+        Extract constraints from a long medical document (PT notes, discharge summaries, ...)
+        The document is split into sections, uncached sections are extracted in parallel,
+        and per-section results are cached by content hash - re-uploading a document with
+        one new page only re-processes that page
+        """
+        medical_profile = medical_profile or {}
+        chunks = split_sections(document_text)
+        results = [None] * len(chunks)
+
+        pending = []
+        for chunk in chunks:
+            cached = self.gemini.cache.get(self._chunk_cache_data(chunk))
+            if cached:
+                results[chunk['index']] = cached
+            else:
+                pending.append(chunk)
+
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as pool:
+                for chunk, extracted in zip(pending, pool.map(bind_request_context(self._extract_chunk), pending)):
+                    results[chunk['index']] = extracted
+
+        constraints = self._merge_chunk_constraints(results)
+        fallback_used = any(r.get('fallback', False) for r in results)
+
+        response = {
+            'success': True,
+            'response': self._format_document_constraints(constraints, medical_profile, len(chunks)),
+            'fallback': fallback_used,
+            'constraints': constraints,
+            'chunks': {
+                'total': len(chunks),
+                'cached': len(chunks) - len(pending),
+                'processed': len(pending)
+            }
+        }
+
+        try:
+            self.opik.log_agent_decision(
+                agent_name='medical_parser',
+                input_data={'document_chars': len(document_text), 'profile': medical_profile},
+                output_data=response['response'],
+                reasoning=response['response'],
+                metadata={
+                    'source': 'document',
+                    'chunks_total': len(chunks),
+                    'chunks_processed': len(pending),
+                    'fallback_used': fallback_used
+                }
+            )
+        except Exception as e:
+            log.warning('opik_logging_failed', error=str(e))
+
+        return response
+
+    def _chunk_cache_data(self, chunk):
+        """Cache key payload for a document chunk - content hash only, not position"""
+        return {
+            'chunk_hash': chunk['hash'],
+            'type': 'document_chunk'
+        }
+
+    def _extract_chunk(self, chunk):
+        """
+        Extract structured constraints from one document chunk
+        """
+        prompt = f"""{self.SYSTEM_INSTRUCTION}
+
+Extract workout constraints from this section of a patient's medical record.
+Return a JSON object with these keys, each a list of short, specific rules
+(empty list if the section says nothing relevant):
+- "avoid": exercises/movements to avoid (e.g. "No pivoting movements")
+- "safe": exercises/movements that are safe now
+- "progression": progression guidelines and timeline milestones
+- "medications": medication-related exercise considerations
+
+SECTION:
+{chunk['text']}
+"""
+        extracted = self.gemini.parse_json_response(prompt)
+
+        if isinstance(extracted, dict):
+            result = {
+                key: [str(rule) for rule in extracted.get(key) or [] if rule]
+                for key, _ in self.DOCUMENT_SECTIONS
+            }
+            self.gemini.cache.set(self._chunk_cache_data(chunk), result)
+            return result
+
+        # Fallback results are not cached so the chunk is retried once the API recovers
+        result = self._fallback_chunk_extraction(chunk['text'])
+        result['fallback'] = True
+        return result
+
+    def _fallback_chunk_extraction(self, text):
+        """
+        Rule-based keyword extraction for a document chunk
+        """
+        result = {key: [] for key, _ in self.DOCUMENT_SECTIONS}
+        for sentence in re.split(r'(?<=[.;!?])\s+|\n+', text):
+            sentence = sentence.strip(' •-*\t')
+            lower = sentence.lower()
+            if not sentence:
+                continue
+
+            if INTERACTION_GRAPH.find_drugs(lower):
+                result['medications'].append(sentence)
+            elif re.search(r"\b(no|avoid|do not|don't|not cleared|contraindicated|restrict\w*)\b", lower):
+                result['avoid'].append(sentence)
+            elif re.search(r'\b(progress\w*|advance|return to|by week|at week|after week)\b', lower):
+                result['progression'].append(sentence)
+            elif re.search(r'\b(cleared for|may begin|may start|can start|allowed|safe to|ok to|okay to)\b', lower):
+                result['safe'].append(sentence)
+
+        return result
+
+    def _merge_chunk_constraints(self, results):
+        """
+        Merge per-chunk constraints, dropping duplicates (case/punctuation-insensitive)
+        and keeping document order
+        """
+        merged = {key: [] for key, _ in self.DOCUMENT_SECTIONS}
+        seen = {key: set() for key, _ in self.DOCUMENT_SECTIONS}
+
+        for result in results:
+            for key, _ in self.DOCUMENT_SECTIONS:
+                for rule in result.get(key, []):
+                    normalized = ' '.join(re.sub(r'[^a-z0-9 ]', ' ', rule.lower()).split())
+                    if normalized and normalized not in seen[key]:
+                        seen[key].add(normalized)
+                        merged[key].append(rule)
+
+        return merged
+
+    def _format_document_constraints(self, constraints, medical_profile, chunk_count):
+        """
+        Render merged document constraints in the same layout as extract_constraints
+        """
+        analysis = f"""
+MEDICAL CONSTRAINT ANALYSIS
+Source: Medical document ({chunk_count} sections)
+Surgery: {medical_profile.get('surgery', 'Not specified')}
+Timeline: Week {medical_profile.get('weeks_post_op', 'N/A')} post-operation
+"""
+        for key, title in self.DOCUMENT_SECTIONS:
+            analysis += f"\n{title}:\n"
+            if constraints[key]:
+                analysis += ''.join(f"• {rule}\n" for rule in constraints[key])
+            else:
+                analysis += "• None found in document\n"
+
+        analysis += "\n[Note: Extracted from uploaded records. Always consult with your physician/PT for clearance]"
+        return analysis
+
+    @metrics.timed('medical_parser.fallback')
     def _fallback_extraction(self, medical_profile):
         """
         Rule-based fallback for medical constraint extraction
         """
-        surgery = medical_profile.get('surgery', '')
-        weeks = medical_profile.get('weeks_post_op', 0)
-        restrictions = medical_profile.get('restrictions', [])
-        medications = medical_profile.get('medications', [])
+        surgery = medical_profile.get('surgery') or ''
+        restrictions = medical_profile.get('restrictions') or []
+        medications = medical_profile.get('medications') or []
+        try:
+            weeks = float(medical_profile.get('weeks_post_op'))
+            weeks_label = f"{weeks:g}"
+        except (TypeError, ValueError):
+            # Unknown timeline: apply the most conservative (earliest) rules
+            weeks = None
+            weeks_label = 'unknown'
         
         analysis = f"""
 MEDICAL CONSTRAINT ANALYSIS
 Surgery: {surgery}
-Timeline: Week {weeks} post-operation
+Timeline: Week {weeks_label} post-operation
 
 REASONING:
-Based on standard post-surgical protocols for {surgery} at {weeks} weeks:
+Based on standard post-surgical protocols for {surgery} at {weeks_label} weeks:
 
 MOVEMENTS TO AVOID:
 """
         
         # ACL-specific rules
         if 'ACL' in surgery.upper():
-            if weeks < 6:
+            if weeks is None or weeks < 6:
                 analysis += "• NO running, jumping, or pivoting movements\n• NO deep squats (below 90°)\n• NO lateral movements\n"
             elif weeks < 12:
                 analysis += "• Avoid pivoting/twisting movements\n• No jumping/plyometrics\n• Limit deep squats\n"
@@ -99,7 +410,7 @@ MOVEMENTS TO AVOID:
         
         analysis += "\nSAFE EXERCISES:\n"
         
-        if 'ACL' in surgery.upper() and weeks >= 8:
+        if 'ACL' in surgery.upper() and weeks is not None and weeks >= 8:
             analysis += "• Upper body exercises (all variations)\n"
             analysis += "• Core stability work (planks, dead bugs, bird dogs)\n"
             analysis += "• Controlled lower body: leg press, hamstring curls, quad extensions\n"
@@ -110,16 +421,18 @@ MOVEMENTS TO AVOID:
             analysis += "• Cardio: stationary bike, swimming (if cleared)\n"
         
         analysis += f"\nPROGRESSION GUIDELINES:\n"
-        analysis += f"• Week {weeks}: Conservative approach, focus on controlled movements\n"
+        analysis += f"• Week {weeks_label}: Conservative approach, focus on controlled movements\n"
         analysis += f"• Can progress load by 5-10% per week if no pain/swelling\n"
         analysis += f"• Full clearance typically at 6-9 months for return to sport\n"
         
         if medications:
             analysis += f"\nMEDICATION CONSIDERATIONS:\n"
             for med in medications:
-                if 'warfarin' in med.lower():
+                if INTERACTION_GRAPH.normalize(med) == 'warfarin':
                     analysis += "• Warfarin: Avoid contact sports, minimize fall risk\n"
                     analysis += "• Use controlled environments for all exercises\n"
+            for interaction in INTERACTION_GRAPH.drug_interactions(medications):
+                analysis += f"• {' + '.join(interaction['medications'])} ({interaction['severity']}): {interaction['message']}\n"
         
         analysis += "\n[Note: This is rule-based extraction. Always consult with your physician/PT for clearance]"
         
@@ -1,23 +1,26 @@
-from utils.gemini_client import GeminiClient
+from utils.model_router import ModelRouter, Ambiguity
 from utils.opik_logger import OpikLogger
-from data.medication_interactions import check_interaction
+from utils.metrics import metrics
+from utils.logger import get_logger
+from utils.slo import get_slo
+from data.interaction_graph import INTERACTION_GRAPH
+
+log = get_logger('nutrition_advisor')
 
 class NutritionAdvisorAgent:
     def __init__(self):
-        self.gemini = GeminiClient(model_name="gemini-2.0-flash-lite")
+        self.router = ModelRouter()
+        self.gemini = self.router.default
         self.opik = OpikLogger()
     
     def analyze_meal(self, meal_description, medications):
         """
         Analyze meal for nutrition and medication interactions
         """
-        # First, check known interactions
+        # First, check known interactions (brand names resolve to the same drug)
         food_items = meal_description.split(',')
-        interactions = []
-        
-        for medication in medications:
-            med_interactions = check_interaction(medication, food_items)
-            interactions.extend(med_interactions)
+        interactions = INTERACTION_GRAPH.food_interactions(medications, food_items)
+        drug_interactions = INTERACTION_GRAPH.drug_interactions(medications)
         
         # Then use Gemini for nutritional analysis
         system_instruction = """You are a nutrition advisor specializing in recovery nutrition.
@@ -33,21 +36,32 @@ Provide:
 4. Timing recommendations (when to eat this for optimal recovery)
 """
         
-        response = self.gemini.generate_with_thinking(prompt, system_instruction)
-
-        # FALLBACK: If Gemini API fails, use rule-based analysis
-        if not response['success']:
-            print(f"⚠️ Gemini API failed for nutrition analysis: {response.get('error', 'Unknown error')}")
-            print("📋 Using fallback rule-based nutrition analysis...")
-            analysis_text = self._fallback_nutrition_analysis(meal_description, interactions)
-        else:
-            analysis_text = response['response']
+        # FALLBACK: rule-based analysis if Gemini fails or misses the endpoint's SLO
+        response = self.router.generate(
+            self._ambiguity(food_items, medications, interactions),
+            prompt,
+            system_instruction,
+            fallback=lambda: {
+                'success': True,
+                'response': self._fallback_nutrition_analysis(meal_description, interactions),
+                'fallback': True
+            },
+            deadline_s=get_slo('nutrition')
+        )
+        analysis_text = response.get('response', '')
 
         result = {
             'nutritional_analysis': analysis_text,
             'medication_interactions': interactions,
-            'safe_to_consume': len(interactions) == 0 or all(i['severity'] != 'high' for i in interactions)
+            'drug_interactions': drug_interactions,
+            'safe_to_consume': len(interactions) == 0 or all(i['severity'] != 'high' for i in interactions),
+            'fallback': response.get('fallback', False),
+            'tier': response['tier']
         }
+        if not response['success']:
+            # The interaction check above is rule-based and still valid
+            result['error'] = response.get('error', 'Nutrition analysis failed')
+            return result
 
         # Log to Opik
         try:
@@ -55,18 +69,37 @@ Provide:
                 agent_name='nutrition_advisor',
                 input_data={'meal': meal_description, 'medications': medications},
                 output_data=result,
-                reasoning=response.get('response', ''),
+                reasoning='' if response.get('fallback') else response['response'],
                 metadata={
                     'interactions_found': len(interactions),
                     'interaction_severity': [i['severity'] for i in interactions],
-                    'api_success': response['success']
+                    'api_success': not response.get('fallback', False),
+                    'model_tier': response['tier']
                 }
             )
         except Exception as e:
-            print(f"⚠️ Opik logging failed: {e}")
+            log.warning('opik_logging_failed', error=str(e))
 
         return result
 
+    def _ambiguity(self, food_items, medications, interactions):
+        """
+        How much judgment the meal analysis needs
+        Macro estimates always need a model (the keyword rules only detect food groups);
+        medication interactions and large meals escalate
+        """
+        ambiguity = Ambiguity(base=0.25)
+        if interactions:
+            ambiguity.add(0.15 * len(interactions), 'medication interactions')
+        if any(i['severity'] == 'high' for i in interactions):
+            ambiguity.add(0.2, 'high-severity interaction')
+        if len(medications) >= 2:
+            ambiguity.add(0.2, 'multiple medications')
+        if len(food_items) > 5:
+            ambiguity.add(0.1, 'many meal components')
+        return ambiguity
+
+    @metrics.timed('nutrition_advisor.fallback')
     def _fallback_nutrition_analysis(self, meal_description, interactions):
         """
         Rule-based fallback nutrition analysis when API is unavailable
@@ -151,7 +184,7 @@ MACRONUTRIENT ASSESSMENT:
         if interactions:
             analysis += f"\n⚠️ MEDICATION INTERACTIONS DETECTED ({len(interactions)}):\n"
             for interaction in interactions[:3]:  # Show first 3
-                analysis += f"- {interaction['description']}\n"
+                analysis += f"- {interaction['food'].strip()} + {interaction['medication']}: {interaction['message']}\n"
             if len(interactions) > 3:
                 analysis += f"- ...and {len(interactions) - 3} more\n"
             analysis += "\n**Please consult your healthcare provider about these interactions.**\n"
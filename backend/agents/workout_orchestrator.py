@@ -1,11 +1,138 @@
-from utils.gemini_client import GeminiClient
+from utils.model_router import ModelRouter, Ambiguity
 from utils.opik_logger import OpikLogger
+from utils.metrics import metrics
+from utils.logger import get_logger
+from utils.slo import get_slo
+from utils.cache import create_cache, derive_cache_key
+from agents.hrv_monitor import assess_recovery
+from datetime import date
+import re
+
+log = get_logger('workout_orchestrator')
+
+# "NO running, jumping, or pivoting movements", "avoid deep squats" -> the restriction clause
+RESTRICTION_PATTERN = re.compile(r"\b(?:no|avoid|limit|limited)\s+(?!restrictions?\b|major\b|concerns?\b)([^.;:\n]+)")
+# Movement category of a restriction clause; the parser words one restriction several
+# ways ("no pivoting", "avoid pivoting/twisting", "no lateral movements"), each counts once
+RESTRICTION_CATEGORIES = [
+    ('pivoting', re.compile(r'pivot|cutting|lateral|side-to-side')),
+    ('rotation', re.compile(r'rotat|twist')),
+    ('jumping', re.compile(r'jump|plyometric|burpee|hop|impact|running')),
+    ('deep_flexion', re.compile(r'deep|kneel|below 90')),
+    ('overhead', re.compile(r'overhead')),
+    ('range_of_motion', re.compile(r'range of motion')),
+    ('weight_bearing', re.compile(r'weight[ -]bearing')),
+    ('contact', re.compile(r'contact'))
+]
+# Categories _fallback_workout plans around (shallow squats and wall sits only, no sport)
+RULE_RESTRICTIONS = {'pivoting', 'jumping', 'rotation', 'deep_flexion', 'contact'}
+# Parser output sections whose "no ..." phrases are not restrictions ("progress if no
+# pain/swelling", "balance work (static, no movement)")
+NON_RESTRICTION_SECTIONS = re.compile(
+    r'^(?:SAFE EXERCISES|PROGRESSION GUIDELINES):\s*$.*?(?=^[A-Z][A-Z /-]+:\s*$|\Z)',
+    re.MULTILINE | re.DOTALL
+)
+
+WEEK_DAYS = 7
+# Rule-based weekly periodization: (focus, intensity, volume factor) per day
+WEEK_TEMPLATE = [
+    ('Strength', 'moderate', 1.0),
+    ('Mobility and core', 'low', 0.7),
+    ('Strength', 'moderate', 1.0),
+    ('Active recovery', 'low', 0.5),
+    ('Strength', 'moderate', 1.0),
+    ('Low-impact conditioning', 'moderate', 0.8),
+    ('Rest', 'rest', 0.0)
+]
+# Daily adaptation of a weekly plan stays deterministic for HRV intensity adjustments
+# (%) within these bounds; outside them the day's session is regenerated by the model
+ADAPT_MIN_ADJUSTMENT = -40
+ADAPT_MAX_ADJUSTMENT = 10
+# Session intensities of a weekly plan, easiest first; an adapted day moves one level
+# per this many points of intensity adjustment
+INTENSITY_LEVELS = ['low', 'moderate', 'high']
+INTENSITY_STEP_PCT = 20
+
+# A stored plan is re-scaled for a new request with the same constraint/equipment/time
+# profile when their HRV deviations are at most this many points apart
+NEAR_MISS_MAX_DEVIATION = 5.0
+# Structured plans kept per profile
+SESSION_PLANS_PER_PROFILE = 8
+# "-24.0% deviation", "24.0% below baseline"
+DEVIATION_PATTERN = re.compile(r'(-?\d+(?:\.\d+)?)\s*%\s*(deviation|below|above)', re.IGNORECASE)
+# Nominal deviation for an HRV analysis that only names the recovery state
+STATE_DEVIATIONS = {'OPTIMAL': 0.0, 'GOOD': -10.0, 'COMPROMISED': -20.0, 'POOR': -30.0}
+# "1. Leg Press: 3 sets × 10-12 reps", "- Wall Sit - 3x30s", "**Rows**: 3 sets of 12"
+EXERCISE_LINE_PATTERN = re.compile(
+    r'^\s*(?:\d+[.)]|[-•*])\s*\**(?P<name>[^:\n*]+?)\**\s*[:–-]\s*(?P<sets>\d+)\s*'
+    r'(?:sets?\s*(?:of|x|×)?|x|×)\s*(?P<reps>[^\n]+?)\s*$',
+    re.IGNORECASE | re.MULTILINE
+)
+
+def adapt_intensity(intensity, adjustment):
+    """
+    Session intensity after an HRV intensity adjustment (%); rest days and labels
+    outside INTENSITY_LEVELS are kept
+
+    >>> adapt_intensity('moderate', -30)
+    'low'
+    >>> adapt_intensity('high', -40)
+    'low'
+    >>> adapt_intensity('moderate', -10)
+    'moderate'
+    >>> adapt_intensity('rest', -30)
+    'rest'
+    """
+    if intensity not in INTENSITY_LEVELS:
+        return intensity
+    level = INTENSITY_LEVELS.index(intensity) + int(adjustment / INTENSITY_STEP_PCT)
+    return INTENSITY_LEVELS[min(max(level, 0), len(INTENSITY_LEVELS) - 1)]
+
+def nearest_session_plan(plans, deviation, volume_modifier):
+    """
+    Stored session plan to derive from: the one with the nearest HRV deviation, within
+    NEAR_MISS_MAX_DEVIATION, among plans whose volume modifier is at least volume_modifier
+    Energy level is not part of the plan profile, so a plan built for a low-energy day
+    may sit next to today's deviation; derivation only ever scales sets down
+
+    >>> plans = [{'deviation': -20.0, 'volume_modifier': 0.5}, {'deviation': -12.0, 'volume_modifier': 1.0}]
+    >>> nearest_session_plan(plans, -21.0, 0.5)['deviation']
+    -20.0
+    >>> nearest_session_plan(plans, -21.0, 1.0) is None
+    True
+    >>> nearest_session_plan(plans, -16.0, 0.7)['deviation']
+    -12.0
+    """
+    candidates = [
+        plan for plan in plans
+        if plan['volume_modifier'] >= volume_modifier
+        and abs(plan['deviation'] - deviation) <= NEAR_MISS_MAX_DEVIATION
+    ]
+    return min(candidates, key=lambda plan: abs(plan['deviation'] - deviation), default=None)
+
+def restriction_categories(medical_constraints):
+    """
+    Distinct restricted movement categories in constraint text; a clause matching no
+    known category counts as its first word
+    """
+    text = NON_RESTRICTION_SECTIONS.sub('', medical_constraints or '')
+    categories = set()
+    for clause in RESTRICTION_PATTERN.findall(text.lower()):
+        matched = {category for category, pattern in RESTRICTION_CATEGORIES if pattern.search(clause)}
+        categories |= matched or {clause.split()[0]}
+    return categories
 
 class WorkoutOrchestratorAgent:
     def __init__(self):
-        # Use Flash-Lite to avoid quota limits (1000 req/day vs 20 req/day)
-        self.gemini = GeminiClient(model_name="gemini-2.0-flash-lite")
+        # Flash-Lite by default (1000 req/day vs 20 req/day); clear-cut requests skip
+        # the model and multi-constraint ones escalate (see utils/model_router.py)
+        self.router = ModelRouter()
+        self.gemini = self.router.default
         self.opik = OpikLogger()
+        # Current weekly block per user, kept for the length of the block
+        self.plan_store = create_cache('weekly_plans', cache_dir='.plan_cache', ttl_hours=24 * WEEK_DAYS)
+        # Structured single-session plans per profile, re-scaled for near-miss requests
+        self.session_store = create_cache('session_plans', cache_dir='.plan_cache', ttl_hours=24)
     
     def generate_workout(self, medical_constraints, hrv_analysis, user_context):
         """
@@ -21,7 +148,8 @@ PRIORITY ORDER:
 
 You must show clear reasoning for every decision."""
 
-        prompt = f"""
+        with metrics.timer('workout_orchestrator.prompt_build'):
+            prompt = f"""
 Generate a workout plan considering ALL these factors:
 
 MEDICAL CONSTRAINTS:
@@ -56,20 +184,35 @@ RECOVERY ALIGNMENT:
 [How HRV influenced programming]
 """
         
-        response = self.gemini.generate_with_thinking(prompt, system_instruction)
-
-        # FALLBACK: If Gemini API fails, use rule-based workout generation
-        if not response['success']:
-            print(f"⚠️ Gemini API failed for workout generation: {response.get('error', 'Unknown error')}")
-            print("📋 Using fallback rule-based workout generation...")
-            response = self._fallback_workout(medical_constraints, hrv_analysis, user_context)
+        # Near miss: same profile as a stored plan, slightly different recovery - re-scale
+        # that plan instead of generating a new one
+        deviation = self._recovery_deviation(hrv_analysis)
+        response = None
+        if not self.gemini.is_cached(prompt, system_instruction):
+            response = self._derive_near_miss(medical_constraints, hrv_analysis, user_context, deviation)
+
+        if response is None:
+            # Also runs for answers that arrive after the deadline
+            def store_plan(result):
+                self._store_session_plan(result['response'], medical_constraints, hrv_analysis, user_context, deviation)
+
+            # FALLBACK: rule-based workout if Gemini fails or misses the endpoint's SLO
+            response = self.router.generate(
+                self._ambiguity(medical_constraints, hrv_analysis, user_context),
+                prompt,
+                system_instruction,
+                fallback=lambda: self._fallback_workout(medical_constraints, hrv_analysis, user_context),
+                deadline_s=get_slo('workout'),
+                on_success=store_plan
+            )
 
         if response['success']:
             # Validate no constraint violations
-            violations = self._check_constraints(
-                response['response'],
-                medical_constraints
-            )
+            with metrics.timer('workout_orchestrator.constraint_check'):
+                violations = self._check_constraints(
+                    response['response'],
+                    medical_constraints
+                )
 
             try:
                 self.opik.log_agent_decision(
@@ -84,7 +227,8 @@ RECOVERY ALIGNMENT:
                     metadata={
                         'constraint_violations': violations,
                         'safe_workout': len(violations) == 0,
-                        'fallback_used': response.get('fallback', False)
+                        'fallback_used': response.get('fallback', False),
+                        'model_tier': response['tier']
                     }
                 )
 
@@ -94,10 +238,348 @@ RECOVERY ALIGNMENT:
                     violations=violations
                 )
             except Exception as e:
-                print(f"⚠️ Opik logging failed: {e}")
+                log.warning('opik_logging_failed', error=str(e))
 
         return response
     
+    def _recovery_modifier(self, hrv_analysis, energy_level):
+        """(intensity, volume_modifier) for a recovery state and energy level"""
+        if 'POOR' in hrv_analysis.upper() or 'COMPROMISED' in hrv_analysis.upper():
+            return 'LOW', 0.5
+        elif energy_level < 5:
+            return 'LOW-MODERATE', 0.7
+        return 'MODERATE', 1.0
+
+    def _recovery_deviation(self, hrv_analysis):
+        """HRV deviation from baseline (%) stated in an HRV analysis, or None"""
+        match = DEVIATION_PATTERN.search(hrv_analysis or '')
+        if match:
+            value, direction = float(match.group(1)), match.group(2).lower()
+            if direction == 'below':
+                return -abs(value)
+            return abs(value) if direction == 'above' else value
+        for state, deviation in STATE_DEVIATIONS.items():
+            if state in (hrv_analysis or '').upper():
+                return deviation
+        return None
+
+    def _parse_session_plan(self, workout_text):
+        """Exercises with sets and reps from a generated workout, or None if unparseable"""
+        main_section = re.split(r'REASONING FOR EACH EXERCISE', workout_text, maxsplit=1, flags=re.IGNORECASE)[0]
+        exercises = [
+            {
+                'name': match.group('name').strip(),
+                'sets': int(match.group('sets')),
+                'reps': re.sub(r'\s*reps?$', '', match.group('reps').strip(), flags=re.IGNORECASE),
+                'reason': ''
+            }
+            for match in EXERCISE_LINE_PATTERN.finditer(main_section)
+            if 0 < int(match.group('sets')) <= 10
+        ]
+        # Warm-up lines ("Arm circles: 10 each direction") do not match; too few means
+        # the answer used a layout we cannot re-scale safely
+        return exercises if len(exercises) >= 3 else None
+
+    def _store_session_plan(self, workout_text, medical_constraints, hrv_analysis, user_context, deviation):
+        """Keep a generated plan in structured form for near-miss requests"""
+        if deviation is None:
+            return
+        exercises = self._parse_session_plan(workout_text)
+        if exercises is None:
+            return
+        _, volume_modifier = self._recovery_modifier(hrv_analysis, user_context.get('energy_level', 5))
+        key = {'profile': self._plan_profile_key(medical_constraints, user_context), 'type': 'session_plans'}
+        plans = self.session_store.get(key) or []
+        if any(p['deviation'] == deviation and p['exercises'] == exercises for p in plans):
+            # Cache hits re-deliver answers that are already stored
+            return
+        plans = [p for p in plans if p['deviation'] != deviation]
+        plans.insert(0, {'deviation': deviation, 'volume_modifier': volume_modifier, 'exercises': exercises})
+        self.session_store.set(key, plans[:SESSION_PLANS_PER_PROFILE])
+
+    def _derive_near_miss(self, medical_constraints, hrv_analysis, user_context, deviation):
+        """
+        Re-scale the nearest stored plan for this profile by the recovery volume modifier
+        (down only, see nearest_session_plan)
+        Returns a workout response, or None when no stored plan is close enough or the
+        derived plan fails the constraint check
+        """
+        if deviation is None:
+            return None
+        with metrics.timer('workout_orchestrator.near_miss'):
+            key = {'profile': self._plan_profile_key(medical_constraints, user_context), 'type': 'session_plans'}
+            intensity, volume_modifier = self._recovery_modifier(hrv_analysis, user_context.get('energy_level', 5))
+            nearest = nearest_session_plan(self.session_store.get(key) or [], deviation, volume_modifier)
+            if nearest is None:
+                return None
+            scale = volume_modifier / nearest['volume_modifier']
+            exercises = [{**ex, 'sets': max(1, round(ex['sets'] * scale))} for ex in nearest['exercises']]
+            if self._check_constraints('\n'.join(ex['name'] for ex in exercises), medical_constraints or ''):
+                return None
+
+            text = self._format_session(
+                f"{intensity} INTENSITY - {user_context.get('time_minutes', 30)} minutes",
+                exercises,
+                medical_constraints,
+                [
+                    f"- Derived from a plan generated for {nearest['deviation']:.1f}% HRV deviation (now {deviation:.1f}%)",
+                    f"- Sets scaled by {scale:.2f} for {intensity} intensity"
+                ]
+            )
+        log.info('workout_near_miss', deviation=deviation, source_deviation=nearest['deviation'], scale=round(scale, 2))
+        return {
+            'success': True,
+            'response': text,
+            'exercises': exercises,
+            'derived_from_deviation': nearest['deviation'],
+            'tier': 'derived',
+            'fallback': False
+        }
+
+    def _plan_profile_key(self, medical_constraints, user_context):
+        """Identity of the inputs a weekly plan was built for; a change means a new plan"""
+        return derive_cache_key({
+            'constraints': medical_constraints or '',
+            'equipment': sorted(user_context.get('equipment', ['bodyweight'])),
+            'time_minutes': user_context.get('time_minutes', 30)
+        })
+
+    def generate_weekly_plan(self, user_id, medical_constraints, user_context, start_date=None):
+        """
+        Generate a 7-day periodized block in one structured model call and store it as
+        the user's current plan (see plan_for_today for the daily adaptation)
+        Clear-cut profiles, and failed model calls, get the rule-based WEEK_TEMPLATE
+        """
+        start_date = start_date or date.today()
+        ambiguity = self._ambiguity(medical_constraints, '', user_context)
+        tier = self.router.choose_tier(ambiguity.score)
+
+        week = None
+        if tier != 'rules':
+            with metrics.timer('workout_orchestrator.weekly_generate'):
+                week = self._validate_week(
+                    self.router.clients[tier].parse_json_response(self._weekly_prompt(medical_constraints, user_context))
+                )
+            if week is None:
+                log.warning('weekly_plan_fallback', tier=tier)
+
+        record = {
+            'user_id': user_id,
+            'start_date': start_date.isoformat(),
+            'profile_key': self._plan_profile_key(medical_constraints, user_context),
+            'tier': tier,
+            'fallback': week is None,
+            # A rule-based week served because the model failed is replaced on the next day
+            'provisional': week is None and tier != 'rules',
+            'days': week if week is not None else self._rules_week(medical_constraints, user_context)
+        }
+        self.plan_store.set({'user_id': user_id, 'type': 'weekly_plan'}, record)
+        return record
+
+    def _weekly_prompt(self, medical_constraints, user_context):
+        return f"""You are a workout programming expert. Medical safety comes first: NEVER violate medical constraints.
+
+Design a 7-day periodized training block.
+
+MEDICAL CONSTRAINTS:
+{medical_constraints}
+
+USER CONTEXT:
+- Time available per session: {user_context.get('time_minutes', 30)} minutes
+- Equipment: {', '.join(user_context.get('equipment', ['bodyweight']))}
+- Typical energy level: {user_context.get('energy_level', 'moderate')}/10
+
+Alternate harder and easier days and include at least one rest or active recovery day.
+Sessions will be scaled each morning to the user's recovery, so plan for a normal day.
+
+Return a JSON object:
+{{"days": [{{"day": 1, "focus": "...", "intensity": "rest|low|moderate|high",
+  "exercises": [{{"name": "...", "sets": 3, "reps": "10-12", "reason": "..."}}]}}]}}
+with exactly 7 days ("exercises" is empty on rest days).
+"""
+
+    def _validate_week(self, plan):
+        """The model's weekly plan normalized to 7 days of exercises with integer sets, or None"""
+        days = plan.get('days') if isinstance(plan, dict) else None
+        if not isinstance(days, list) or len(days) != WEEK_DAYS:
+            return None
+        week = []
+        try:
+            for i, day in enumerate(days, 1):
+                week.append({
+                    'day': i,
+                    'focus': str(day.get('focus', '')),
+                    'intensity': str(day.get('intensity', 'moderate')).lower(),
+                    'exercises': [
+                        {
+                            'name': str(ex['name']),
+                            'sets': max(1, int(ex['sets'])),
+                            'reps': str(ex.get('reps', '')),
+                            'reason': str(ex.get('reason', ''))
+                        }
+                        for ex in day.get('exercises') or []
+                    ]
+                })
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return None
+        return week
+
+    def _rules_week(self, medical_constraints, user_context):
+        """Rule-based 7-day block: the fallback exercise selection on WEEK_TEMPLATE"""
+        time_minutes = user_context.get('time_minutes', 30)
+        equipment = user_context.get('equipment', ['bodyweight'])
+        week = []
+        for i, (focus, intensity, factor) in enumerate(WEEK_TEMPLATE, 1):
+            exercises = []
+            if factor > 0:
+                exercises = self._select_exercises(
+                    medical_constraints or '', equipment, time_minutes, max(1, round(3 * factor))
+                )
+            week.append({'day': i, 'focus': focus, 'intensity': intensity, 'exercises': exercises})
+        return week
+
+    def plan_for_today(self, user_id, medical_constraints, user_context, hrv_data, today=None):
+        """
+        Today's session from the user's weekly plan, adapted to this morning's HRV
+
+        Sets and the session intensity are scaled by the HRV intensity adjustment and
+        the constraint check is re-run - no model call. A new block is generated when
+        there is none, the week is over or the constraints/equipment/time changed; the
+        day alone is regenerated by the model when the adjustment is outside the safe
+        adaptation bounds or the adapted session fails the constraint check.
+        """
+        today = today or date.today()
+        record = self.plan_store.get({'user_id': user_id, 'type': 'weekly_plan'})
+        profile_key = self._plan_profile_key(medical_constraints, user_context)
+
+        reason = None
+        if record is None:
+            reason = 'no_plan'
+        elif record['profile_key'] != profile_key:
+            reason = 'constraints_changed'
+        elif not 0 <= (today - date.fromisoformat(record['start_date'])).days < WEEK_DAYS:
+            reason = 'week_complete'
+        elif record.get('provisional') and record['start_date'] != today.isoformat():
+            reason = 'retry_model'
+        if reason:
+            log.info('weekly_plan_generated', reason=reason)
+            record = self.generate_weekly_plan(user_id, medical_constraints, user_context, start_date=today)
+
+        day_index = (today - date.fromisoformat(record['start_date'])).days
+        planned = record['days'][day_index]
+        assessment = assess_recovery(hrv_data)
+        adjustment = assessment['intensity_adjustment']
+        adaptation = {
+            'recovery_state': assessment['state'],
+            'intensity_adjustment': adjustment,
+            'volume_factor': round(1 + adjustment / 100, 2),
+            'plan_regenerated': reason
+        }
+
+        if not ADAPT_MIN_ADJUSTMENT <= adjustment <= ADAPT_MAX_ADJUSTMENT:
+            return self._regenerate_day(medical_constraints, user_context, assessment, adaptation, 'outside_safe_bounds')
+
+        with metrics.timer('workout_orchestrator.adapt'):
+            session = {
+                **planned,
+                'intensity': adapt_intensity(planned['intensity'], adjustment),
+                'planned_intensity': planned['intensity'],
+                'exercises': [
+                    {**ex, 'sets': max(1, round(ex['sets'] * adaptation['volume_factor']))}
+                    for ex in planned['exercises']
+                ]
+            }
+            alignment_lines = [f"- Recovery state: {adaptation['recovery_state']}"]
+            if session['exercises']:
+                title = f"Day {session['day']}: {session['focus']} - {session['intensity'].upper()} INTENSITY"
+                alignment_lines.append(
+                    f"- Volume scaled to {adaptation['volume_factor']:.0%} of the planned sets "
+                    f"(intensity adjustment {adaptation['intensity_adjustment']}%)"
+                )
+            else:
+                title = f"Day {session['day']}: {session['focus']} - REST"
+            text = self._format_session(title, session['exercises'], medical_constraints, alignment_lines)
+            # Exercises only: the rendered safety section quotes the constraints themselves
+            violations = self._check_constraints(
+                '\n'.join(f"{ex['name']}: {ex['reason']}" for ex in session['exercises']),
+                medical_constraints or ''
+            )
+        if violations:
+            return self._regenerate_day(medical_constraints, user_context, assessment, adaptation, 'constraint_violation')
+
+        return {
+            'success': True,
+            'response': text,
+            'session': session,
+            'day': day_index + 1,
+            'adaptation': {**adaptation, 'source': 'weekly_plan'},
+            'tier': record['tier'],
+            'fallback': record['fallback']
+        }
+
+    def _regenerate_day(self, medical_constraints, user_context, assessment, adaptation, reason):
+        """A full generate_workout for today, when the weekly plan cannot be safely adapted"""
+        log.info('weekly_plan_day_regenerated', reason=reason, intensity_adjustment=assessment['intensity_adjustment'])
+        hrv_analysis = (
+            f"Recovery State: {assessment['state']}\n"
+            f"Recommended Intensity Adjustment: {assessment['intensity_adjustment']}%\n"
+            + ''.join(f"• {c}\n" for c in assessment['concerns'])
+        )
+        response = self.generate_workout(medical_constraints or '', hrv_analysis, user_context)
+        return {**response, 'adaptation': {**adaptation, 'source': 'regenerated', 'reason': reason}}
+
+    def _format_session(self, title, exercises, medical_constraints, alignment_lines):
+        """Render a structured session in the generate_workout layout"""
+        if not exercises:
+            return f"""
+WORKOUT PLAN ({title}):
+Rest day - light walking and mobility only.
+
+RECOVERY ALIGNMENT:
+{chr(10).join(alignment_lines)}
+"""
+        text = f"""
+WORKOUT PLAN ({title}):
+
+MAIN WORKOUT:
+"""
+        for i, ex in enumerate(exercises, 1):
+            text += f"{i}. {ex['name']}: {ex['sets']} sets × {ex['reps']} reps\n"
+
+        text += "\nREASONING FOR EACH EXERCISE:\n"
+        for i, ex in enumerate(exercises, 1):
+            text += f"{i}. {ex['name']}: {ex['reason'] or 'Carried over from the generated plan'}\n"
+
+        text += f"""
+MEDICAL SAFETY CHECKS:
+✓ All exercises reviewed against: {medical_constraints}
+
+RECOVERY ALIGNMENT:
+{chr(10).join(alignment_lines)}
+"""
+        return text
+
+    def _ambiguity(self, medical_constraints, hrv_analysis, user_context):
+        """
+        How much judgment the workout needs
+        A recovered user with no restrictions is fully covered by the rule-based plan;
+        restricted movement categories, and especially ones the rules do not know, escalate
+        """
+        ambiguity = Ambiguity()
+        restricted = restriction_categories(medical_constraints)
+        hrv_upper = (hrv_analysis or '').upper()
+
+        if restricted:
+            ambiguity.add(0.25, f'{len(restricted)} restricted movement categories')
+        unknown = restricted - RULE_RESTRICTIONS
+        if unknown:
+            ambiguity.add(0.15, 'restrictions without rules: ' + ', '.join(sorted(unknown)))
+        if 'POOR' in hrv_upper or 'COMPROMISED' in hrv_upper:
+            ambiguity.add(0.25, 'compromised recovery')
+            if user_context.get('energy_level', 5) < 5:
+                ambiguity.add(0.1, 'low energy on a compromised day')
+        return ambiguity
+
     def _check_constraints(self, workout_text, constraints):
         """
         Simple constraint violation check
@@ -116,28 +598,12 @@ RECOVERY ALIGNMENT:
 
         return violations
 
-    def _fallback_workout(self, medical_constraints, hrv_analysis, user_context):
+    def _select_exercises(self, medical_constraints, equipment, time_minutes, sets_per_exercise):
         """
-        Rule-based fallback workout generation when Gemini API is unavailable
+        Rule-based exercise selection: safe exercises for the constraints and equipment,
+        as many as fit the time available
         """
-        time_minutes = user_context.get('time_minutes', 30)
-        equipment = user_context.get('equipment', ['bodyweight'])
-        energy_level = user_context.get('energy_level', 5)
-
-        # Determine intensity modifier based on HRV and energy
-        if 'POOR' in hrv_analysis.upper() or 'COMPROMISED' in hrv_analysis.upper():
-            intensity = 'LOW'
-            volume_modifier = 0.5
-        elif energy_level < 5:
-            intensity = 'LOW-MODERATE'
-            volume_modifier = 0.7
-        else:
-            intensity = 'MODERATE'
-            volume_modifier = 1.0
-
-        # Calculate sets based on time available
         exercises_count = min(6, max(4, time_minutes // 5))
-        sets_per_exercise = int(3 * volume_modifier)
 
         # Select safe exercises based on constraints
         safe_exercises = []
@@ -208,7 +674,22 @@ RECOVERY ALIGNMENT:
             })
 
         # Trim to fit time
-        safe_exercises = safe_exercises[:exercises_count]
+        return safe_exercises[:exercises_count]
+
+    @metrics.timed('workout_orchestrator.fallback')
+    def _fallback_workout(self, medical_constraints, hrv_analysis, user_context):
+        """
+        Rule-based fallback workout generation when Gemini API is unavailable
+        """
+        time_minutes = user_context.get('time_minutes', 30)
+        equipment = user_context.get('equipment', ['bodyweight'])
+        energy_level = user_context.get('energy_level', 5)
+
+        # Determine intensity modifier based on HRV and energy
+        intensity, volume_modifier = self._recovery_modifier(hrv_analysis, energy_level)
+
+        sets_per_exercise = int(3 * volume_modifier)
+        safe_exercises = self._select_exercises(medical_constraints, equipment, time_minutes, sets_per_exercise)
 
         # Format workout plan
         workout_text = f"""
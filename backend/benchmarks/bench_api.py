@@ -0,0 +1,475 @@
+"""
+Offline end-to-end benchmark: every API route and agent against a local Gemini stand-in
+
+    cd backend && python -m benchmarks.bench_api [--requests 2000] [--concurrency 16]
+        [--latency lognormal:0.4,0.5] [--rate-limit 0.05] [--out results.json]
+        [--baseline previous.json --tolerance 0.2]
+
+No API key needed: the fake model (benchmarks/fake_gemini.py) sleeps for a sampled
+latency, injects 429s and returns canned output. Requests go through the Flask app
+(test client per thread), so routing, agents, deadlines, retries, circuit breaker and
+caches are all exercised. Caches live in a temporary directory.
+
+Reports throughput, p50/p95/p99 per route, cache hit ratio, fallback share and upstream
+call counts. With --baseline, exits non-zero if throughput or any route's p95 regressed
+by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from benchmarks.fake_gemini import FakeGeminiModel, LatencyModel
+
+MEALS = [
+    'grilled chicken, brown rice, broccoli',
+    'salmon, quinoa, spinach salad',
+    'greek yogurt, berries, oats',
+    'tofu stir fry, rice, vegetables',
+    'turkey sandwich, apple',
+    'lentil soup, bread',
+    'grapefruit, eggs, toast',
+    'steak, potato, kale',
+    'pasta, tomato sauce, parmesan',
+    'banana, peanut butter, oats'
+]
+
+MEDICATION_SETS = [[], [], ['warfarin'], ['atorvastatin'], ['levothyroxine']]
+
+WORKOUT_CONSTRAINTS = [
+    'ACL Reconstruction, week 6: no pivoting, no jumping',
+    'Meniscus Repair, week 4: no pivoting, no impact',
+    'Shoulder Surgery, week 8: limited range of motion',
+    'No restrictions'
+]
+
+HRV_STATES = [
+    'Recovery State: OPTIMAL',
+    'Recovery State: GOOD',
+    'Recovery State: COMPROMISED',
+    'Recovery State: POOR'
+]
+
+DOCUMENTS = [
+    """PHYSICAL THERAPY NOTE
+Patient is 6 weeks post ACL reconstruction. Gait normalized.
+
+RESTRICTIONS:
+No pivoting or cutting. No jumping until cleared at week 12.
+
+PLAN:
+Progress closed-chain strengthening. Stationary bike 20 minutes daily.""",
+    """DISCHARGE SUMMARY
+Arthroscopic meniscus repair, uncomplicated.
+
+ACTIVITY:
+Partial weight bearing for 4 weeks. Avoid deep squats beyond 90 degrees.
+
+MEDICATIONS:
+Warfarin 5mg daily for 6 weeks.""",
+    """SHOULDER REHAB PROGRESS
+Week 8 after rotator cuff repair.
+
+RANGE OF MOTION:
+Active flexion to 140 degrees. No overhead lifting.
+
+NEXT STEPS:
+Begin light resistance band external rotation."""
+]
+
+# Users of the per-user routes (weekly plans, today's session, HRV samples and alerts)
+BENCH_USERS = 50
+FIRST_SAMPLE_DATE = date(2026, 1, 1)
+
+# (weight, label) - roughly the production mix: HRV check and today's session on every
+# app open, wearable syncs, workouts and meals through the day, weekly plans and
+# documents rarely; job_submit is an async workout followed by a long-poll of the job
+ROUTE_MIX = [
+    (0.20, 'hrv_check'),
+    (0.15, 'medical_parse'),
+    (0.15, 'nutrition_analyze'),
+    (0.15, 'workout_generate'),
+    (0.12, 'workout_today'),
+    (0.03, 'workout_week'),
+    (0.08, 'hrv_samples'),
+    (0.04, 'hrv_alerts'),
+    (0.03, 'job_submit'),
+    (0.02, 'medical_ingest'),
+    (0.02, 'health'),
+    (0.01, 'metrics')
+]
+
+def _workout_body(rng):
+    return {
+        'medical_constraints': rng.choice(WORKOUT_CONSTRAINTS),
+        'hrv_analysis': rng.choice(HRV_STATES),
+        'user_context': {
+            'time_minutes': rng.choice([20, 30, 45]),
+            'equipment': rng.choice([['bodyweight'], ['dumbbells'], ['bodyweight', 'bands']]),
+            'energy_level': rng.choice([4, 6, 8])
+        }
+    }
+
+def _hrv_sample(rng, user_id, day):
+    """One wearable reading; day counts up per user so the detector accepts it"""
+    return {
+        'user_id': user_id,
+        'date': (FIRST_SAMPLE_DATE + timedelta(days=day)).isoformat(),
+        'hrv_ms': round(rng.gauss(55, 9), 1),
+        'baseline_hrv': 55,
+        'resting_hr': round(rng.gauss(60, 4)),
+        'sleep_hours': round(rng.uniform(5.5, 8.5), 1)
+    }
+
+def make_request(label, rng, profiles, user_days):
+    """
+    One request as (method, path, json body)
+    user_days: user_id -> days of HRV samples sent so far, updated in place
+    """
+    if label in ('workout_today', 'workout_week', 'hrv_samples', 'hrv_alerts'):
+        user_id = f'bench-user-{rng.randrange(BENCH_USERS)}'
+        day = user_days.get(user_id, 0)
+    if label == 'hrv_check':
+        return 'GET', '/api/hrv/check', None
+    if label == 'workout_today':
+        body = {**_workout_body(rng), 'user_id': user_id}
+        del body['hrv_analysis']
+        # Half the clients send this morning's reading, the rest use the server's
+        if rng.random() < 0.5:
+            user_days[user_id] = day + 1
+            body['hrv_data'] = _hrv_sample(rng, user_id, day)
+        return 'POST', '/api/workout/today', body
+    if label == 'workout_week':
+        body = {**_workout_body(rng), 'user_id': user_id}
+        del body['hrv_analysis']
+        return 'POST', '/api/workout/week', body
+    if label == 'hrv_samples':
+        # A sync uploads every day since the last one
+        days = rng.choice([1, 1, 1, 2, 3])
+        user_days[user_id] = day + days
+        return 'POST', '/api/hrv/samples', {
+            'samples': [_hrv_sample(rng, user_id, day + i) for i in range(days)]
+        }
+    if label == 'hrv_alerts':
+        return 'GET', f'/api/hrv/alerts?user_id={user_id}&since=0&limit=50', None
+    if label == 'job_submit':
+        return 'POST', '/api/jobs/workout', _workout_body(rng)
+    if label == 'medical_parse':
+        return 'POST', '/api/medical/parse', rng.choice(profiles)
+    if label == 'nutrition_analyze':
+        return 'POST', '/api/nutrition/analyze', {
+            'meal_description': rng.choice(MEALS),
+            'medications': rng.choice(MEDICATION_SETS)
+        }
+    if label == 'workout_generate':
+        return 'POST', '/api/workout/generate', _workout_body(rng)
+    if label == 'medical_ingest':
+        return 'POST', '/api/medical/ingest', {'document': rng.choice(DOCUMENTS)}
+    if label == 'health':
+        return 'GET', '/api/health', None
+    return 'GET', '/api/metrics', None
+
+def build_workload(count, seed=42):
+    """Weighted random mix of requests over finite pools, so repeats hit the cache"""
+    from data.common_profiles import enumerate_common_profiles
+
+    rng = random.Random(seed)
+    # Traffic concentrates on a few popular profiles
+    profiles = enumerate_common_profiles()
+    rng.shuffle(profiles)
+    popular = profiles[:40]
+
+    weights = [w for w, _ in ROUTE_MIX]
+    labels = [label for _, label in ROUTE_MIX]
+    user_days = {}
+    return [make_request(rng.choices(labels, weights)[0], rng, popular, user_days) for _ in range(count)]
+
+class CountingCache:
+    """
+    Cache proxy counting hits and misses
+    Lookups made while holding the single-flight lock are counted separately: a hit
+    there means another request's upstream call was reused
+    """
+    def __init__(self, cache, counters):
+        self._cache = cache
+        self._counters = counters
+        self._local = threading.local()
+
+    def _count(self, field):
+        with self._counters['lock']:
+            self._counters[field] += 1
+
+    def get(self, data):
+        response = self._cache.get(data)
+        if getattr(self._local, 'locked', False):
+            self._count('single_flight_hits' if response is not None else 'single_flight_misses')
+        else:
+            self._count('hits' if response is not None else 'misses')
+        return response
+
+    def lock(self, data):
+        proxy = self
+
+        class _Lock:
+            def __enter__(self):
+                self._inner = proxy._cache.lock(data)
+                self._inner.__enter__()
+                proxy._local.locked = True
+
+            def __exit__(self, *exc):
+                proxy._local.locked = False
+                return self._inner.__exit__(*exc)
+
+        return _Lock()
+
+    def __getattr__(self, name):
+        return getattr(self._cache, name)
+
+def new_cache_counters():
+    return {
+        'lock': threading.Lock(),
+        'hits': 0, 'misses': 0,
+        'single_flight_hits': 0, 'single_flight_misses': 0
+    }
+
+def prepare_app(fake, workdir, cache_backend='sqlite', retry_delay=None, admit_llm=None):
+    """
+    Build the Flask app with every Gemini client routed to the fake model and caches
+    in workdir; returns (app, cache counters)
+    Admission control is off unless admit_llm sets the LLM-bound in-flight limit: the
+    benchmark's client threads are not server threads
+    """
+    os.environ['HEALTHFLOW_ADMIT_LLM'] = str(admit_llm or 0)
+    os.environ['HEALTHFLOW_CACHE_BACKEND'] = cache_backend
+    os.environ['HEALTHFLOW_CACHE_DB'] = os.path.join(workdir, 'cache.sqlite3')
+    os.environ['OPIK_API_KEY'] = ''
+    os.environ.setdefault('HEALTHFLOW_LOG_LEVEL', 'ERROR')
+    # File-backend caches use relative directories
+    os.chdir(workdir)
+
+    from utils.gemini_client import use_model_factory
+    use_model_factory(fake.for_model)
+
+    import main
+    app = main.create_app()
+    agents = main.init_agents()
+
+    counters = new_cache_counters()
+    for agent in agents.values():
+        # One client per routing tier, all on the same response cache
+        for client in agent.router.clients.values():
+            client.cache = CountingCache(client.cache, counters)
+            if retry_delay is not None:
+                client.retry_delay = retry_delay
+        if hasattr(agent, 'phase_cache'):
+            agent.phase_cache = CountingCache(agent.phase_cache, counters)
+    return app, counters
+
+def _used_fallback(body):
+    """Fallback served in place of a model answer (rules-routed answers do not count)"""
+    if not isinstance(body, dict):
+        return False
+    if 'analysis' in body:
+        body = body['analysis']
+    return isinstance(body, dict) and bool(body.get('fallback')) and body.get('tier') != 'rules'
+
+def send(client, method, path, body):
+    """Send one request; returns (status, seconds, used fallback, deadline exceeded, body)"""
+    start = time.perf_counter()
+    if method == 'GET':
+        response = client.get(path)
+    else:
+        response = client.post(path, json=body)
+    elapsed = time.perf_counter() - start
+
+    payload = response.get_json(silent=True)
+    deadline = isinstance(payload, dict) and (
+        payload.get('deadline_exceeded') or (payload.get('analysis') or {}).get('deadline_exceeded')
+    )
+    return response.status_code, elapsed, _used_fallback(payload), bool(deadline), payload
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(q * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def _latency_stats(latencies):
+    ordered = sorted(latencies)
+    return {
+        'count': len(ordered),
+        'p50_ms': percentile(ordered, 0.50) * 1000,
+        'p95_ms': percentile(ordered, 0.95) * 1000,
+        'p99_ms': percentile(ordered, 0.99) * 1000,
+        'max_ms': (ordered[-1] if ordered else 0.0) * 1000
+    }
+
+def summarize(records, elapsed, counters, fake):
+    """records: list of (route, status, seconds, fallback, deadline_exceeded)"""
+    by_route = {}
+    for route, status, seconds, fallback, deadline in records:
+        by_route.setdefault(route, []).append((status, seconds, fallback, deadline))
+
+    routes = {}
+    for route, rows in sorted(by_route.items()):
+        routes[route] = {
+            **_latency_stats([r[1] for r in rows]),
+            'errors': sum(1 for r in rows if r[0] >= 500 and r[0] != 503),
+            'shed': sum(1 for r in rows if r[0] == 503),
+            'fallback_share': sum(1 for r in rows if r[2]) / len(rows),
+            'deadline_exceeded': sum(1 for r in rows if r[3])
+        }
+
+    lookups = counters['hits'] + counters['misses']
+    return {
+        'requests': len(records),
+        'elapsed_s': elapsed,
+        'throughput_rps': len(records) / elapsed if elapsed else 0.0,
+        'overall': _latency_stats([r[2] for r in records]),
+        'errors': sum(1 for r in records if r[1] >= 500 and r[1] != 503),
+        'shed': sum(1 for r in records if r[1] == 503),
+        'routes': routes,
+        'cache': {
+            'hits': counters['hits'],
+            'misses': counters['misses'],
+            'hit_ratio': counters['hits'] / lookups if lookups else 0.0,
+            'single_flight_hits': counters['single_flight_hits']
+        },
+        'upstream': fake.totals()
+    }
+
+# Long-poll of an async job after its submission
+JOB_POLL_WAIT_S = 10
+
+def run(workload, concurrency, app):
+    """Closed-loop load: `concurrency` clients each send their next request as soon as the last returns"""
+    records = []
+    records_lock = threading.Lock()
+    position = iter(range(len(workload)))
+    position_lock = threading.Lock()
+
+    def client_loop():
+        client = app.test_client()
+        while True:
+            with position_lock:
+                index = next(position, None)
+            if index is None:
+                return
+            method, path, body = workload[index]
+            status, seconds, fallback, deadline, payload = send(client, method, path, body)
+            with records_lock:
+                records.append((f"{method} {path.split('?')[0]}", status, seconds, fallback, deadline))
+
+            # Async submissions: wait for the result the way a client would
+            if status == 202:
+                status, seconds, fallback, deadline, _ = send(
+                    client, 'GET', f"/api/jobs/{payload['job_id']}?wait={JOB_POLL_WAIT_S}", None
+                )
+                with records_lock:
+                    records.append(('GET /api/jobs/<id>', status, seconds, fallback, deadline))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client_loop)
+    return records, time.perf_counter() - start
+
+def compare(results, baseline, tolerance, min_delta_ms=5.0):
+    """
+    Regressions vs a previous results file, as human-readable strings
+    p95 changes smaller than min_delta_ms are noise on sub-millisecond routes
+    """
+    regressions = []
+    if results['throughput_rps'] < baseline['throughput_rps'] * (1 - tolerance):
+        regressions.append(
+            f"throughput {results['throughput_rps']:.1f} rps < baseline {baseline['throughput_rps']:.1f} rps"
+        )
+    for route, stats in results['routes'].items():
+        previous = baseline.get('routes', {}).get(route)
+        if (previous and stats['p95_ms'] > previous['p95_ms'] * (1 + tolerance)
+                and stats['p95_ms'] - previous['p95_ms'] > min_delta_ms):
+            regressions.append(f"{route} p95 {stats['p95_ms']:.1f} ms > baseline {previous['p95_ms']:.1f} ms")
+    return regressions
+
+def print_report(results):
+    print(f"{results['requests']} requests in {results['elapsed_s']:.1f}s "
+          f"({results['throughput_rps']:.1f} req/s), {results['errors']} errors, {results['shed']} shed (503)")
+    print(f"{'route':<28}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'fallback':>10}")
+    for route, stats in results['routes'].items():
+        print(f"{route:<28}{stats['count']:>7}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}"
+              f"{stats['p99_ms']:>10.1f}{stats['fallback_share']:>9.0%}")
+    cache = results['cache']
+    upstream = results['upstream']
+    print(f"cache: {cache['hit_ratio']:.1%} hit ratio ({cache['hits']} hits, {cache['misses']} misses, "
+          f"{cache['single_flight_hits']} single-flight reuses)")
+    print(f"upstream: {upstream['calls']} calls, {upstream['rate_limited']} rate-limited, "
+          f"{upstream['bytes_sent']} bytes sent, {upstream['bytes_registered']} bytes of system instructions registered")
+    for model, stats in sorted(upstream['per_model'].items()):
+        print(f"  {model}: {stats['calls']} calls, {stats['bytes_sent'] // max(stats['calls'], 1)} bytes/call")
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline API benchmark with a fake Gemini model')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency', default='lognormal:0.4,0.5', help='fixed:S | uniform:A,B | lognormal:MEDIAN,SIGMA')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='Fraction of upstream calls answered with 429')
+    parser.add_argument('--retry-delay', type=float, default=0.1, help='Base retry backoff in seconds (production: 2)')
+    parser.add_argument('--cache-backend', choices=['file', 'sqlite'], default='sqlite')
+    parser.add_argument('--admit-llm', type=int, help='LLM-bound in-flight limit (default: no admission control)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', help='Write results as JSON to this path')
+    parser.add_argument('--baseline', help='Previous results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    out_path = os.path.abspath(args.out) if args.out else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    fake = FakeGeminiModel(
+        latency=LatencyModel.parse(args.latency, seed=args.seed),
+        rate_limit_rate=args.rate_limit,
+        seed=args.seed
+    )
+    workdir = tempfile.mkdtemp(prefix='bench_api_')
+    try:
+        app, counters = prepare_app(fake, workdir, args.cache_backend, args.retry_delay, args.admit_llm)
+        workload = build_workload(args.requests, args.seed)
+        records, elapsed = run(workload, args.concurrency, app)
+    finally:
+        os.chdir(os.path.dirname(workdir))
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = summarize(records, elapsed, counters, fake)
+    results['config'] = {
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'latency': str(fake.latency),
+        'rate_limit': args.rate_limit,
+        'retry_delay': args.retry_delay,
+        'cache_backend': args.cache_backend,
+        'seed': args.seed
+    }
+    print_report(results)
+
+    if out_path:
+        with open(out_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Microbenchmark: legacy JSON cache records vs the compact binary format
+
+    cd backend && python -m benchmarks.bench_cache [--entries 500]
+
+Compares per-lookup key derivation CPU, set/get latency and on-disk size for
+realistic prompt/response sizes. Logging defaults to ERROR: the compact path emits a
+cache_write/cache_hit event per call that the legacy helpers do not, which would time
+stdout rather than the record format.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import string
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+# Must precede the utils imports: logging is configured on first get_logger()
+os.environ.setdefault('HEALTHFLOW_LOG_LEVEL', 'ERROR')
+
+from utils.cache import SimpleCache, derive_cache_key
+
+def _legacy_key(data):
+    return hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+def _legacy_set(cache_dir, data, response):
+    with open(cache_dir / f"{_legacy_key(data)}.json", 'w') as f:
+        json.dump({
+            'timestamp': datetime.now().isoformat(),
+            'input': data,
+            'response': response
+        }, f, indent=2)
+
+def _legacy_get(cache_dir, data):
+    with open(cache_dir / f"{_legacy_key(data)}.json", 'r') as f:
+        cached = json.load(f)
+    datetime.fromisoformat(cached['timestamp'])
+    return cached['response']
+
+def _text(n_words, rng):
+    words = ['squat', 'recovery', 'HRV', 'baseline', 'constraint', 'pivoting', 'sets', 'reps',
+             'warm-up', 'intensity', 'medical', 'safe', 'avoid', 'progression', 'week']
+    return ' '.join(rng.choice(words) for _ in range(n_words))
+
+def make_entries(count, seed=42):
+    """Workout-generation sized prompts (~4KB) and responses (~3KB)"""
+    rng = random.Random(seed)
+    entries = []
+    for i in range(count):
+        prompt = f"Generate a workout plan #{i}\n" + _text(600, rng)
+        data = {
+            'prompt': prompt,
+            'system_instruction': 'You are a workout programming expert. ' + _text(60, rng),
+            'type': 'thinking'
+        }
+        response = {'success': True, 'response': _text(450, rng) + ''.join(rng.choices(string.digits, k=20))}
+        entries.append((data, response))
+    return entries
+
+def _per_op_us(start, count):
+    return (time.perf_counter() - start) / count * 1_000_000
+
+def _dir_size(path):
+    return sum(f.stat().st_size for f in Path(path).iterdir() if f.is_file())
+
+def run(entries_count):
+    entries = make_entries(entries_count)
+    results = {}
+    workdir = Path(tempfile.mkdtemp(prefix='bench_cache_'))
+    try:
+        # Key derivation only
+        start = time.perf_counter()
+        for data, _ in entries:
+            _legacy_key(data)
+        results['legacy_key_us'] = _per_op_us(start, len(entries))
+
+        start = time.perf_counter()
+        for data, _ in entries:
+            derive_cache_key(data)
+        results['compact_key_us'] = _per_op_us(start, len(entries))
+
+        # Legacy file format
+        legacy_dir = workdir / 'legacy'
+        legacy_dir.mkdir()
+        start = time.perf_counter()
+        for data, response in entries:
+            _legacy_set(legacy_dir, data, response)
+        results['legacy_set_us'] = _per_op_us(start, len(entries))
+        start = time.perf_counter()
+        for data, _ in entries:
+            _legacy_get(legacy_dir, data)
+        results['legacy_get_us'] = _per_op_us(start, len(entries))
+        results['legacy_bytes'] = _dir_size(legacy_dir)
+
+        # Compact binary format
+        cache = SimpleCache(cache_dir=workdir / 'compact')
+        start = time.perf_counter()
+        for data, response in entries:
+            cache.set(data, response)
+        results['compact_set_us'] = _per_op_us(start, len(entries))
+        start = time.perf_counter()
+        for data, response in entries:
+            assert cache.get(data) == response
+        results['compact_get_us'] = _per_op_us(start, len(entries))
+        results['compact_bytes'] = _dir_size(workdir / 'compact')
+    finally:
+        shutil.rmtree(workdir)
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Cache record format microbenchmark')
+    parser.add_argument('--entries', type=int, default=500)
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args = parser.parse_args()
+
+    results = run(args.entries)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'':<18}{'legacy':>12}{'compact':>12}{'ratio':>8}")
+    for label, key, unit in [
+        ('key derivation', 'key_us', 'µs'),
+        ('set', 'set_us', 'µs'),
+        ('get', 'get_us', 'µs'),
+        ('disk size', 'bytes', 'B')
+    ]:
+        legacy = results[f'legacy_{key}']
+        compact = results[f'compact_{key}']
+        print(f"{label + ' (' + unit + ')':<18}{legacy:>12.1f}{compact:>12.1f}{legacy / compact:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Cold-start benchmark: `import main` time (-X importtime) against a budget
+
+    cd backend && python -m benchmarks.bench_import [--runs 5] [--budget-ms 500]
+
+Each run is a fresh interpreter, as on a serverless cold start. Reports the median
+cumulative import time of main, the slowest imports, and the time until a first
+/api/health response. Exits non-zero if the median exceeds the budget or if importing
+main pulled in a module that must stay lazy (the Gemini and Opik SDKs).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Imported on first use only; importing main must not load them
+LAZY_MODULES = ['google.generativeai', 'opik']
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+app = main.create_app()
+response = app.test_client().get('/api/health')
+assert response.status_code == 200
+done = time.perf_counter()
+print('RESULT ' + json.dumps({{
+    'lazy_loaded': [m for m in {lazy!r} if m in sys.modules],
+    'import_s': imported - start,
+    'first_response_s': done - start
+}}))
+"""
+
+def _run_once():
+    env = dict(os.environ, HEALTHFLOW_LOG_LEVEL='ERROR')
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE.format(lazy=LAZY_MODULES)],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr[-2000:])
+
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    imports = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace('import time:', '|', 1).split('|')]
+        imports.append((name.strip(), int(self_us), int(cumulative_us)))
+
+    result_line = next(line for line in completed.stdout.splitlines() if line.startswith('RESULT '))
+    probe = json.loads(result_line[len('RESULT '):])
+    main_us = next(cumulative for name, _, cumulative in imports if name == 'main')
+    return {
+        'main_import_ms': main_us / 1000,
+        'wall_import_ms': probe['import_s'] * 1000,
+        'first_health_response_ms': probe['first_response_s'] * 1000,
+        'lazy_modules_loaded': probe['lazy_loaded'],
+        'imports': imports
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Import-time / cold-start benchmark')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=500.0, help='Budget for the median import of main')
+    parser.add_argument('--top', type=int, default=10, help='Slowest imports to list')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args = parser.parse_args()
+
+    runs = [_run_once() for _ in range(args.runs)]
+    median_import = statistics.median(r['main_import_ms'] for r in runs)
+    median_first = statistics.median(r['first_health_response_ms'] for r in runs)
+    lazy_loaded = sorted({m for r in runs for m in r['lazy_modules_loaded']})
+
+    # Slowest imports (cumulative, so packages include their submodules) in the last run
+    slowest = sorted(
+        ((name.strip(), cumulative / 1000) for name, _, cumulative in runs[-1]['imports'] if name.strip() != 'main'),
+        key=lambda item: item[1], reverse=True
+    )[:args.top]
+
+    results = {
+        'runs': args.runs,
+        'budget_ms': args.budget_ms,
+        'median_main_import_ms': median_import,
+        'median_first_health_response_ms': median_first,
+        'lazy_modules_loaded': lazy_loaded,
+        'slowest_imports_ms': dict(slowest),
+        'within_budget': median_import <= args.budget_ms and not lazy_loaded
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"import main: {median_import:.1f} ms median over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+        print(f"first /api/health response: {median_first:.1f} ms after the start of the import")
+        print('slowest imports (cumulative ms):')
+        for name, ms in slowest:
+            print(f"  {ms:>8.1f}  {name}")
+        if lazy_loaded:
+            print(f"FAIL: importing main loaded {', '.join(lazy_loaded)} - these must stay lazy")
+        if median_import > args.budget_ms:
+            print(f"FAIL: import time over budget by {median_import - args.budget_ms:.1f} ms")
+
+    if not results['within_budget']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Microbenchmark: stdlib json vs the fast JSON path (orjson when installed)
+
+    cd backend && python -m benchmarks.bench_json [--iterations 2000]
+
+Uses large nested workout/analysis payloads (orchestration results with embedded
+HRV, medical and nutrition outputs) and times the hot paths: Flask response
+serialization, request parsing, cache record JSON encode+decode (before compression)
+and Opik trace sanitizing (the old recursive copy vs the single-pass check).
+"""
+import argparse
+import json
+import random
+import time
+
+from utils import fast_json
+
+def _legacy_sanitize(data):
+    if isinstance(data, dict):
+        return {k: _legacy_sanitize(v) for k, v in data.items()}
+    elif isinstance(data, list):
+        return [_legacy_sanitize(item) for item in data]
+    elif isinstance(data, (str, int, float, bool, type(None))):
+        return data
+    else:
+        return str(data)
+
+def _fast_sanitize(data):
+    try:
+        fast_json.dumps_bytes(data)
+        return data
+    except TypeError:
+        return fast_json.loads(fast_json.dumps_bytes(data, default=str))
+
+def _text(n_words, rng):
+    words = ['squat', 'recovery', 'HRV', 'baseline', 'constraint', 'pivoting', 'sets', 'reps',
+             'warm-up', 'intensity', 'medical', 'safe', 'avoid', 'progression', 'week', 'protein']
+    return ' '.join(rng.choice(words) for _ in range(n_words))
+
+def make_payload(rng):
+    """One orchestrated workout result (~15KB of JSON)"""
+    return {
+        'success': True,
+        'response': _text(500, rng),
+        'fallback': False,
+        'hrv': {
+            'hrv_data': [
+                {'date': f'2026-10-{day:02d}', 'hrv_ms': rng.uniform(40, 60), 'baseline_hrv': 55,
+                 'resting_hr': rng.randint(55, 72), 'sleep_hours': rng.uniform(5.5, 8.5)}
+                for day in range(1, 29)
+            ],
+            'analysis': {'success': True, 'response': _text(250, rng)}
+        },
+        'medical': {
+            'constraints': {
+                section: [_text(8, rng) for _ in range(6)]
+                for section in ('avoid', 'safe', 'progression', 'medications')
+            },
+            'protocol_phase': {'name': 'Strengthening', 'start_week': 8, 'next_transition_week': 12}
+        },
+        'exercises': [
+            {'name': _text(2, rng), 'sets': rng.randint(2, 4), 'reps': rng.randint(8, 15),
+             'rest_s': rng.choice([30, 60, 90]), 'rationale': _text(30, rng),
+             'constraints_respected': [_text(3, rng) for _ in range(3)]}
+            for _ in range(7)
+        ],
+        'nutrition': {
+            'nutritional_analysis': _text(200, rng),
+            'medication_interactions': [
+                {'medication': 'warfarin', 'food': 'spinach', 'severity': 'moderate', 'message': _text(20, rng)}
+            ],
+            'safe_to_consume': True
+        }
+    }
+
+def _per_op_us(func, payloads, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        func(payloads[i % len(payloads)])
+    return (time.perf_counter() - start) / iterations * 1_000_000
+
+def run(iterations):
+    rng = random.Random(42)
+    payloads = [make_payload(rng) for _ in range(20)]
+    encoded = [fast_json.dumps_bytes(p) for p in payloads]
+    results = {
+        'backend': 'orjson' if fast_json.orjson is not None else 'stdlib',
+        'payload_bytes': sum(len(e) for e in encoded) // len(encoded)
+    }
+
+    results['response_stdlib_us'] = _per_op_us(
+        lambda p: json.dumps(p, separators=(',', ':')).encode(), payloads, iterations)
+    results['response_fast_us'] = _per_op_us(fast_json.dumps_bytes, payloads, iterations)
+
+    results['parse_stdlib_us'] = _per_op_us(json.loads, encoded, iterations)
+    results['parse_fast_us'] = _per_op_us(fast_json.loads, encoded, iterations)
+
+    results['cache_roundtrip_stdlib_us'] = _per_op_us(
+        lambda p: json.loads(json.dumps({'response': p}, separators=(',', ':')).encode())['response'],
+        payloads, iterations)
+    results['cache_roundtrip_fast_us'] = _per_op_us(
+        lambda p: fast_json.loads(fast_json.dumps_bytes({'response': p}))['response'],
+        payloads, iterations)
+
+    results['sanitize_stdlib_us'] = _per_op_us(_legacy_sanitize, payloads, iterations)
+    results['sanitize_fast_us'] = _per_op_us(_fast_sanitize, payloads, iterations)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON serialization microbenchmark')
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args = parser.parse_args()
+
+    results = run(args.iterations)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"fast path: {results['backend']}, payload ~{results['payload_bytes']} bytes")
+    print(f"{'':<28}{'stdlib':>12}{'fast':>12}{'ratio':>8}")
+    for label, key in [
+        ('response dumps (µs)', 'response'),
+        ('request loads (µs)', 'parse'),
+        ('cache record set+get (µs)', 'cache_roundtrip'),
+        ('opik sanitize (µs)', 'sanitize')
+    ]:
+        stdlib = results[f'{key}_stdlib_us']
+        fast = results[f'{key}_fast_us']
+        print(f"{label:<28}{stdlib:>12.1f}{fast:>12.1f}{stdlib / fast:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""
+Local stand-in for the Gemini API, for offline benchmarks and traffic replay
+
+    from benchmarks.fake_gemini import FakeGeminiModel, LatencyModel
+    from utils.gemini_client import use_model_factory
+
+    fake = FakeGeminiModel(latency=LatencyModel.parse('lognormal:0.4,0.5'), rate_limit_rate=0.05)
+    use_model_factory(fake.for_model)
+
+Every client built afterwards calls the fake instead of the API. The fake sleeps for
+a latency drawn from the configured distribution, raises 429-style errors at the
+configured rate, and answers with canned REASONING/DECISION/EXPLANATION text (or
+JSON for parse_json_response prompts). It counts calls and bytes per model; like a
+current SDK it accepts a system_instruction per model, sent once (bytes_registered)
+rather than with every call.
+"""
+import json
+import random
+import threading
+import time
+
+class LatencyModel:
+    """
+    Upstream latency distribution, in seconds
+
+    fixed:0.5            always 0.5s
+    uniform:0.2,1.5      uniform between 0.2s and 1.5s
+    lognormal:0.4,0.5    median 0.4s, sigma 0.5 (long right tail, like real LLM calls)
+    """
+    def __init__(self, kind='fixed', params=(0.0,), seed=None):
+        self.kind = kind
+        self.params = params
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, spec, seed=None):
+        kind, _, args = spec.partition(':')
+        params = tuple(float(p) for p in args.split(',')) if args else (0.0,)
+        if kind not in ('fixed', 'uniform', 'lognormal'):
+            raise ValueError(f'unknown latency distribution: {kind}')
+        return cls(kind, params, seed)
+
+    def sample(self):
+        with self._lock:
+            if self.kind == 'uniform':
+                return self._rng.uniform(self.params[0], self.params[1])
+            if self.kind == 'lognormal':
+                median, sigma = self.params[0], self.params[1] if len(self.params) > 1 else 0.5
+                return median * self._rng.lognormvariate(0, sigma)
+            return self.params[0]
+
+    def __str__(self):
+        return f"{self.kind}:{','.join(str(p) for p in self.params)}"
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+CANNED_THINKING = """REASONING:
+1. Reviewed the provided data against the stated constraints
+2. Current state is within the expected range for this stage of recovery
+3. Selected options that respect every restriction listed
+
+DECISION:
+Proceed with a moderate session: squats 3x10, glute bridges 3x12, step-ups 3x8,
+wall sits 3x30s, side-lying leg raises 2x15. Intensity adjustment: -10%.
+
+EXPLANATION:
+The plan keeps load moderate and avoids restricted movements while still
+making progress. Reassess tomorrow with fresh recovery data.
+"""
+
+CANNED_WORKOUT = """REASONING:
+1. Constraints and recovery state reviewed before choosing exercises
+
+DECISION:
+WORKOUT PLAN:
+Warm-up: 5 minutes easy cycling
+1. Goblet Squat: 3 sets × 10 reps
+2. Glute Bridge: 3 sets × 12 reps
+3. Dumbbell Row: 3 sets × 10 reps
+4. Wall Sit: 2 sets × 30s reps
+5. Side-Lying Leg Raise: 2 sets × 15 reps
+Cool-down: 5 minutes stretching
+
+REASONING FOR EACH EXERCISE:
+1. Goblet Squat: controlled knee flexion without pivoting
+
+EXPLANATION:
+Moderate volume matched to the reported recovery.
+"""
+
+CANNED_JSON = {
+    'avoid': ['pivoting', 'jumping'],
+    'safe': ['stationary bike', 'straight-leg raises'],
+    'progression': ['add resistance when pain-free'],
+    'medications': []
+}
+
+# Answer to the weekly plan prompt (WorkoutOrchestratorAgent.generate_weekly_plan)
+CANNED_WEEK = {
+    'days': [
+        {'day': day, 'focus': focus, 'intensity': intensity, 'exercises': [
+            {'name': name, 'sets': sets, 'reps': '10-12', 'reason': 'Controlled, constraint-safe movement'}
+            for name in ('Leg Press', 'Hamstring Curls', 'Plank Hold', 'Seated Row')
+        ] if sets else []}
+        for day, (focus, intensity, sets) in enumerate([
+            ('Strength', 'moderate', 3), ('Mobility', 'low', 2), ('Strength', 'high', 4),
+            ('Active recovery', 'low', 2), ('Strength', 'moderate', 3), ('Conditioning', 'moderate', 3),
+            ('Rest', 'rest', 0)
+        ], 1)
+    ]
+}
+
+class FakeGeminiModel:
+    """
+    Drop-in for genai.GenerativeModel.generate_content with injected latency and 429s
+    One instance can serve every model name (see for_model); counters are per model
+    """
+    def __init__(self, latency=None, rate_limit_rate=0.0, seed=None, thinking_text=CANNED_THINKING):
+        self.latency = latency or LatencyModel()
+        self.rate_limit_rate = rate_limit_rate
+        self.thinking_text = thinking_text
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    def for_model(self, model_name, system_instruction=None):
+        """Model factory for utils.gemini_client.use_model_factory"""
+        if system_instruction is not None:
+            self._count(model_name, 'bytes_registered', len(system_instruction.encode()))
+        return _BoundFakeModel(self, model_name, system_instruction)
+
+    def _count(self, model_name, field, amount=1):
+        with self._lock:
+            model_stats = self.stats.setdefault(model_name, {
+                'calls': 0, 'rate_limited': 0, 'bytes_sent': 0, 'bytes_received': 0, 'bytes_registered': 0
+            })
+            model_stats[field] += amount
+
+    def generate_content(self, contents, model_name='fake', system_instruction=None, **kwargs):
+        prompt = contents if isinstance(contents, str) else json.dumps(contents, default=str)
+        self._count(model_name, 'calls')
+        self._count(model_name, 'bytes_sent', len(prompt.encode()))
+        # The canned answer depends on the whole request, registered part included
+        prompt = f"{system_instruction or ''}\n{prompt}"
+
+        time.sleep(self.latency.sample())
+
+        with self._lock:
+            rate_limited = self._rng.random() < self.rate_limit_rate
+        if rate_limited:
+            self._count(model_name, 'rate_limited')
+            raise Exception('429 Resource has been exhausted (e.g. check quota).')
+
+        if 'Respond ONLY with valid JSON' in prompt and '7-day periodized' in prompt:
+            text = json.dumps(CANNED_WEEK)
+        elif 'Respond ONLY with valid JSON' in prompt:
+            text = json.dumps(CANNED_JSON)
+        elif 'Generate a workout plan' in prompt:
+            text = CANNED_WORKOUT
+        else:
+            text = self.thinking_text
+        self._count(model_name, 'bytes_received', len(text.encode()))
+        return FakeResponse(text)
+
+    def totals(self):
+        with self._lock:
+            totals = {'calls': 0, 'rate_limited': 0, 'bytes_sent': 0, 'bytes_received': 0, 'bytes_registered': 0}
+            for model_stats in self.stats.values():
+                for field, value in model_stats.items():
+                    totals[field] += value
+            return {**totals, 'per_model': {name: dict(s) for name, s in self.stats.items()}}
+
+class _BoundFakeModel:
+    def __init__(self, fake, model_name, system_instruction=None):
+        self.fake = fake
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    def generate_content(self, contents, **kwargs):
+        return self.fake.generate_content(
+            contents, model_name=self.model_name, system_instruction=self.system_instruction, **kwargs
+        )
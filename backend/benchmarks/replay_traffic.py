@@ -0,0 +1,155 @@
+"""
+Replay recorded API traffic against the backend with a local Gemini stand-in
+
+    # record (any server): HEALTHFLOW_RECORD_PATH=requests.jsonl gunicorn -c gunicorn.conf.py wsgi:app
+    cd backend && python -m benchmarks.replay_traffic requests.jsonl [--speed 1]
+        [--model open|closed] [--concurrency 32] [--latency lognormal:0.4,0.5] [--out results.json]
+
+--model open (default) sends each request at its recorded offset divided by --speed,
+whether or not earlier ones finished - bursts arrive as bursts. --concurrency is then
+the number of request threads serving them (gunicorn workers x threads), and time spent
+waiting for a free thread is reported as queue wait: if it grows, add workers.
+--speed 0 sends everything at once.
+
+--model closed ignores timestamps: --concurrency clients send the recorded requests
+back to back, which gives peak throughput for the recorded mix.
+
+Reports the same figures as bench_api (latency per route, cache hit ratio, upstream
+calls), so cache capacity and hit ratio can be read off real traffic shapes.
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.bench_api import prepare_app, send, summarize, print_report, run, percentile
+from benchmarks.fake_gemini import FakeGeminiModel, LatencyModel
+
+def load_recording(path):
+    """Recorded requests as (ts, method, path, body), oldest first"""
+    requests = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if 'path' not in record:
+                continue
+            requests.append((
+                float(record.get('ts', 0.0)),
+                record.get('method', 'POST' if record.get('body') is not None else 'GET'),
+                record['path'],
+                record.get('body')
+            ))
+    requests.sort(key=lambda r: r[0])
+    return requests
+
+def replay_open(recording, app, speed, concurrency):
+    """
+    Dispatch each request at its (scaled) recorded time onto a pool of `concurrency`
+    threads; returns (records, queue waits, elapsed)
+    """
+    records = []
+    waits = []
+    lock = threading.Lock()
+    local = threading.local()
+
+    def execute(scheduled_at, method, path, body):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        wait = time.perf_counter() - scheduled_at
+        status, seconds, fallback, deadline = send(client, method, path, body)
+        with lock:
+            # Latency as the caller sees it: time queued for a thread plus service time
+            records.append((f'{method} {path}', status, wait + seconds, fallback, deadline))
+            waits.append(wait)
+
+    first_ts = recording[0][0] if recording else 0.0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for ts, method, path, body in recording:
+            offset = (ts - first_ts) / speed if speed else 0.0
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(execute, start + offset, method, path, body)
+    return records, waits, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded traffic against a fake Gemini model')
+    parser.add_argument('recording', help='JSON-lines file written with HEALTHFLOW_RECORD_PATH')
+    parser.add_argument('--speed', type=float, default=1.0, help='Time compression: 1 = real time, 10 = 10x faster, 0 = all at once')
+    parser.add_argument('--model', choices=['open', 'closed'], default='open')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--latency', default='lognormal:0.4,0.5', help='fixed:S | uniform:A,B | lognormal:MEDIAN,SIGMA')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='Fraction of upstream calls answered with 429')
+    parser.add_argument('--retry-delay', type=float, default=0.1, help='Base retry backoff in seconds (production: 2)')
+    parser.add_argument('--cache-backend', choices=['file', 'sqlite'], default='sqlite')
+    parser.add_argument('--admit-llm', type=int, help='LLM-bound in-flight limit (default: no admission control)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    recording = load_recording(args.recording)
+    if not recording:
+        parser.error(f'no requests found in {args.recording}')
+    out_path = os.path.abspath(args.out) if args.out else None
+
+    fake = FakeGeminiModel(
+        latency=LatencyModel.parse(args.latency, seed=args.seed),
+        rate_limit_rate=args.rate_limit,
+        seed=args.seed
+    )
+    workdir = tempfile.mkdtemp(prefix='replay_')
+    waits = []
+    try:
+        app, counters = prepare_app(fake, workdir, args.cache_backend, args.retry_delay, args.admit_llm)
+        if args.model == 'open':
+            records, waits, elapsed = replay_open(recording, app, args.speed, args.concurrency)
+        else:
+            records, elapsed = run([r[1:] for r in recording], args.concurrency, app)
+    finally:
+        os.chdir(os.path.dirname(workdir))
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = summarize(records, elapsed, counters, fake)
+    recorded_span = recording[-1][0] - recording[0][0]
+    results['config'] = {
+        'recording': os.path.abspath(args.recording),
+        'recorded_span_s': recorded_span,
+        'speed': args.speed,
+        'model': args.model,
+        'concurrency': args.concurrency,
+        'latency': str(fake.latency),
+        'rate_limit': args.rate_limit,
+        'cache_backend': args.cache_backend
+    }
+    if waits:
+        ordered = sorted(waits)
+        results['queue_wait'] = {
+            'p50_ms': percentile(ordered, 0.50) * 1000,
+            'p95_ms': percentile(ordered, 0.95) * 1000,
+            'p99_ms': percentile(ordered, 0.99) * 1000
+        }
+
+    print_report(results)
+    if 'queue_wait' in results:
+        wait = results['queue_wait']
+        print(f"queue wait: p50 {wait['p50_ms']:.1f} ms, p95 {wait['p95_ms']:.1f} ms, p99 {wait['p99_ms']:.1f} ms "
+              f"with {args.concurrency} request threads")
+
+    if out_path:
+        with open(out_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
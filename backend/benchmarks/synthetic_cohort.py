@@ -0,0 +1,262 @@
+"""
+Seeded synthetic cohort generator for scale tests (requires numpy)
+
+    cd backend && python -m benchmarks.synthetic_cohort --users 100000 --days 28 --seed 7 --out cohort/
+    cd backend && python -m benchmarks.synthetic_cohort --users 100000 --format columnar --out cohort/
+
+Writes a users table (surgery timeline, restrictions, medications) and a user-days
+table (HRV readings in the /api/hrv/samples shape, plus a meal and the ground-truth
+episode). Per-user baselines vary, HRV and sleep follow a weekly training cycle, and
+illness and overtraining episodes suppress HRV and raise resting HR for days at a time.
+
+Users are generated in chunks of CHUNK_USERS with every column computed as a NumPy
+array, so memory stays flat for millions of user-days. The same --seed, --users,
+--days and --start always produce identical files.
+
+ndjson: users.ndjson and days.ndjson, one JSON object per line
+columnar: users-NNNNN.npz and days-NNNNN.npz per chunk, one array per column
+(np.load without pickle). String columns are int16 codes into a <name>_values array;
+list columns are ';'-joined strings and user_id is the integer N of "uN".
+"""
+import argparse
+import os
+import sys
+import time
+
+from data.common_profiles import COMMON_PROFILES
+from data.interaction_graph import INTERACTION_GRAPH
+
+# Users per generated chunk (part of the output's identity: changing it changes the data)
+CHUNK_USERS = 50_000
+
+# Episode starts per user-day, and (min, max) length in days
+ILLNESS_RATE = 0.004
+ILLNESS_DAYS = (3, 7)
+OVERTRAINING_RATE = 0.003
+OVERTRAINING_DAYS = (5, 14)
+EPISODES = ['none', 'illness', 'overtraining']
+
+# Share of users per surgery (the rest have none)
+SURGERY_SHARE = 0.6
+# Medication lists and their weights: mostly none, with some polypharmacy
+MEDICATION_SETS = [
+    ([], 0.55),
+    (['warfarin'], 0.1),
+    (['atorvastatin'], 0.08),
+    (['levothyroxine'], 0.06),
+    (['ibuprofen'], 0.06),
+    (['oxycodone', 'gabapentin'], 0.04),
+    (['warfarin', 'atorvastatin', 'ciprofloxacin'], 0.04),
+    (['apixaban', 'aspirin', 'sertraline'], 0.03),
+    (['warfarin', 'simvastatin', 'clarithromycin', 'acetaminophen', 'metronidazole'], 0.04)
+]
+MEALS = [
+    'grilled chicken, brown rice, broccoli',
+    'salmon, quinoa, spinach salad',
+    'greek yogurt, berries, walnuts',
+    'oatmeal, banana, coffee',
+    'turkey sandwich, apple',
+    'tofu stir fry, rice, kale',
+    'eggs, toast, orange juice',
+    'pasta, tomato sauce, glass of wine',
+    'grapefruit, cottage cheese',
+    'lentil soup, bread, milk'
+]
+
+def _require_numpy():
+    try:
+        import numpy
+    except ImportError:
+        sys.exit('synthetic_cohort needs numpy: pip install numpy')
+    return numpy
+
+def _surgery_options():
+    """[(surgery, weeks range, restriction sets)] from the common profiles config"""
+    return [
+        (surgery, spec['weeks_post_op'], spec['restriction_sets'])
+        for surgery, spec in COMMON_PROFILES.items()
+    ]
+
+def generate_chunk(np, seed, chunk_index, first_user, n_users, days, start):
+    """(users, days) column dicts for users first_user..first_user+n_users-1"""
+    rng = np.random.default_rng([seed, chunk_index])
+    user_ids = np.arange(first_user, first_user + n_users)
+
+    # Per-user baselines
+    baseline_hrv = np.clip(rng.lognormal(np.log(55), 0.3, n_users), 20, 120).round(1)
+    baseline_rhr = np.clip(rng.normal(60, 6, n_users), 42, 85)
+    baseline_sleep = np.clip(rng.normal(7.2, 0.6, n_users), 5, 9.5)
+    # Hard training day of the week (HRV dips the day after)
+    training_phase = rng.integers(0, 7, n_users)
+
+    # Surgery timelines: weeks post-op on the first day, a restriction set from the profile
+    options = _surgery_options()
+    has_surgery = rng.random(n_users) < SURGERY_SHARE
+    surgery_index = rng.integers(0, len(options), n_users)
+    surgery = np.array([name for name, _, _ in options])[surgery_index]
+    weeks_low = np.array([weeks.start for _, weeks, _ in options])[surgery_index]
+    weeks_high = np.array([weeks.stop for _, weeks, _ in options])[surgery_index]
+    start_weeks = rng.integers(weeks_low, weeks_high)
+    surgery_date = np.datetime64(start) - (start_weeks * 7 + rng.integers(0, 7, n_users)).astype('timedelta64[D]')
+    restrictions = np.array([
+        ';'.join(restriction_set) for _, _, sets in options for restriction_set in sets
+    ])
+    restriction_offsets = np.cumsum([0] + [len(sets) for _, _, sets in options[:-1]])
+    restriction_counts = np.array([len(sets) for _, _, sets in options])
+    restriction_index = restriction_offsets[surgery_index] + (
+        rng.random(n_users) * restriction_counts[surgery_index]
+    ).astype(np.int64)
+
+    medication_weights = np.array([weight for _, weight in MEDICATION_SETS])
+    medication_index = rng.choice(len(MEDICATION_SETS), n_users, p=medication_weights / medication_weights.sum())
+    medications = np.array([';'.join(meds) for meds, _ in MEDICATION_SETS])
+
+    users = {
+        'user_id': user_ids,
+        'surgery': np.where(has_surgery, surgery, ''),
+        'surgery_date': np.where(has_surgery, surgery_date, np.datetime64('NaT')),
+        'restrictions': np.where(has_surgery, restrictions[restriction_index], ''),
+        'medications': medications[medication_index],
+        'baseline_hrv': baseline_hrv
+    }
+
+    # User-days: one vectorized step per day across the whole chunk
+    hrv = np.empty((days, n_users))
+    rhr = np.empty((days, n_users))
+    sleep = np.empty((days, n_users))
+    episode = np.zeros((days, n_users), dtype=np.int8)
+    illness_left = np.zeros(n_users, dtype=np.int32)
+    overtraining_left = np.zeros(n_users, dtype=np.int32)
+    noise = np.zeros(n_users)
+    weekday_start = int((np.datetime64(start).astype('datetime64[D]').astype(np.int64) + 3) % 7)
+
+    for day in range(days):
+        idle = (illness_left == 0) & (overtraining_left == 0)
+        new_illness = idle & (rng.random(n_users) < ILLNESS_RATE)
+        new_overtraining = idle & ~new_illness & (rng.random(n_users) < OVERTRAINING_RATE)
+        illness_left[new_illness] = rng.integers(ILLNESS_DAYS[0], ILLNESS_DAYS[1] + 1, new_illness.sum())
+        overtraining_left[new_overtraining] = rng.integers(
+            OVERTRAINING_DAYS[0], OVERTRAINING_DAYS[1] + 1, new_overtraining.sum()
+        )
+        ill = illness_left > 0
+        overtrained = overtraining_left > 0
+
+        # AR(1) day-to-day noise, weekly cycle (dip the day after the hard session)
+        noise = 0.6 * noise + rng.normal(0, 0.06, n_users)
+        weekday = (weekday_start + day) % 7
+        after_hard_day = weekday == (training_phase + 1) % 7
+        weekend = weekday >= 5
+
+        hrv_factor = np.exp(noise) * np.where(after_hard_day, 0.92, 1.0)
+        hrv_factor *= np.where(ill, 0.75, 1.0) * np.where(overtrained, 0.85, 1.0)
+        hrv[day] = baseline_hrv * hrv_factor
+        rhr[day] = (baseline_rhr + rng.normal(0, 2, n_users) + np.where(after_hard_day, 2, 0)
+                    + np.where(ill, 6, 0) + np.where(overtrained, 4, 0))
+        sleep[day] = (baseline_sleep + rng.normal(0, 0.5, n_users) + np.where(weekend, 0.5, 0)
+                      + np.where(ill, 0.5, 0) - np.where(overtrained, 0.7, 0))
+        episode[day] = np.where(ill, 1, np.where(overtrained, 2, 0))
+
+        illness_left[ill] -= 1
+        overtraining_left[overtrained] -= 1
+
+    # Day-major arrays -> user-major rows (each user's days are contiguous)
+    dates = (np.datetime64(start) + np.arange(days)).astype('datetime64[D]')
+    days_table = {
+        'user_id': np.repeat(user_ids, days),
+        'date': np.tile(dates, n_users),
+        'hrv_ms': hrv.T.ravel().round(1),
+        'baseline_hrv': np.repeat(baseline_hrv, days),
+        'resting_hr': rhr.T.ravel().round().astype(np.int32),
+        'sleep_hours': np.clip(sleep.T.ravel(), 3, 11).round(1),
+        'meal': np.array(MEALS)[rng.integers(0, len(MEALS), n_users * days)],
+        'episode': np.array(EPISODES)[episode.T.ravel()]
+    }
+    return users, days_table
+
+def _json_str(value):
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def write_ndjson(users, days_table, users_file, days_file):
+    """Append a chunk as JSON lines (columns converted to Python lists once, then formatted)"""
+    surgery_dates = users['surgery_date'].astype(str).tolist()
+    user_lines = [
+        '{"user_id":"u%d","surgery":%s,"surgery_date":%s,"restrictions":[%s],"medications":[%s],"baseline_hrv":%s}' % (
+            user_id,
+            _json_str(surgery) if surgery else 'null',
+            _json_str(surgery_date) if surgery_date != 'NaT' else 'null',
+            ','.join(_json_str(r) for r in restrictions.split(';') if r),
+            ','.join(_json_str(m) for m in medications.split(';') if m),
+            baseline
+        )
+        for user_id, surgery, surgery_date, restrictions, medications, baseline in zip(
+            users['user_id'].tolist(), users['surgery'].tolist(), surgery_dates,
+            users['restrictions'].tolist(), users['medications'].tolist(), users['baseline_hrv'].tolist()
+        )
+    ]
+    users_file.write('\n'.join(user_lines) + '\n')
+
+    template = ('{"user_id":"u%d","date":"%s","hrv_ms":%s,"baseline_hrv":%s,"resting_hr":%d,'
+                '"sleep_hours":%s,"meal":"%s","episode":"%s"}')
+    columns = [days_table[name] for name in (
+        'user_id', 'date', 'hrv_ms', 'baseline_hrv', 'resting_hr', 'sleep_hours', 'meal', 'episode'
+    )]
+    columns[1] = columns[1].astype(str)
+    days_file.write('\n'.join(template % row for row in zip(*(column.tolist() for column in columns))) + '\n')
+
+def _encode_categories(np, table):
+    """String columns as int16 codes plus a <name>_values vocabulary (meals repeat millions of times)"""
+    encoded = {}
+    for name, column in table.items():
+        if column.dtype.kind == 'U':
+            values, codes = np.unique(column, return_inverse=True)
+            encoded[name] = codes.astype(np.int16)
+            encoded[f'{name}_values'] = values
+        else:
+            encoded[name] = column
+    return encoded
+
+def write_columnar(np, users, days_table, out_dir, chunk_index):
+    np.savez(os.path.join(out_dir, f'users-{chunk_index:05d}.npz'), **_encode_categories(np, users))
+    np.savez(os.path.join(out_dir, f'days-{chunk_index:05d}.npz'), **_encode_categories(np, days_table))
+
+def main():
+    parser = argparse.ArgumentParser(description='Seeded synthetic cohort generator')
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--days', type=int, default=28)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start', default='2026-01-05', help='First day (YYYY-MM-DD)')
+    parser.add_argument('--format', choices=['ndjson', 'columnar'], default='ndjson')
+    parser.add_argument('--out', default='cohort', help='Output directory')
+    args = parser.parse_args()
+
+    np = _require_numpy()
+    os.makedirs(args.out, exist_ok=True)
+    known = {drug for meds, _ in MEDICATION_SETS for drug in meds}
+    unknown = [drug for drug in known if INTERACTION_GRAPH.normalize(drug) is None]
+    if unknown:
+        sys.exit(f"Medications missing from the interaction graph: {', '.join(sorted(unknown))}")
+
+    start = time.perf_counter()
+    if args.format == 'ndjson':
+        users_file = open(os.path.join(args.out, 'users.ndjson'), 'w')
+        days_file = open(os.path.join(args.out, 'days.ndjson'), 'w')
+
+    for chunk_index, first_user in enumerate(range(0, args.users, CHUNK_USERS)):
+        n_users = min(CHUNK_USERS, args.users - first_user)
+        users, days_table = generate_chunk(np, args.seed, chunk_index, first_user, n_users, args.days, args.start)
+        if args.format == 'ndjson':
+            write_ndjson(users, days_table, users_file, days_file)
+        else:
+            write_columnar(np, users, days_table, args.out, chunk_index)
+
+    if args.format == 'ndjson':
+        users_file.close()
+        days_file.close()
+
+    elapsed = time.perf_counter() - start
+    user_days = args.users * args.days
+    print(f"{args.users} users, {user_days} user-days -> {args.out}/ ({args.format}) "
+          f"in {elapsed:.1f}s ({user_days / elapsed:,.0f} user-days/s)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# Most common medical profiles seen in production traffic
+# Used by warm_cache.py to pre-fill the medical constraint cache before the morning peak
+COMMON_PROFILES = {
+    'ACL Reconstruction': {
+        'weeks_post_op': range(2, 25),
+        'restriction_sets': [
+            ['no pivoting', 'no jumping'],
+            ['no pivoting'],
+            []
+        ],
+        'medication_sets': [
+            [],
+            ['warfarin']
+        ]
+    },
+    'Meniscus Repair': {
+        'weeks_post_op': range(2, 13),
+        'restriction_sets': [
+            ['no pivoting', 'no impact'],
+            []
+        ],
+        'medication_sets': [
+            []
+        ]
+    },
+    'Shoulder Surgery': {
+        'weeks_post_op': range(2, 13),
+        'restriction_sets': [
+            ['limited range of motion'],
+            []
+        ],
+        'medication_sets': [
+            []
+        ]
+    }
+}
+
+def enumerate_common_profiles(profiles=None):
+    """
+    Expand the COMMON_PROFILES config into concrete medical profiles
+    Returns a list of profile dicts in the shape /api/medical/parse accepts
+    """
+    profiles = profiles or COMMON_PROFILES
+    expanded = []
+
+    for surgery, spec in profiles.items():
+        for weeks in spec['weeks_post_op']:
+            for restrictions in spec['restriction_sets']:
+                for medications in spec['medication_sets']:
+                    expanded.append({
+                        'surgery': surgery,
+                        'weeks_post_op': weeks,
+                        'restrictions': list(restrictions),
+                        'medications': list(medications)
+                    })
+
+    return expanded
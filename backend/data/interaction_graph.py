@@ -0,0 +1,235 @@
+import re
+from data.medication_interactions import MEDICATION_INTERACTIONS
+
+# Interaction graph over normalized drug IDs (generic names): drug-drug edges and
+# drug-food edges, each with a severity. Adjacency is precomputed as int bitsets, so
+# checking a whole medication list is a few AND/OR operations per drug.
+
+SEVERITY_WEIGHTS = {'low': 1, 'moderate': 2, 'high': 4}
+
+# Normalized medication strings remembered per graph
+NORMALIZE_CACHE_SIZE = 4096
+
+# Brand and common alternative names -> drug ID
+DRUG_ALIASES = {
+    'coumadin': 'warfarin',
+    'jantoven': 'warfarin',
+    'zocor': 'simvastatin',
+    'lipitor': 'atorvastatin',
+    'cipro': 'ciprofloxacin',
+    'synthroid': 'levothyroxine',
+    'levoxyl': 'levothyroxine',
+    'advil': 'ibuprofen',
+    'motrin': 'ibuprofen',
+    'aleve': 'naproxen',
+    'asa': 'aspirin',
+    'tylenol': 'acetaminophen',
+    'paracetamol': 'acetaminophen',
+    'plavix': 'clopidogrel',
+    'eliquis': 'apixaban',
+    'lovenox': 'enoxaparin',
+    'flagyl': 'metronidazole',
+    'diflucan': 'fluconazole',
+    'biaxin': 'clarithromycin',
+    'zoloft': 'sertraline',
+    'ultram': 'tramadol',
+    'oxycontin': 'oxycodone',
+    'percocet': 'oxycodone',
+    'neurontin': 'gabapentin'
+}
+
+# (drug, drug, severity, message)
+DRUG_INTERACTIONS = [
+    ('warfarin', 'aspirin', 'high', 'Both thin the blood - markedly higher bleeding risk.'),
+    ('warfarin', 'ibuprofen', 'high', 'NSAIDs with warfarin raise the risk of serious bleeding.'),
+    ('warfarin', 'naproxen', 'high', 'NSAIDs with warfarin raise the risk of serious bleeding.'),
+    ('warfarin', 'ciprofloxacin', 'high', 'Ciprofloxacin can raise INR - more frequent INR checks needed.'),
+    ('warfarin', 'metronidazole', 'high', 'Metronidazole strongly raises INR - warfarin dose usually needs adjusting.'),
+    ('warfarin', 'fluconazole', 'high', 'Fluconazole strongly raises INR - warfarin dose usually needs adjusting.'),
+    ('warfarin', 'acetaminophen', 'moderate', 'Regular acetaminophen use can raise INR.'),
+    ('warfarin', 'sertraline', 'moderate', 'SSRIs add to the bleeding risk of warfarin.'),
+    ('warfarin', 'simvastatin', 'moderate', 'Simvastatin can slightly raise INR when started or stopped.'),
+    ('apixaban', 'aspirin', 'high', 'Anticoagulant plus antiplatelet - higher bleeding risk.'),
+    ('apixaban', 'ibuprofen', 'high', 'NSAIDs with an anticoagulant raise the risk of serious bleeding.'),
+    ('apixaban', 'naproxen', 'high', 'NSAIDs with an anticoagulant raise the risk of serious bleeding.'),
+    ('enoxaparin', 'ibuprofen', 'high', 'NSAIDs with enoxaparin raise the risk of bleeding and hematoma.'),
+    ('enoxaparin', 'naproxen', 'high', 'NSAIDs with enoxaparin raise the risk of bleeding and hematoma.'),
+    ('enoxaparin', 'aspirin', 'moderate', 'Antiplatelet with enoxaparin - watch for bleeding.'),
+    ('clopidogrel', 'aspirin', 'moderate', 'Dual antiplatelet therapy - higher bleeding risk, use only as prescribed.'),
+    ('clopidogrel', 'ibuprofen', 'moderate', 'NSAIDs add to the bleeding risk of clopidogrel.'),
+    ('ibuprofen', 'aspirin', 'moderate', 'Ibuprofen can blunt the cardioprotective effect of aspirin and adds GI bleeding risk.'),
+    ('ibuprofen', 'naproxen', 'moderate', 'Two NSAIDs together add GI and kidney risk without more pain relief.'),
+    ('sertraline', 'ibuprofen', 'moderate', 'SSRIs with NSAIDs raise the risk of GI bleeding.'),
+    ('sertraline', 'tramadol', 'high', 'Risk of serotonin syndrome and seizures.'),
+    ('simvastatin', 'clarithromycin', 'high', 'Clarithromycin sharply raises simvastatin levels (muscle damage) - avoid together.'),
+    ('atorvastatin', 'clarithromycin', 'high', 'Clarithromycin raises atorvastatin levels (muscle damage).'),
+    ('simvastatin', 'fluconazole', 'moderate', 'Fluconazole raises simvastatin levels - watch for muscle pain.'),
+    ('oxycodone', 'gabapentin', 'high', 'Combined sedation and risk of slowed breathing.'),
+    ('oxycodone', 'clarithromycin', 'moderate', 'Clarithromycin raises oxycodone levels - more sedation.'),
+    ('oxycodone', 'tramadol', 'high', 'Two opioids together - risk of slowed breathing.')
+]
+
+# Drug-food edges beyond the medication_interactions table
+EXTRA_FOOD_INTERACTIONS = {
+    'metronidazole': [{
+        'interacts_with': ['alcohol', 'beer', 'wine', 'vodka', 'whiskey'],
+        'severity': 'high',
+        'message': 'Alcohol with metronidazole causes severe nausea, vomiting and flushing. Avoid until 72 hours after the last dose.'
+    }],
+    'oxycodone': [{
+        'interacts_with': ['alcohol', 'beer', 'wine', 'vodka', 'whiskey'],
+        'severity': 'high',
+        'message': 'Alcohol adds to opioid sedation and can slow breathing dangerously. Avoid completely.'
+    }],
+    'acetaminophen': [{
+        'interacts_with': ['alcohol', 'beer', 'wine', 'vodka', 'whiskey'],
+        'severity': 'moderate',
+        'message': 'Regular alcohol with acetaminophen raises the risk of liver damage.'
+    }]
+}
+
+class InteractionGraph:
+    """
+    Drug-drug and drug-food interaction graph with bitset adjacency
+
+    Drugs and food keywords get dense indices; adjacency[i] has bit j set when drugs
+    i and j interact, high_adjacency only for high-severity edges, and food_adjacency[i]
+    has a bit per food keyword that interacts with drug i. Edge details (severity,
+    message) are looked up only for the pairs the bit operations find.
+    """
+    def __init__(self, drug_interactions, food_interactions, aliases):
+        self.drugs = sorted(
+            {drug for a, b, _, _ in drug_interactions for drug in (a, b)} | set(food_interactions)
+        )
+        self.index = {drug: i for i, drug in enumerate(self.drugs)}
+        self.aliases = {**{drug: drug for drug in self.drugs}, **aliases}
+        self._normalized = {}
+
+        self.adjacency = [0] * len(self.drugs)
+        self.high_adjacency = [0] * len(self.drugs)
+        self.edges = {}
+        for a, b, severity, message in drug_interactions:
+            i, j = self.index[a], self.index[b]
+            self.adjacency[i] |= 1 << j
+            self.adjacency[j] |= 1 << i
+            if severity == 'high':
+                self.high_adjacency[i] |= 1 << j
+                self.high_adjacency[j] |= 1 << i
+            self.edges[(min(i, j), max(i, j))] = {'severity': severity, 'message': message}
+
+        self.foods = sorted({food for entries in food_interactions.values() for entry in entries for food in entry['interacts_with']})
+        self.food_bits = [(food, 1 << i) for i, food in enumerate(self.foods)]
+        self.food_adjacency = [0] * len(self.drugs)
+        self.food_edges = {}
+        for drug, entries in food_interactions.items():
+            i = self.index[drug]
+            for entry in entries:
+                for food in entry['interacts_with']:
+                    bit = 1 << self.foods.index(food)
+                    self.food_adjacency[i] |= bit
+                    self.food_edges[(i, bit)] = entry
+
+    def normalize(self, medication):
+        """Drug ID for a medication string ("Coumadin 5mg daily" -> 'warfarin'), or None"""
+        if medication in self._normalized:
+            return self._normalized[medication]
+        drug = next(
+            (self.aliases[token] for token in re.findall(r'[a-z]+', medication.lower()) if token in self.aliases),
+            None
+        )
+        if len(self._normalized) >= NORMALIZE_CACHE_SIZE:
+            self._normalized.clear()
+        self._normalized[medication] = drug
+        return drug
+
+    def find_drugs(self, text):
+        """Drug IDs mentioned anywhere in free text"""
+        return {self.aliases[token] for token in re.findall(r'[a-z]+', text.lower()) if token in self.aliases}
+
+    def _resolve(self, medications):
+        """[(index, medication)] for the known drugs in a medication list, and their bitmask"""
+        resolved = []
+        mask = 0
+        for medication in medications:
+            drug = self.normalize(medication)
+            if drug is not None:
+                i = self.index[drug]
+                if not mask & (1 << i):
+                    resolved.append((i, medication))
+                    mask |= 1 << i
+        return resolved, mask
+
+    def drug_interactions(self, medications):
+        """Every interacting pair in a medication list, most severe first"""
+        resolved, mask = self._resolve(medications)
+        names = dict(resolved)
+        found = []
+        for i, medication in resolved:
+            # Partners with a higher index only, so each pair is reported once
+            partners = self.adjacency[i] & mask & ~((2 << i) - 1)
+            while partners:
+                low = partners & -partners
+                partners ^= low
+                j = low.bit_length() - 1
+                edge = self.edges[(i, j)]
+                found.append({
+                    'medications': [medication, names[j]],
+                    'drugs': [self.drugs[i], self.drugs[j]],
+                    'severity': edge['severity'],
+                    'message': edge['message']
+                })
+        found.sort(key=lambda interaction: -SEVERITY_WEIGHTS[interaction['severity']])
+        return found
+
+    def has_high_severity(self, medications):
+        """Any high-severity drug-drug pair in the list"""
+        resolved, mask = self._resolve(medications)
+        return any(self.high_adjacency[i] & mask for i, _ in resolved)
+
+    def interaction_burden(self, medications):
+        """Sum of severity weights over every interacting pair in the list"""
+        return sum(SEVERITY_WEIGHTS[i['severity']] for i in self.drug_interactions(medications))
+
+    def food_interactions(self, medications, food_items):
+        """
+        Drug-food interactions of a meal for a medication list, in the check_interaction
+        format ({'medication', 'food', 'severity', 'message'}), one per food item and edge
+        """
+        resolved, _ = self._resolve(medications)
+        food_masks = []
+        for food in food_items:
+            food_lower = food.lower()
+            food_mask = 0
+            for keyword, bit in self.food_bits:
+                if keyword in food_lower:
+                    food_mask |= bit
+            food_masks.append((food, food_mask))
+
+        found = []
+        for i, medication in resolved:
+            for food, food_mask in food_masks:
+                hits = self.food_adjacency[i] & food_mask
+                entries = []
+                while hits:
+                    bit = hits & -hits
+                    hits ^= bit
+                    entry = self.food_edges[(i, bit)]
+                    # "grapefruit juice" matches two keywords of one entry
+                    if entry not in entries:
+                        entries.append(entry)
+                for entry in entries:
+                    found.append({
+                        'medication': medication,
+                        'food': food,
+                        'severity': entry['severity'],
+                        'message': entry['message']
+                    })
+        return found
+
+def _food_interactions():
+    food_interactions = {drug: [details] for drug, details in MEDICATION_INTERACTIONS.items()}
+    for drug, entries in EXTRA_FOOD_INTERACTIONS.items():
+        food_interactions.setdefault(drug, []).extend(entries)
+    return food_interactions
+
+INTERACTION_GRAPH = InteractionGraph(DRUG_INTERACTIONS, _food_interactions(), DRUG_ALIASES)
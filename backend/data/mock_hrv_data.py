@@ -1,10 +1,12 @@
 from datetime import datetime, timedelta
 import random
 
-def generate_mock_hrv_data(days=7):
+def generate_mock_hrv_data(days=7, seed=None):
     """
     Generate realistic mock HRV data for testing
+    Pass a seed for reproducible data (benchmarks/synthetic_cohort.py generates whole cohorts)
     """
+    rng = random.Random(seed)
     baseline_hrv = 55  # Healthy baseline
     data = []
     
@@ -17,9 +19,9 @@ def generate_mock_hrv_data(days=7):
             resting_hr = 72  # Elevated
             sleep_hours = 6.0  # Poor sleep
         else:
-            hrv = baseline_hrv + random.uniform(-5, 5)
-            resting_hr = random.randint(58, 65)
-            sleep_hours = random.uniform(7, 8.5)
+            hrv = baseline_hrv + rng.uniform(-5, 5)
+            resting_hr = rng.randint(58, 65)
+            sleep_hours = rng.uniform(7, 8.5)
         
         data.append({
             'date': date.strftime('%Y-%m-%d'),
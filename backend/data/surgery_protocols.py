@@ -0,0 +1,47 @@
+# Post-operative rehab protocol timelines
+# Constraints only change at phase boundaries, so every week inside a phase shares
+# the same extraction result. Boundaries mirror the thresholds in
+# MedicalParserAgent._fallback_extraction.
+SURGERY_PROTOCOLS = {
+    'acl': {
+        'keywords': ['acl'],
+        'phases': [
+            {'name': 'Early protection', 'start_week': 0},
+            {'name': 'Controlled strengthening', 'start_week': 6},
+            {'name': 'Progressive loading', 'start_week': 8},
+            {'name': 'Return to sport', 'start_week': 12}
+        ]
+    }
+}
+
+def get_protocol_phase(surgery, weeks_post_op):
+    """
+    Find the protocol phase a patient is in
+    Returns None when the surgery has no known timeline or weeks is missing
+    """
+    try:
+        weeks = int(weeks_post_op)
+    except (TypeError, ValueError):
+        return None
+
+    surgery_lower = (surgery or '').lower()
+    for protocol_id, protocol in SURGERY_PROTOCOLS.items():
+        if not any(keyword in surgery_lower for keyword in protocol['keywords']):
+            continue
+
+        phases = protocol['phases']
+        index = 0
+        for i, phase in enumerate(phases):
+            if weeks >= phase['start_week']:
+                index = i
+
+        next_phase = phases[index + 1] if index + 1 < len(phases) else None
+        return {
+            'protocol': protocol_id,
+            'index': index,
+            'name': phases[index]['name'],
+            'start_week': phases[index]['start_week'],
+            'next_transition_week': next_phase['start_week'] if next_phase else None
+        }
+
+    return None
@@ -0,0 +1,36 @@
+"""
+Gunicorn configuration for production serving
+
+    cd backend && gunicorn -c gunicorn.conf.py wsgi:app
+
+Pre-fork workers with threads: each request mostly waits on Gemini, so a few threads
+per process keep cores busy while the process count scales across all cores.
+The app is imported once in the master (preload_app) and the Gemini/Opik clients
+are created in each worker after fork.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5001)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Gemini calls plus backoff retries can take ~10s; leave headroom
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers periodically to bound memory growth
+max_requests = 2000
+max_requests_jitter = 200
+
+# Share one SQLite WAL cache across workers instead of per-entry JSON files
+os.environ.setdefault('HEALTHFLOW_CACHE_BACKEND', 'sqlite')
+
+preload_app = True
+accesslog = '-'
+
+def post_fork(server, worker):
+    from main import init_worker
+    init_worker()
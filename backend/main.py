@@ -1,97 +1,517 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, request, jsonify, g, Response, current_app
 from flask_cors import CORS
 from agents.hrv_monitor import HRVMonitorAgent
 from agents.medical_parser import MedicalParserAgent
 from agents.nutrition_advisor import NutritionAdvisorAgent
 from agents.workout_orchestrator import WorkoutOrchestratorAgent
 from data.mock_hrv_data import get_today_hrv
+from utils.metrics import metrics
+from utils.logger import get_logger, request_id_var, reset_after_fork
+from utils.gemini_client import configure_gemini, preload_sdk as preload_gemini_sdk
+from utils.opik_logger import reset_client_after_fork, preload_sdk as preload_opik_sdk
+from utils.circuit_breaker import breaker_states
+from utils.quota import budget_states
+from utils.traffic_recorder import TrafficRecorder
+from utils.profiling import start_profile, finish_profile
+from utils.http_cache import set_cache_control, finalize_response
+from utils.json_provider import FastJSONProvider
+from utils.job_queue import JobQueue, QueueFull
+from utils.cache import derive_cache_key
+from utils.admission import create_limiters, retry_after_s
+from utils.model_router import rules_only_var
+from utils.hrv_anomaly import HRVAnomalyDetector, sample_error, reading_error
 import os
+import threading
+import time
+import uuid
 
-app = Flask(__name__)
+log = get_logger('api')
 
-# Enable CORS for all routes and origins (for development)
-CORS(app, resources={r"/api/*": {"origins": "*"}})
+api = Blueprint('api', __name__)
 
-# Initialize agents
-hrv_agent = HRVMonitorAgent()
-medical_agent = MedicalParserAgent()
-nutrition_agent = NutritionAdvisorAgent()
-workout_agent = WorkoutOrchestratorAgent()
+# Admission control class per route; unlisted routes (health, metrics, jobs) are never limited
+ROUTE_CLASSES = {
+    '/api/hrv/check': 'llm',
+    '/api/medical/parse': 'llm',
+    '/api/medical/ingest': 'llm',
+    '/api/nutrition/analyze': 'llm',
+    '/api/workout/generate': 'llm',
+    '/api/workout/week': 'llm',
+    '/api/workout/today': 'llm'
+}
+# Served by the agent's rules when saturated, instead of waiting or a 503
+DEGRADE_ROUTES = {'/api/hrv/check'}
 
-@app.route('/api/health', methods=['GET'])
+# Agents are built per process, after fork, so worker processes never share
+# SDK connections or thread state with the master
+_agents = {}
+_agents_lock = threading.Lock()
+
+def init_agents():
+    """Build this process's agents (idempotent)"""
+    with _agents_lock:
+        if not _agents:
+            _agents.update({
+                'hrv': HRVMonitorAgent(),
+                'medical': MedicalParserAgent(),
+                'nutrition': NutritionAdvisorAgent(),
+                'workout': WorkoutOrchestratorAgent()
+            })
+    return _agents
+
+def get_agent(name):
+    return (_agents or init_agents())[name]
+
+def agent_response(agent_name, result, fallback_used):
+    """jsonify an agent result, cacheable by clients for as long as the agent's response cache"""
+    return set_cache_control(jsonify(result), get_agent(agent_name).gemini.cache.ttl_hours, fallback_used)
+
+def is_provisional(result):
+    """
+    True for a fallback served in place of a model answer
+    Requests the router sent to the rules on purpose get a final answer
+    (unless only because the server was saturated)
+    """
+    return result.get('fallback', False) and (result.get('tier') != 'rules' or result.get('load_shed', False))
+
+def preload_sdks():
+    """
+    Import the Gemini and Opik SDKs now. They are otherwise imported on first use, so
+    serverless cold starts, health checks and fallback-only requests never pay for
+    them; long-running servers call this once in the master instead (see wsgi.py)
+    """
+    preload_gemini_sdk()
+    preload_opik_sdk()
+
+def init_worker():
+    """
+    Post-fork initialization for pre-fork servers (see gunicorn.conf.py)
+    Restarts the log writer thread, re-configures the Gemini SDK and builds the agents
+    """
+    reset_after_fork()
+    reset_client_after_fork()
+    configure_gemini()
+    init_agents()
+
+def create_app():
+    """Application factory"""
+    app = Flask(__name__)
+    # orjson when installed, stdlib json otherwise
+    app.json = FastJSONProvider(app)
+    app.json.sort_keys = False
+
+    # Enable CORS for all routes and origins (for development)
+    CORS(app, resources={r"/api/*": {"origins": "*"}},
+         expose_headers=['ETag', 'X-Request-ID', 'Server-Timing', 'X-Profile-Id'])
+
+    # HEALTHFLOW_RECORD_PATH=requests.jsonl captures anonymized traffic for replay
+    app.extensions['traffic_recorder'] = TrafficRecorder.from_env()
+
+    # Async job API: persistent queue, worker threads start with the first request
+    jobs = JobQueue.from_env()
+    for kind, (_, runner) in JOB_KINDS.items():
+        jobs.register(kind, _job_handler(kind, runner))
+    app.extensions['job_queue'] = jobs
+
+    # Admission control: bounded concurrency for LLM-bound routes
+    app.extensions['limiters'] = create_limiters()
+
+    # Per-user multi-day HRV/resting HR/sleep alerts, fed by /api/hrv/samples
+    app.extensions['hrv_detector'] = HRVAnomalyDetector.from_env()
+
+    app.register_blueprint(api)
+    return app
+
+@api.before_app_request
+def start_request():
+    g.request_start = time.perf_counter()
+    # Request ID ties together the log lines of every agent involved in this request
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    request_id_var.set(g.request_id)
+
+    # None unless X-Profile (HEALTHFLOW_PROFILE_HEADER=1) or HEALTHFLOW_PROFILE_SAMPLE picks this request
+    g.profile = start_profile(request.headers, g.request_id)
+
+    # Also picks up jobs queued before a restart; no-op after the first request
+    current_app.extensions['job_queue'].ensure_started()
+
+    recorder = current_app.extensions.get('traffic_recorder')
+    if recorder is not None and request.method != 'OPTIONS' and request.path != '/api/metrics':
+        recorder.record(request.method, request.path, request.get_json(silent=True))
+
+    return admit_request()
+
+def admit_request():
+    """
+    Admission control for LLM-bound routes: run, wait briefly for a slot, or shed
+    Returns a 503 response when the request is rejected, None otherwise
+    """
+    rules_only_var.set(False)
+    rule = request.url_rule.rule if request.url_rule is not None else None
+    limiter = current_app.extensions['limiters'].get(ROUTE_CLASSES.get(rule))
+    if limiter is None or request.method == 'OPTIONS':
+        return None
+
+    degrade = rule in DEGRADE_ROUTES
+    if limiter.acquire(wait=not degrade):
+        g.limiter = limiter
+        return None
+    if degrade:
+        rules_only_var.set(True)
+        return None
+
+    retry_after = retry_after_s(rule)
+    log.warning('request_shed', route=rule, route_class=limiter.name, retry_after_s=retry_after)
+    response = jsonify({
+        'error': 'server busy',
+        'message': f'Too many requests in progress, retry in {retry_after}s'
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+@api.teardown_app_request
+def release_admission(exc):
+    limiter = g.pop('limiter', None)
+    if limiter is not None:
+        limiter.release()
+
+@api.teardown_app_request
+def stop_request_profile(exc):
+    # Runs even when a before/after_request hook raised, so the cProfile slot is never leaked
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.stop()
+
+@api.after_app_request
+def finish_request(response):
+    if 'request_start' in g and request.url_rule is not None:
+        metrics.observe(f"route.{request.url_rule.rule}", time.perf_counter() - g.request_start)
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    if g.get('profile') is not None:
+        finish_profile(g.profile, response, request.path)
+    if request.path.startswith('/api/'):
+        response = finalize_response(request, response)
+    return response
+
+@api.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy', 'message': 'HealthFlow AI API is running'})
+    breakers = breaker_states()
+    degraded = any(b['state'] != 'closed' for b in breakers.values())
+    return jsonify({
+        'status': 'degraded' if degraded else 'healthy',
+        'message': 'HealthFlow AI API is running' + (' (Gemini unavailable, using fallbacks)' if degraded else ''),
+        'circuit_breakers': breakers,
+        'daily_budgets': budget_states(),
+        'admission': {name: limiter.snapshot() for name, limiter in current_app.extensions['limiters'].items()},
+        'hrv_alerts': current_app.extensions['hrv_detector'].snapshot()
+    })
+
+@api.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Per-stage latency histograms in Prometheus text format"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+def run_hrv_check(data=None):
+    hrv_data = get_today_hrv()
+    analysis = get_agent('hrv').analyze_recovery(hrv_data)
+    return {
+        'hrv_data': hrv_data,
+        'analysis': analysis
+    }
+
+def run_medical_parse(medical_profile):
+    return get_agent('medical').extract_constraints(medical_profile)
+
+def run_medical_ingest(data):
+    return get_agent('medical').extract_from_document(
+        data.get('document', ''),
+        medical_profile=data.get('profile')
+    )
 
-@app.route('/api/hrv/check', methods=['GET'])
+def run_nutrition_analyze(data):
+    return get_agent('nutrition').analyze_meal(data.get('meal_description'), data.get('medications', []))
+
+def run_workout_generate(data):
+    return get_agent('workout').generate_workout(
+        medical_constraints=data.get('medical_constraints'),
+        hrv_analysis=data.get('hrv_analysis'),
+        user_context=data.get('user_context')
+    )
+
+# Job kind -> (agent, runner) for the async job API
+JOB_KINDS = {
+    'hrv': ('hrv', run_hrv_check),
+    'medical': ('medical', run_medical_parse),
+    'document': ('medical', run_medical_ingest),
+    'nutrition': ('nutrition', run_nutrition_analyze),
+    'workout': ('workout', run_workout_generate)
+}
+
+def _job_handler(kind, runner):
+    """JobQueue handler: fallback answers are not reused for duplicate submissions"""
+    def handler(payload):
+        result = runner(payload)
+        return result, not is_provisional(result['analysis'] if kind == 'hrv' else result)
+    return handler
+
+def job_dedupe_key(kind, payload):
+    """
+    Agent cache key of a job: identical submissions share one job
+    Medical profiles use the agent's cache identity, so every week of a protocol phase
+    maps to the same job; HRV checks dedupe per day
+    """
+    if kind == 'medical':
+        return get_agent('medical').cache_identity(payload)
+    if kind == 'hrv':
+        payload = {'day': time.strftime('%Y-%m-%d')}
+    return derive_cache_key({'kind': kind, 'payload': payload})
+
+@api.route('/api/hrv/check', methods=['GET'])
 def check_hrv():
     """Get today's HRV and analysis"""
     try:
-        hrv_data = get_today_hrv()
-        analysis = hrv_agent.analyze_recovery(hrv_data)
-        
-        return jsonify({
-            'hrv_data': hrv_data,
-            'analysis': analysis
-        })
+        result = run_hrv_check()
+        return agent_response('hrv', result, is_provisional(result['analysis']))
     except Exception as e:
         return jsonify({
             'error': str(e),
             'message': 'Failed to analyze HRV'
         }), 500
 
-@app.route('/api/medical/parse', methods=['POST'])
+@api.route('/api/hrv/samples', methods=['POST'])
+def ingest_hrv_samples():
+    """
+    Feed daily readings to the anomaly detector
+    Body: one sample or {"samples": [...]}, each with user_id, date, hrv_ms, resting_hr, sleep_hours
+    """
+    data = request.get_json(silent=True) or {}
+    samples = data.get('samples', [data]) if isinstance(data, dict) else data
+    if not isinstance(samples, list) or any(not isinstance(s, dict) or not s.get('user_id') for s in samples):
+        return jsonify({
+            'error': 'user_id is required',
+            'message': 'Every sample needs a user_id'
+        }), 400
+    # The whole batch is rejected before any sample is applied
+    for i, sample in enumerate(samples):
+        error = sample_error(sample)
+        if error:
+            return jsonify({
+                'error': f'samples[{i}]: {error}',
+                'message': 'Invalid HRV sample'
+            }), 400
+
+    results = current_app.extensions['hrv_detector'].observe_many([(s['user_id'], s) for s in samples])
+    accepted = [events for events in results if events is not None]
+    return jsonify({
+        'accepted': len(accepted),
+        'ignored': len(samples) - len(accepted),
+        'alerts': [event for events in accepted for event in events]
+    })
+
+@api.route('/api/hrv/alerts', methods=['GET'])
+def hrv_alerts():
+    """
+    Alert feed: events after ?since=<seq> (oldest first, at most ?limit=), optionally for
+    one ?user_id=, whose active alerts and baselines are included
+    """
+    detector = current_app.extensions['hrv_detector']
+    user_id = request.args.get('user_id')
+    events = detector.alerts(
+        since=request.args.get('since', 0, type=int),
+        user_id=user_id,
+        limit=min(request.args.get('limit', 100, type=int), 1000)
+    )
+    result = {
+        'alerts': events,
+        'next_since': events[-1]['seq'] if events else request.args.get('since', 0, type=int)
+    }
+    if user_id is not None:
+        result['user'] = detector.user_status(user_id)
+    return jsonify(result)
+
+@api.route('/api/medical/parse', methods=['POST'])
 def parse_medical():
     """Extract constraints from medical profile"""
     try:
-        medical_profile = request.json
-        constraints = medical_agent.extract_constraints(medical_profile)
+        constraints = run_medical_parse(request.json)
         
-        return jsonify(constraints)
+        return agent_response('medical', constraints, is_provisional(constraints))
     except Exception as e:
         return jsonify({
             'error': str(e),
             'message': 'Failed to parse medical profile'
         }), 500
 
-@app.route('/api/nutrition/analyze', methods=['POST'])
+@api.route('/api/medical/ingest', methods=['POST'])
+def ingest_medical_document():
+    """Extract constraints from a long medical document (PT notes, lab reports)"""
+    try:
+        data = request.json
+        document = data.get('document', '')
+        if not document.strip():
+            return jsonify({
+                'error': 'document is required',
+                'message': 'Failed to ingest medical document'
+            }), 400
+
+        constraints = run_medical_ingest(data)
+
+        return agent_response('medical', constraints, constraints.get('fallback', False))
+    except Exception as e:
+        return jsonify({
+            'error': str(e),
+            'message': 'Failed to ingest medical document'
+        }), 500
+
+@api.route('/api/nutrition/analyze', methods=['POST'])
 def analyze_nutrition():
     """Analyze meal for nutrition and interactions"""
     try:
-        data = request.json
-        meal = data.get('meal_description')
-        medications = data.get('medications', [])
-        
-        analysis = nutrition_agent.analyze_meal(meal, medications)
+        analysis = run_nutrition_analyze(request.json)
         
-        return jsonify(analysis)
+        return agent_response('nutrition', analysis, is_provisional(analysis))
     except Exception as e:
         return jsonify({
             'error': str(e),
             'message': 'Failed to analyze nutrition'
         }), 500
 
-@app.route('/api/workout/generate', methods=['POST'])
+@api.route('/api/workout/generate', methods=['POST'])
 def generate_workout():
     """Generate adaptive workout plan"""
     try:
-        data = request.json
+        workout = run_workout_generate(request.json)
         
-        workout = workout_agent.generate_workout(
+        return agent_response('workout', workout, is_provisional(workout))
+    except Exception as e:
+        return jsonify({
+            'error': str(e),
+            'message': 'Failed to generate workout'
+        }), 500
+
+@api.route('/api/workout/week', methods=['POST'])
+def generate_weekly_plan():
+    """Generate a 7-day periodized block for a user (one model call per week)"""
+    try:
+        data = request.json
+        if not data.get('user_id'):
+            return jsonify({
+                'error': 'user_id is required',
+                'message': 'Failed to generate weekly plan'
+            }), 400
+
+        plan = get_agent('workout').generate_weekly_plan(
+            data['user_id'],
             medical_constraints=data.get('medical_constraints'),
-            hrv_analysis=data.get('hrv_analysis'),
-            user_context=data.get('user_context')
+            user_context=data.get('user_context') or {}
         )
-        
-        return jsonify(workout)
+        return jsonify(plan)
     except Exception as e:
         return jsonify({
             'error': str(e),
-            'message': 'Failed to generate workout'
+            'message': 'Failed to generate weekly plan'
         }), 500
 
+@api.route('/api/workout/today', methods=['POST'])
+def workout_for_today():
+    """Today's session from the user's weekly plan, adapted to this morning's HRV"""
+    try:
+        data = request.json
+        if not data.get('user_id'):
+            return jsonify({
+                'error': 'user_id is required',
+                'message': "Failed to get today's workout"
+            }), 400
+
+        hrv_data = data.get('hrv_data') or get_today_hrv()
+        # Client-supplied readings are checked before any agent work, and also feed the
+        # alert detector (repeats of a day are ignored)
+        if data.get('hrv_data'):
+            error = reading_error(hrv_data)
+            if error:
+                return jsonify({
+                    'error': f'hrv_data: {error}',
+                    'message': "Failed to get today's workout"
+                }), 400
+
+        workout = get_agent('workout').plan_for_today(
+            data['user_id'],
+            medical_constraints=data.get('medical_constraints'),
+            user_context=data.get('user_context') or {},
+            hrv_data=hrv_data
+        )
+        # Only once the session is built: a failed request, and its retry, must not
+        # count the day twice
+        if data.get('hrv_data'):
+            current_app.extensions['hrv_detector'].observe(data['user_id'], hrv_data)
+        return agent_response('workout', workout, is_provisional(workout))
+    except Exception as e:
+        return jsonify({
+            'error': str(e),
+            'message': "Failed to get today's workout"
+        }), 500
+
+# Longest long-poll a client may request with ?wait=
+MAX_JOB_WAIT_S = 30
+
+@api.route('/api/jobs/<kind>', methods=['POST'])
+def submit_job(kind):
+    """
+    Queue a generation and return its job ID right away (202)
+    Same body as the synchronous endpoint; identical submissions share one job
+    """
+    if kind not in JOB_KINDS:
+        return jsonify({
+            'error': f'Unknown job type: {kind}',
+            'message': f"Job type must be one of: {', '.join(JOB_KINDS)}"
+        }), 404
+
+    try:
+        payload = request.get_json(silent=True) or {}
+        if kind == 'document' and not payload.get('document', '').strip():
+            return jsonify({
+                'error': 'document is required',
+                'message': 'Failed to queue job'
+            }), 400
+
+        job, created = current_app.extensions['job_queue'].submit(
+            kind, payload, dedupe_key=job_dedupe_key(kind, payload), request_id=g.request_id
+        )
+    except QueueFull as e:
+        response = jsonify({
+            'error': str(e),
+            'message': 'Job queue is full, retry later'
+        })
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    except Exception as e:
+        return jsonify({
+            'error': str(e),
+            'message': 'Failed to queue job'
+        }), 500
+
+    response = jsonify({**job, 'deduplicated': not created})
+    response.headers['Location'] = f"/api/jobs/{job['job_id']}"
+    return response, 200 if job['status'] == 'done' else 202
+
+@api.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Job status and result; ?wait=S long-polls up to S seconds for it to finish"""
+    jobs = current_app.extensions['job_queue']
+    wait_s = min(request.args.get('wait', 0, type=float), MAX_JOB_WAIT_S)
+    job = jobs.wait(job_id, wait_s) if wait_s > 0 else jobs.get(job_id)
+    if job is None:
+        return jsonify({
+            'error': 'job not found',
+            'message': f'No job {job_id} (finished jobs are kept for {jobs.ttl_hours} hours)'
+        }), 404
+    return jsonify(job)
+
 if __name__ == '__main__':
+    # Development server only - use `gunicorn -c gunicorn.conf.py wsgi:app` in production
     port = int(os.environ.get('PORT', 5001))
-    # Increase timeout for slow AI operations
+    app = create_app()
     app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
-    app.config['JSON_SORT_KEYS'] = False
     app.run(debug=True, host='0.0.0.0', port=port, threaded=True)
\ No newline at end of file
@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+from utils.metrics import metrics
+from utils.logger import get_logger
+
+log = get_logger('admission')
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+class Limiter:
+    """
+    In-flight limit for one route class, with a small bounded wait queue
+
+    Up to max_in_flight requests run at once; up to max_queue more wait at most
+    queue_timeout_s for a slot. Anything beyond that is rejected immediately, so a
+    burst never parks more than max_in_flight + max_queue server threads on this class.
+    """
+    def __init__(self, name, max_in_flight, max_queue, queue_timeout_s):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout_s = queue_timeout_s
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, wait=True):
+        """True once admitted (release() when done), False if rejected"""
+        start = time.perf_counter()
+        with self._cond:
+            if self.in_flight < self.max_in_flight:
+                self.in_flight += 1
+                return True
+            if not wait or self.waiting >= self.max_queue:
+                self.rejected += 1
+                return False
+
+            self.waiting += 1
+            deadline = time.monotonic() + self.queue_timeout_s
+            try:
+                while self.in_flight >= self.max_in_flight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        return False
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+            finally:
+                self.waiting -= 1
+
+        metrics.observe(f'admission.{self.name}.queue_wait', time.perf_counter() - start)
+        return True
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def snapshot(self):
+        return {
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'max_in_flight': self.max_in_flight,
+            'max_queue': self.max_queue,
+            'rejected': self.rejected
+        }
+
+def create_limiters():
+    """
+    Per-process limiters per route class
+
+    Defaults leave a quarter of the gunicorn threads (GUNICORN_THREADS, default 8)
+    free for cheap routes whatever the LLM-bound load: half may run LLM-bound
+    requests and a quarter may wait for a slot. Override with HEALTHFLOW_ADMIT_LLM
+    (0 disables admission control), HEALTHFLOW_ADMIT_LLM_QUEUE and
+    HEALTHFLOW_ADMIT_QUEUE_TIMEOUT_S.
+    """
+    threads = _env_int('GUNICORN_THREADS', 8)
+    max_in_flight = _env_int('HEALTHFLOW_ADMIT_LLM', max(1, threads // 2))
+    if max_in_flight <= 0:
+        return {}
+    return {
+        'llm': Limiter(
+            'llm',
+            max_in_flight=max_in_flight,
+            max_queue=max(0, _env_int('HEALTHFLOW_ADMIT_LLM_QUEUE', threads // 4)),
+            queue_timeout_s=float(os.getenv('HEALTHFLOW_ADMIT_QUEUE_TIMEOUT_S', 2))
+        )
+    }
+
+def retry_after_s(rule):
+    """Retry-After hint: the route's median latency, at least 1s"""
+    stats = metrics.histogram(f'route.{rule}').quantiles((0.5,))
+    return max(1, min(30, round(stats[0.5])))
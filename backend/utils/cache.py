@@ -1,29 +1,203 @@
 import hashlib
 import json
 import os
-from datetime import datetime, timedelta
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
 from pathlib import Path
+from utils.logger import get_logger
+from utils import fast_json
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, dev server only
+    fcntl = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+log = get_logger('cache')
+
+# Binary record: magic, codec, created-at timestamp, then the (compressed) JSON payload
+RECORD_MAGIC = b'HFC1'
+RECORD_HEADER = struct.Struct('>4sBd')
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+# Small payloads are not worth the compression call
+COMPRESS_MIN_BYTES = 512
+
+# Per-key lock files unused for this long are removed by clear_expired
+LOCK_MAX_AGE_S = 3600
+
+# Keep the request payload next to the response only when debugging cache contents
+STORE_INPUT = os.getenv('HEALTHFLOW_CACHE_STORE_INPUT') == '1'
+
+_zstd_compressor = zstandard.ZstdCompressor(level=3) if zstandard else None
+_zstd_decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+def derive_cache_key(data):
+    """
+    Derive a cache key from a dict of prompt fields
+
+    Feeds each field straight into BLAKE2b instead of serializing the whole
+    multi-KB prompt with json.dumps(sort_keys=True) first; type tags and separators
+    keep distinct inputs from colliding. Non-string values stay on stdlib json so keys
+    are identical whether or not orjson is installed.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for field in sorted(data):
+        value = data[field]
+        digest.update(field.encode())
+        if isinstance(value, str):
+            digest.update(b'\x00s')
+            digest.update(value.encode())
+        elif value is None:
+            digest.update(b'\x00n')
+        else:
+            digest.update(b'\x00j')
+            digest.update(json.dumps(value, sort_keys=True).encode())
+        digest.update(b'\x1e')
+    return digest.hexdigest()
+
+def encode_payload(response, data=None):
+    """Serialize (and compress, if large) a cache payload; returns (codec, bytes)"""
+    payload = {'response': response}
+    if STORE_INPUT and data is not None:
+        payload['input'] = data
+    raw = fast_json.dumps_bytes(payload)
+
+    if len(raw) < COMPRESS_MIN_BYTES:
+        return CODEC_RAW, raw
+    if _zstd_compressor:
+        return CODEC_ZSTD, _zstd_compressor.compress(raw)
+    return CODEC_ZLIB, zlib.compress(raw, 6)
+
+def decode_payload(codec, body):
+    """Inverse of encode_payload; returns the cached response"""
+    if codec == CODEC_ZSTD:
+        if _zstd_decompressor is None:
+            raise ValueError('entry is zstd-compressed but zstandard is not installed')
+        body = _zstd_decompressor.decompress(body)
+    elif codec == CODEC_ZLIB:
+        body = zlib.decompress(body)
+    return fast_json.loads(body)['response']
+
+@contextmanager
+def _file_lock(lock_path):
+    """Exclusive flock on lock_path, shared by all threads and worker processes"""
+    if fcntl is None:
+        yield
+        return
+
+    while True:
+        lock_file = open(lock_path, 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        # clear_expired may have unlinked the file while we waited: a lock on the old
+        # inode would not exclude whoever opens the new one, so start over
+        try:
+            current = os.stat(lock_path).st_ino == os.fstat(lock_file.fileno()).st_ino
+        except FileNotFoundError:
+            current = False
+        if current:
+            break
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+    try:
+        # Marks the lock as recently used for _remove_stale_locks
+        os.utime(lock_path)
+        yield
+    finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+def _remove_stale_locks(lock_paths):
+    """
+    Delete per-key lock files unused for LOCK_MAX_AGE_S (one per distinct prompt
+    otherwise accumulates forever); a file someone holds right now is skipped
+    """
+    if fcntl is None:
+        return 0
+    cutoff = time.time() - LOCK_MAX_AGE_S
+    removed = 0
+    for lock_path in lock_paths:
+        try:
+            if os.stat(lock_path).st_mtime > cutoff:
+                continue
+            with open(lock_path, 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                # Unlinked while held: waiters re-open the path (see _file_lock)
+                os.unlink(lock_path)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+def sqlite_connection(local, db_path, row_factory=None):
+    """
+    SQLite WAL connection for the calling thread, kept on local (a threading.local)
+    One connection per thread, re-opened after fork (connections must not cross processes)
+    """
+    conn = getattr(local, 'conn', None)
+    if conn is None or local.pid != os.getpid():
+        conn = sqlite3.connect(db_path, timeout=5.0, isolation_level=None)
+        conn.row_factory = row_factory
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        local.conn = conn
+        local.pid = os.getpid()
+    return conn
+
+def create_cache(namespace='responses', cache_dir='.cache', ttl_hours=24):
+    """
+    Build the configured cache backend
+    HEALTHFLOW_CACHE_BACKEND=file (default) uses one JSON file per entry under cache_dir;
+    HEALTHFLOW_CACHE_BACKEND=sqlite stores every namespace in one SQLite WAL database
+    (HEALTHFLOW_CACHE_DB, default .cache.sqlite3), recommended with several workers
+    """
+    backend = os.getenv('HEALTHFLOW_CACHE_BACKEND', 'file').lower()
+    if backend == 'sqlite':
+        return SQLiteCache(
+            db_path=os.getenv('HEALTHFLOW_CACHE_DB', '.cache.sqlite3'),
+            namespace=namespace,
+            ttl_hours=ttl_hours
+        )
+    return SimpleCache(cache_dir=cache_dir, ttl_hours=ttl_hours)
 
 class SimpleCache:
     """
     Simple file-based cache to reduce API calls to Gemini
     Caches responses for 24 hours
+
+    Safe to share between worker processes: writes are atomic (temp file + rename),
+    so readers never see a half-written entry, and lock() serializes work per key.
     """
-    def __init__(self, cache_dir='.cache'):
+    def __init__(self, cache_dir='.cache', ttl_hours=24):
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(exist_ok=True)
-        self.ttl_hours = 24  # Cache for 24 hours
+        self.ttl_hours = ttl_hours  # Cache for 24 hours by default
 
     def _get_cache_key(self, data):
         """Generate cache key from input data"""
-        # Convert data to stable JSON string
-        json_str = json.dumps(data, sort_keys=True)
-        # Create hash
-        return hashlib.md5(json_str.encode()).hexdigest()
+        return derive_cache_key(data)
 
     def _get_cache_path(self, cache_key):
         """Get file path for cache key"""
-        return self.cache_dir / f"{cache_key}.json"
+        return self.cache_dir / f"{cache_key}.bin"
+
+    def _is_expired(self, created_at):
+        return time.time() - created_at > self.ttl_hours * 3600
 
     def get(self, data):
         """
@@ -33,24 +207,27 @@ class SimpleCache:
         cache_key = self._get_cache_key(data)
         cache_path = self._get_cache_path(cache_key)
 
-        if not cache_path.exists():
-            return None
-
         try:
-            with open(cache_path, 'r') as f:
-                cached = json.load(f)
+            with open(cache_path, 'rb') as f:
+                record = f.read()
+
+            magic, codec, created_at = RECORD_HEADER.unpack_from(record)
+            if magic != RECORD_MAGIC:
+                raise ValueError('unknown cache record format')
 
             # Check if expired
-            cached_time = datetime.fromisoformat(cached['timestamp'])
-            if datetime.now() - cached_time > timedelta(hours=self.ttl_hours):
-                # Expired, delete cache file
-                cache_path.unlink()
+            if self._is_expired(created_at):
+                # Expired, delete cache file (another worker may have beaten us to it)
+                cache_path.unlink(missing_ok=True)
                 return None
 
-            print(f"✅ Cache hit for key: {cache_key[:8]}...")
-            return cached['response']
+            response = decode_payload(codec, record[RECORD_HEADER.size:])
+            log.info('cache_hit', key=cache_key[:8])
+            return response
+        except FileNotFoundError:
+            return None
         except Exception as e:
-            print(f"⚠️ Cache read error: {e}")
+            log.warning('cache_read_error', key=cache_key[:8], error=str(e))
             return None
 
     def set(self, data, response):
@@ -61,28 +238,143 @@ class SimpleCache:
         cache_path = self._get_cache_path(cache_key)
 
         try:
-            with open(cache_path, 'w') as f:
-                json.dump({
-                    'timestamp': datetime.now().isoformat(),
-                    'input': data,
-                    'response': response
-                }, f, indent=2)
-            print(f"💾 Cached response for key: {cache_key[:8]}...")
+            # Write to a temp file and rename over the entry so concurrent readers
+            # in other workers see either the old or the new file, never a partial one
+            codec, body = encode_payload(response, data)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(RECORD_HEADER.pack(RECORD_MAGIC, codec, time.time()))
+                    f.write(body)
+                os.replace(tmp_path, cache_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            log.info('cache_write', key=cache_key[:8])
         except Exception as e:
-            print(f"⚠️ Cache write error: {e}")
+            log.warning('cache_write_error', key=cache_key[:8], error=str(e))
+
+    @contextmanager
+    def lock(self, data):
+        """
+        Exclusive per-key lock shared by all threads and worker processes
+        Used so only one worker calls upstream for a given key at a time
+        """
+        with _file_lock(self.cache_dir / f"{self._get_cache_key(data)}.lock"):
+            yield
 
     def clear_expired(self):
-        """Clear all expired cache entries"""
+        """Clear all expired cache entries (reads only each record's header)"""
         count = 0
-        for cache_file in self.cache_dir.glob('*.json'):
+        for cache_file in self.cache_dir.glob('*.bin'):
             try:
-                with open(cache_file, 'r') as f:
-                    cached = json.load(f)
-                cached_time = datetime.fromisoformat(cached['timestamp'])
-                if datetime.now() - cached_time > timedelta(hours=self.ttl_hours):
-                    cache_file.unlink()
+                with open(cache_file, 'rb') as f:
+                    _, _, created_at = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                if self._is_expired(created_at):
+                    cache_file.unlink(missing_ok=True)
                     count += 1
             except:
                 pass
-        if count > 0:
-            print(f"🧹 Cleared {count} expired cache entries")
+        # Entries in the old one-JSON-file-per-key format are never read any more
+        for legacy_file in self.cache_dir.glob('*.json'):
+            legacy_file.unlink(missing_ok=True)
+            count += 1
+        locks = _remove_stale_locks(self.cache_dir.glob('*.lock'))
+        if count > 0 or locks > 0:
+            log.info('cache_expired_cleared', count=count, locks=locks)
+
+class SQLiteCache:
+    """
+    Single-file cache backed by SQLite in WAL mode, with the same get/set interface
+    as SimpleCache
+
+    WAL gives every worker process consistent snapshot reads while another writes,
+    so there are no half-written entries and no read errors under concurrency.
+    Expiry timestamps are indexed, so clear_expired only touches expired rows.
+    """
+    def __init__(self, db_path='.cache.sqlite3', namespace='responses', ttl_hours=24):
+        self.db_path = str(db_path)
+        self.namespace = namespace
+        self.ttl_hours = ttl_hours
+        self.lock_dir = Path(f"{self.db_path}.locks")
+        self.lock_dir.mkdir(exist_ok=True)
+        self._local = threading.local()
+
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_records (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    codec INTEGER NOT NULL,
+                    payload BLOB NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_records_expires ON cache_records (expires_at)")
+            # Superseded by cache_records (JSON text, MD5 keys)
+            conn.execute("DROP TABLE IF EXISTS cache_entries")
+
+    def _connection(self):
+        return sqlite_connection(self._local, self.db_path)
+
+    def _get_cache_key(self, data):
+        """Generate cache key from input data"""
+        return derive_cache_key(data)
+
+    def get(self, data):
+        """
+        Get cached response if available and not expired
+        Returns None if cache miss or expired
+        """
+        cache_key = self._get_cache_key(data)
+        try:
+            row = self._connection().execute(
+                "SELECT codec, payload FROM cache_records WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (self.namespace, cache_key, time.time())
+            ).fetchone()
+            if row is None:
+                return None
+
+            response = decode_payload(row[0], row[1])
+            log.info('cache_hit', key=cache_key[:8])
+            return response
+        except Exception as e:
+            log.warning('cache_read_error', key=cache_key[:8], error=str(e))
+            return None
+
+    def set(self, data, response):
+        """
+        Store response in cache
+        """
+        cache_key = self._get_cache_key(data)
+        try:
+            codec, payload = encode_payload(response, data)
+            self._connection().execute(
+                "INSERT OR REPLACE INTO cache_records (namespace, key, expires_at, codec, payload) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, cache_key, time.time() + self.ttl_hours * 3600, codec, payload)
+            )
+            log.info('cache_write', key=cache_key[:8])
+        except Exception as e:
+            log.warning('cache_write_error', key=cache_key[:8], error=str(e))
+
+    @contextmanager
+    def lock(self, data):
+        """
+        Exclusive per-key lock shared by all threads and worker processes
+        Used so only one worker calls upstream for a given key at a time
+        """
+        with _file_lock(self.lock_dir / f"{self.namespace}-{self._get_cache_key(data)}.lock"):
+            yield
+
+    def clear_expired(self):
+        """
+        Clear all expired cache entries (index range delete, all namespaces) and this
+        namespace's stale lock files
+        """
+        cursor = self._connection().execute(
+            "DELETE FROM cache_records WHERE expires_at <= ?", (time.time(),)
+        )
+        locks = _remove_stale_locks(self.lock_dir.glob(f"{self.namespace}-*.lock"))
+        if cursor.rowcount > 0 or locks > 0:
+            log.info('cache_expired_cleared', count=cursor.rowcount, locks=locks)
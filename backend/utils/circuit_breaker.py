@@ -0,0 +1,139 @@
+import threading
+import time
+from utils.logger import get_logger
+
+log = get_logger('circuit_breaker')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+def is_rate_limit_error(error_msg):
+    error_lower = error_msg.lower()
+    return ('quota' in error_lower or
+            'rate limit' in error_lower or
+            'too many requests' in error_lower or
+            '429' in error_msg)
+
+def is_availability_error(error_msg):
+    error_lower = error_msg.lower()
+    return any(marker in error_lower for marker in [
+        '500', '502', '503', '504', 'unavailable', 'internal error', 'deadline exceeded',
+        'timed out', 'timeout', 'connection', 'overloaded'
+    ])
+
+def trips_breaker(error_msg):
+    """Only rate-limit and availability errors count; bad keys or prompts are not outages"""
+    return is_rate_limit_error(error_msg) or is_availability_error(error_msg)
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one Gemini model
+
+    closed    - calls go upstream; consecutive rate-limit/availability failures are counted
+    open      - calls are refused immediately so agents go straight to their fallbacks
+    half_open - recovery timeout elapsed; one background probe is in flight, callers
+                are still refused until it succeeds
+
+    Requests never wait on a probe: recovery is detected off the request path.
+    """
+    def __init__(self, name, failure_threshold=3, recovery_timeout=30, max_recovery_timeout=600, probe=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_recovery_timeout = recovery_timeout
+        self.max_recovery_timeout = max_recovery_timeout
+        self.recovery_timeout = recovery_timeout
+        self.probe = probe
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """True if a call may go upstream right now"""
+        if self.state == CLOSED:
+            return True
+
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = HALF_OPEN
+                self._start_probe()
+            return self.state == CLOSED
+
+    def record_success(self):
+        if self.state == CLOSED and self.consecutive_failures == 0:
+            return
+        with self._lock:
+            if self.state != CLOSED:
+                log.info('circuit_closed', model=self.name)
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.recovery_timeout = self.base_recovery_timeout
+
+    def record_failure(self, error_msg):
+        """Count a failed call; returns True if the breaker is now open"""
+        if not trips_breaker(error_msg):
+            return self.state != CLOSED
+
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = error_msg[:200]
+            if self.state == CLOSED and self.consecutive_failures >= self.failure_threshold:
+                self._open()
+            return self.state != CLOSED
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        log.warning('circuit_opened', model=self.name, retry_in_s=self.recovery_timeout, error=self.last_error)
+
+    def _start_probe(self):
+        if self.probe is None:
+            # Nothing to probe with: let the next real request through as the trial
+            self.state = CLOSED
+            self.consecutive_failures = self.failure_threshold - 1
+            return
+        threading.Thread(target=self._run_probe, name=f'breaker-probe-{self.name}', daemon=True).start()
+
+    def _run_probe(self):
+        try:
+            self.probe()
+        except Exception as e:
+            with self._lock:
+                self.last_error = str(e)[:200]
+                # Back off further while the outage continues
+                self.recovery_timeout = min(self.recovery_timeout * 2, self.max_recovery_timeout)
+                self._open()
+            return
+        self.record_success()
+
+    def snapshot(self):
+        retry_in = None
+        if self.state == OPEN:
+            retry_in = max(0.0, self.recovery_timeout - (time.monotonic() - self.opened_at))
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'retry_in_s': round(retry_in, 1) if retry_in is not None else None,
+            'last_error': self.last_error
+        }
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(model_name, probe=None):
+    """Shared breaker per model name (every agent using a model shares its breaker)"""
+    with _breakers_lock:
+        breaker = _breakers.get(model_name)
+        if breaker is None:
+            breaker = _breakers[model_name] = CircuitBreaker(model_name, probe=probe)
+        elif breaker.probe is None:
+            breaker.probe = probe
+        return breaker
+
+def breaker_states():
+    """State of every model's breaker, for the health endpoint"""
+    with _breakers_lock:
+        return {name: breaker.snapshot() for name, breaker in _breakers.items()}
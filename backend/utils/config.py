@@ -0,0 +1,18 @@
+import threading
+from dotenv import load_dotenv
+
+_loaded = False
+_lock = threading.Lock()
+
+def load_config():
+    """
+    Load backend/.env into the environment, once per process
+    Every module reading settings calls this instead of load_dotenv() directly
+    """
+    global _loaded
+    if _loaded:
+        return
+    with _lock:
+        if not _loaded:
+            load_dotenv()
+            _loaded = True
@@ -0,0 +1,77 @@
+import hashlib
+import re
+
+PAGE_MARKER = re.compile(r'^page\s+\d+\b', re.IGNORECASE)
+
+def _is_section_break(line):
+    """
+    Lines that start a new section in clinical notes: form feeds (PDF page breaks),
+    markdown headers, "Page 3" markers, and short ALL-CAPS or "Heading:" lines
+    """
+    if line.startswith('\f'):
+        return True
+    stripped = line.strip()
+    if not stripped:
+        return False
+    if stripped.startswith('#') or PAGE_MARKER.match(stripped):
+        return True
+    if len(stripped) > 60:
+        return False
+    return stripped.isupper() or (stripped.endswith(':') and len(stripped.split()) <= 6)
+
+def content_hash(text):
+    """Hash of whitespace-normalized chunk text, so re-extracted PDFs still match"""
+    normalized = ' '.join(text.split())
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+def split_sections(text, max_chars=4000):
+    """
+    Split a long medical document into chunks for extraction
+
+    Sections (page breaks and headings) are never merged together, so editing or adding
+    one page only changes the chunks for that page and every other chunk keeps its hash.
+    Sections longer than max_chars are split further on paragraph boundaries.
+
+    Returns a list of {'index', 'text', 'hash'} dicts
+    """
+    sections = []
+    current = []
+    for line in text.splitlines():
+        if _is_section_break(line) and any(l.strip() for l in current):
+            sections.append('\n'.join(current))
+            current = []
+        current.append(line.lstrip('\f'))
+    if any(l.strip() for l in current):
+        sections.append('\n'.join(current))
+
+    chunks = []
+    for section in sections:
+        for piece in _split_long_section(section.strip(), max_chars):
+            chunks.append({
+                'index': len(chunks),
+                'text': piece,
+                'hash': content_hash(piece)
+            })
+    return chunks
+
+def _split_long_section(section, max_chars):
+    """Split an oversized section on blank lines, then hard-wrap anything still too long"""
+    if len(section) <= max_chars:
+        return [section]
+
+    pieces = []
+    current = ''
+    for paragraph in re.split(r'\n\s*\n', section):
+        while len(paragraph) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ''
+            pieces.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            pieces.append(current)
+            current = ''
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        pieces.append(current)
+    return pieces
@@ -0,0 +1,39 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # stdlib json fallback
+    orjson = None
+
+# Datetimes go through `default` like with stdlib json (Flask renders them as HTTP
+# dates); non-string keys are stringified like stdlib json does
+_ORJSON_BASE_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+def dumps_bytes(obj, default=None, sort_keys=False, indent=False):
+    """
+    Serialize to compact UTF-8 JSON bytes (orjson when installed, else stdlib json)
+    default is called for objects the encoder cannot handle, as with json.dumps
+    """
+    if orjson is not None:
+        options = _ORJSON_BASE_OPTIONS
+        if sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=default, option=options)
+
+    if indent:
+        text = json.dumps(obj, default=default, sort_keys=sort_keys, ensure_ascii=False, indent=2)
+    else:
+        text = json.dumps(obj, default=default, sort_keys=sort_keys, ensure_ascii=False, separators=(',', ':'))
+    return text.encode()
+
+def dumps(obj, default=None, sort_keys=False, indent=False):
+    """Same as dumps_bytes, as str"""
+    return dumps_bytes(obj, default=default, sort_keys=sort_keys, indent=indent).decode()
+
+def loads(data):
+    """Parse JSON from str or bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
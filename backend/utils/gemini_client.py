@@ -1,30 +1,141 @@
-import google.generativeai as genai
 import os
-from dotenv import load_dotenv
+import functools
+import inspect
 import json
+import threading
 import time
-from utils.cache import SimpleCache
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utils.cache import create_cache
+from utils.metrics import metrics
+from utils.logger import get_logger, bind_request_context
+from utils.circuit_breaker import get_breaker, is_rate_limit_error
+from utils.quota import get_budget
+from utils.slo import HEDGE_ENABLED, HEDGE_MIN_SAMPLES
+from utils.config import load_config
 
-load_dotenv()
+log = get_logger('gemini')
 
-# Configure Gemini
-api_key = os.getenv('GEMINI_API_KEY')
+load_config()
 
-if not api_key or api_key == 'your_gemini_api_key_here':
-    print("="*60)
-    print("⚠️  WARNING: GEMINI_API_KEY not configured!")
-    print("="*60)
-    print("Please set your Gemini API key in backend/.env")
-    print("Get your API key from: https://aistudio.google.com/app/apikey")
-    print("All agents will use fallback rule-based logic until configured.")
-    print("="*60)
-    api_key = None  # Will cause API calls to fail gracefully
+api_key = None
+# HEALTHFLOW_SYSTEM_INSTRUCTION=0 sends the system instruction inside every prompt
+# even when the SDK can register it on the model
+SYSTEM_INSTRUCTION_ENABLED = os.getenv('HEALTHFLOW_SYSTEM_INSTRUCTION', '1') != '0'
+# Models registered per client, one per distinct static prefix (agents have one or two)
+MAX_PREFIXED_MODELS = 16
 
-if api_key:
-    genai.configure(api_key=api_key)
-    print("✅ Gemini API configured successfully")
-else:
-    print("⚠️  Running in FALLBACK MODE (rule-based responses only)")
+# Response format appended to every generate_with_thinking request
+THINKING_FORMAT = """Please provide your response in this format:
+REASONING:
+[Your step-by-step thought process]
+
+DECISION:
+[Your final recommendation]
+
+EXPLANATION:
+[Brief explanation for the user]"""
+# google.generativeai, imported on first model use: the SDK and its gRPC/protobuf
+# dependencies take most of a second to import, which health checks, rule-based
+# fallbacks and serverless cold starts should not pay for
+_genai = None
+_genai_lock = threading.Lock()
+
+def _sdk():
+    """The configured google.generativeai module (imported on first call)"""
+    global _genai
+    if _genai is None:
+        with _genai_lock:
+            if _genai is None:
+                import google.generativeai as genai
+                if api_key:
+                    genai.configure(api_key=api_key)
+                _genai = genai
+    return _genai
+
+def configure_gemini():
+    """
+    Configure the Gemini SDK from GEMINI_API_KEY
+    Runs at import, and again in each pre-fork worker (SDK connections do not survive fork)
+    The SDK itself is only configured here once imported; otherwise _sdk() does it
+    """
+    global api_key
+    api_key = os.getenv('GEMINI_API_KEY')
+
+    if not api_key or api_key == 'your_gemini_api_key_here':
+        log.warning(
+            'gemini_api_key_missing',
+            hint='Set GEMINI_API_KEY in backend/.env (https://aistudio.google.com/app/apikey). '
+                 'All agents will use fallback rule-based logic until configured.'
+        )
+        api_key = None  # Will cause API calls to fail gracefully
+
+    if api_key:
+        if _genai is not None:
+            _genai.configure(api_key=api_key)
+        log.info('gemini_configured')
+    else:
+        log.warning('gemini_fallback_mode')
+
+configure_gemini()
+
+def preload_sdk():
+    """Import the SDK now rather than on the first request (long-running servers)"""
+    if api_key and _model_factory is None:
+        _sdk()
+
+# Replaces genai.GenerativeModel when set (offline benchmarks and traffic replay)
+_model_factory = None
+
+@functools.lru_cache(maxsize=8)
+def _supports_system_instruction(factory):
+    """
+    Whether a model factory takes system_instruction - google-generativeai added it
+    after 0.3.2, which only accepts the instruction as prompt text
+    Memoized per factory: inspect.signature is too slow to repeat on every request
+    """
+    try:
+        return 'system_instruction' in inspect.signature(factory).parameters
+    except (TypeError, ValueError):
+        return False
+
+def use_model_factory(factory):
+    """
+    Build every GeminiClient created from now on with factory(model_name) instead of
+    the Gemini API - factory must return an object with generate_content(prompt, **kwargs)
+    Pass None to restore the real SDK
+    """
+    global _model_factory, api_key
+    _model_factory = factory
+    if factory is not None:
+        # The stand-in needs no key, but the no-key fast path must not kick in
+        api_key = api_key or 'offline'
+    else:
+        configure_gemini()
+
+_upstream_pool = None
+_upstream_pool_lock = threading.Lock()
+
+def run_fallback(fallback):
+    """fallback() result, or None (logged) when it raises"""
+    try:
+        return fallback()
+    except Exception:
+        log.error('fallback_failed', exc_info=True)
+        return None
+
+def _get_upstream_pool():
+    """
+    Shared pool running deadline-bounded model calls
+    Created lazily so each pre-fork worker starts its own threads
+    """
+    global _upstream_pool
+    with _upstream_pool_lock:
+        if _upstream_pool is None:
+            _upstream_pool = ThreadPoolExecutor(
+                max_workers=int(os.getenv('HEALTHFLOW_UPSTREAM_THREADS', 16)),
+                thread_name_prefix='gemini-upstream'
+            )
+        return _upstream_pool
 
 class GeminiClient:
     def __init__(self, model_name="gemini-2.0-flash-lite"):
@@ -35,19 +146,113 @@ class GeminiClient:
         - gemini-2.0-flash (20 req/day)
         - gemini-2.0-pro (25-50 req/day for complex reasoning)
         """
-        self.model = genai.GenerativeModel(
-            model_name=model_name,
+        self._model = None
+        self.model_name = model_name
+        # Static prefix (system instruction + response format) -> model holding it
+        self._prefixed_models = {}
+        self._prefixed_models_lock = threading.Lock()
+        self.cache = create_cache()
+        self.max_retries = 3
+        self.retry_delay = 2  # seconds
+        # Shared per model: once Gemini is down or out of quota, every agent skips
+        # straight to its fallback instead of paying for retries and backoff sleeps
+        self.breaker = get_breaker(model_name, probe=self._probe)
+        # Shared per model too: upstream calls made today against the model's daily quota
+        self.budget = get_budget(model_name)
+
+    @property
+    def model(self):
+        """The underlying model, built on first use so constructing agents stays cheap"""
+        if self._model is None:
+            self._model = self._build_model()
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+
+    def _build_model(self, system_instruction=None):
+        kwargs = {'system_instruction': system_instruction} if system_instruction is not None else {}
+        if _model_factory is not None:
+            return _model_factory(self.model_name, **kwargs)
+        return _sdk().GenerativeModel(
+            model_name=self.model_name,
             generation_config={
                 "temperature": 0.7,
                 "top_p": 0.95,
                 "top_k": 40,
                 "max_output_tokens": 2048,
-            }
+            },
+            **kwargs
         )
-        self.cache = SimpleCache()
-        self.max_retries = 3
-        self.retry_delay = 2  # seconds
-    
+
+    def _prefixed_model(self, prefix):
+        """
+        Model with a static prompt prefix registered as its system instruction, so each
+        request only sends the variable part; None when the SDK cannot take one
+        """
+        model = self._prefixed_models.get(prefix)
+        if model is not None:
+            return model
+        if not SYSTEM_INSTRUCTION_ENABLED:
+            return None
+        factory = _model_factory if _model_factory is not None else _sdk().GenerativeModel
+        if not _supports_system_instruction(factory):
+            return None
+
+        with self._prefixed_models_lock:
+            model = self._prefixed_models.get(prefix)
+            if model is None and len(self._prefixed_models) < MAX_PREFIXED_MODELS:
+                model = self._prefixed_models[prefix] = self._build_model(system_instruction=prefix)
+                log.info('system_instruction_registered', model=self.model_name, prefix_bytes=len(prefix.encode()))
+        return model
+
+    def _thinking_request(self, prompt, system_instruction=None):
+        """
+        (model, contents) for a generate_with_thinking call
+        The system instruction and response format are the same for every request of an
+        agent: registered once on the model where the SDK allows, else sent inline
+        """
+        prefix = f"{system_instruction}\n\n{THINKING_FORMAT}" if system_instruction else THINKING_FORMAT
+        model = self._prefixed_model(prefix)
+        if model is not None:
+            return model, prompt
+        return self.model, f"""
+{system_instruction or ''}
+
+{prompt}
+
+{THINKING_FORMAT}
+"""
+
+    def _probe(self):
+        """Minimal upstream call used by the circuit breaker to detect recovery"""
+        self.budget.record_call()
+        self.model.generate_content('ping', generation_config={'max_output_tokens': 1})
+
+    def _circuit_open_error(self):
+        return {
+            'success': False,
+            'error': f'Gemini ({self.model_name}) temporarily unavailable - circuit open. Using fallback logic.',
+            'circuit_open': True
+        }
+
+    def _thinking_cache_data(self, prompt, system_instruction=None):
+        """Cache key payload for generate_with_thinking"""
+        return {
+            'prompt': prompt,
+            'system_instruction': system_instruction,
+            'type': 'thinking'
+        }
+
+    def is_cached(self, prompt, system_instruction=None):
+        """
+        Check whether a generate_with_thinking call would be a cache hit
+        without touching the API
+        """
+        with metrics.timer('gemini.cache_get'):
+            return self.cache.get(self._thinking_cache_data(prompt, system_instruction)) is not None
+
     def generate_with_thinking(self, prompt, system_instruction=None):
         """
         Generate response with step-by-step reasoning
@@ -60,46 +265,167 @@ class GeminiClient:
             }
 
         # Create cache key from prompt and system instruction
-        cache_data = {
-            'prompt': prompt,
-            'system_instruction': system_instruction,
-            'type': 'thinking'
-        }
+        cache_data = self._thinking_cache_data(prompt, system_instruction)
 
         # Try to get from cache first
-        cached_response = self.cache.get(cache_data)
+        with metrics.timer('gemini.cache_get'):
+            cached_response = self.cache.get(cache_data)
         if cached_response:
             return cached_response
 
-        # Add thinking instruction to prompt
-        thinking_prompt = f"""
-{system_instruction or ''}
+        return self._generate_thinking(cache_data, prompt, system_instruction)
 
-{prompt}
+    def _generate_thinking(self, cache_data, prompt, system_instruction=None, single_flight=True):
+        """
+        Cache-miss path of generate_with_thinking
+        single_flight=False skips the per-key lock (hedged duplicates must not queue
+        behind the request they are hedging)
+        """
+        # Add thinking instruction to prompt (or to the model's system instruction)
+        model, contents = self._thinking_request(prompt, system_instruction)
 
-Please provide your response in this format:
-REASONING:
-[Your step-by-step thought process]
+        if not single_flight:
+            if not self.breaker.allow_request():
+                return self._circuit_open_error()
+            return self._generate_thinking_with_retries(cache_data, contents, model)
 
-DECISION:
-[Your final recommendation]
+        # Only one worker process calls upstream per key; the others wait for the
+        # lock and then read the result it cached
+        with self.cache.lock(cache_data):
+            with metrics.timer('gemini.cache_get'):
+                cached_response = self.cache.get(cache_data)
+            if cached_response:
+                return cached_response
+            if not self.breaker.allow_request():
+                return self._circuit_open_error()
+            return self._generate_thinking_with_retries(cache_data, contents, model)
 
-EXPLANATION:
-[Brief explanation for the user]
-"""
+    def generate_with_deadline(self, prompt, system_instruction=None, fallback=None, deadline_s=None, on_success=None):
+        """
+        generate_with_thinking bounded by a latency SLO, raced against a rule-based fallback
+
+        The model call runs on the upstream pool. If it has not answered successfully
+        within deadline_s, fallback() is computed and served (marked deadline_exceeded);
+        the model call keeps running and caches its answer, so the next identical
+        request is a cache hit. A fallback that raises is logged and the model answer
+        is awaited instead. on_success(result) runs for every successful model answer,
+        late ones included.
 
+        With HEALTHFLOW_HEDGE=1 a second, lock-free request is fired once the first has
+        been outstanding longer than the p95 upstream latency; the first success wins.
+        Without a deadline this is generate_with_thinking plus fallback on failure.
+        """
+        if not deadline_s or fallback is None:
+            response = self.generate_with_thinking(prompt, system_instruction)
+            if response['success'] and on_success:
+                on_success(response)
+            if not response['success'] and fallback is not None:
+                log.warning('gemini_failed_using_fallback', error=response.get('error', 'Unknown error'))
+                response = run_fallback(fallback) or response
+            return response
+
+        if not api_key:
+            return run_fallback(fallback) or {'success': False, 'error': 'Gemini API key not configured'}
+
+        # Cache hits need no race
+        cache_data = self._thinking_cache_data(prompt, system_instruction)
+        with metrics.timer('gemini.cache_get'):
+            cached_response = self.cache.get(cache_data)
+        if cached_response:
+            if on_success:
+                on_success(cached_response)
+            return cached_response
+
+        def call(single_flight=True):
+            result = self._generate_thinking(cache_data, prompt, system_instruction, single_flight=single_flight)
+            if result['success'] and on_success:
+                on_success(result)
+            return result
+
+        start = time.monotonic()
+        deadline = start + deadline_s
+        pool = _get_upstream_pool()
+        pending = [pool.submit(bind_request_context(call))]
+
+        hedge_at = None
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is not None and hedge_delay < deadline_s:
+            hedge_at = start + hedge_delay
+
+        error = 'Unknown error'
+        with metrics.timer('gemini.deadline_wait'):
+            while pending:
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    # Built only when it is served
+                    fallback_response = run_fallback(fallback)
+                    if fallback_response is not None:
+                        break
+                    # Nothing to serve instead: wait for the model after all
+                    deadline = None
+                timeout = None if deadline is None else deadline - now
+                if hedge_at is not None:
+                    hedge_timeout = max(hedge_at - now, 0)
+                    timeout = hedge_timeout if timeout is None else min(timeout, hedge_timeout)
+
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = {'success': False, 'error': str(e)}
+                    if result['success']:
+                        return result
+                    error = result.get('error', error)
+
+                if hedge_at is not None and pending and time.monotonic() >= hedge_at:
+                    hedge_at = None
+                    if self.breaker.allow_request():
+                        log.info('gemini_hedged_request', after_ms=round(hedge_delay * 1000))
+                        pending.append(pool.submit(bind_request_context(call), single_flight=False))
+
+        if pending:
+            # Still running: its answer lands in the cache for the next request
+            log.warning('gemini_deadline_exceeded', deadline_s=deadline_s, model=self.model_name)
+            return {**fallback_response, 'deadline_exceeded': True}
+
+        log.warning('gemini_failed_using_fallback', error=error)
+        # deadline is None when the fallback has already failed
+        fallback_response = run_fallback(fallback) if deadline is not None else None
+        return fallback_response or {'success': False, 'error': error}
+
+    def _hedge_delay(self):
+        """p95 upstream latency, or None when hedging is off or there is too little data"""
+        if not HEDGE_ENABLED:
+            return None
+        stats = metrics.histogram('gemini.upstream').quantiles((0.95,))
+        if stats['count'] < HEDGE_MIN_SAMPLES:
+            return None
+        return stats[0.95]
+
+    def _generate_thinking_with_retries(self, cache_data, thinking_prompt, model=None):
+        """
+        Call Gemini with exponential backoff on rate limits and cache the result
+        model defaults to the client's model (no registered system instruction)
+        """
+        model = model or self.model
         # Retry logic for rate limiting
         for attempt in range(self.max_retries):
             try:
-                response = self.model.generate_content(thinking_prompt)
+                self.budget.record_call()
+                with metrics.timer('gemini.upstream'):
+                    response = model.generate_content(thinking_prompt)
+                self.breaker.record_success()
                 result = {
                     'success': True,
-                    'response': response.text,
-                    'full_response': response
+                    'response': response.text
                 }
 
-                # Cache successful response
-                self.cache.set(cache_data, result)
+                # Cache successful response (the raw SDK object is not JSON-serializable,
+                # so it is not returned either - agent results are sent through jsonify)
+                with metrics.timer('gemini.cache_set'):
+                    self.cache.set(cache_data, result)
 
                 return result
 
@@ -107,16 +433,16 @@ EXPLANATION:
                 error_msg = str(e)
 
                 # Check if it's a rate limit error
-                is_rate_limit = ('quota' in error_msg.lower() or
-                               'rate limit' in error_msg.lower() or
-                               'too many requests' in error_msg.lower() or
-                               '429' in error_msg)
+                is_rate_limit = is_rate_limit_error(error_msg)
+                circuit_open = self.breaker.record_failure(error_msg)
 
                 # If rate limited and not last attempt, retry with backoff
-                if is_rate_limit and attempt < self.max_retries - 1:
+                # (unless the breaker just opened - then fall back right away)
+                if is_rate_limit and not circuit_open and attempt < self.max_retries - 1:
                     wait_time = self.retry_delay * (2 ** attempt)  # Exponential backoff
-                    print(f"⚠️ Rate limited. Retrying in {wait_time}s... (attempt {attempt + 1}/{self.max_retries})")
-                    time.sleep(wait_time)
+                    log.warning('gemini_rate_limited', retry_in_s=wait_time, attempt=attempt + 1, max_retries=self.max_retries)
+                    with metrics.timer('gemini.retry_sleep'):
+                        time.sleep(wait_time)
                     continue
 
                 # Provide helpful error messages
@@ -136,7 +462,7 @@ EXPLANATION:
         Uses caching and retry logic
         """
         if not api_key:
-            print("❌ Error: GEMINI_API_KEY not configured")
+            log.error('gemini_api_key_missing')
             return None
 
         # Create cache key
@@ -146,27 +472,47 @@ EXPLANATION:
         }
 
         # Try cache first
-        cached_response = self.cache.get(cache_data)
+        with metrics.timer('gemini.cache_get'):
+            cached_response = self.cache.get(cache_data)
         if cached_response:
             return cached_response
 
         json_prompt = f"{prompt}\n\nRespond ONLY with valid JSON, no markdown formatting."
 
+        with self.cache.lock(cache_data):
+            with metrics.timer('gemini.cache_get'):
+                cached_response = self.cache.get(cache_data)
+            if cached_response:
+                return cached_response
+            if not self.breaker.allow_request():
+                log.warning('gemini_circuit_open', model=self.model_name)
+                return None
+            return self._parse_json_with_retries(cache_data, json_prompt)
+
+    def _parse_json_with_retries(self, cache_data, json_prompt):
+        """
+        Call Gemini for JSON with exponential backoff on rate limits and cache the result
+        """
         # Retry logic
         for attempt in range(self.max_retries):
             try:
-                response = self.model.generate_content(json_prompt)
-                # Clean response (remove markdown if present)
-                text = response.text.strip()
-                if text.startswith('```json'):
-                    text = text[7:]
-                if text.endswith('```'):
-                    text = text[:-3]
+                self.budget.record_call()
+                with metrics.timer('gemini.upstream'):
+                    response = self.model.generate_content(json_prompt)
+                self.breaker.record_success()
+                with metrics.timer('gemini.json_parse'):
+                    # Clean response (remove markdown if present)
+                    text = response.text.strip()
+                    if text.startswith('```json'):
+                        text = text[7:]
+                    if text.endswith('```'):
+                        text = text[:-3]
 
-                result = json.loads(text.strip())
+                    result = json.loads(text.strip())
 
                 # Cache successful response
-                self.cache.set(cache_data, result)
+                with metrics.timer('gemini.cache_set'):
+                    self.cache.set(cache_data, result)
 
                 return result
 
@@ -174,23 +520,22 @@ EXPLANATION:
                 error_msg = str(e)
 
                 # Check if it's a rate limit error
-                is_rate_limit = ('quota' in error_msg.lower() or
-                               'rate limit' in error_msg.lower() or
-                               'too many requests' in error_msg.lower() or
-                               '429' in error_msg)
+                is_rate_limit = is_rate_limit_error(error_msg)
+                circuit_open = self.breaker.record_failure(error_msg)
 
                 # If rate limited and not last attempt, retry
-                if is_rate_limit and attempt < self.max_retries - 1:
+                if is_rate_limit and not circuit_open and attempt < self.max_retries - 1:
                     wait_time = self.retry_delay * (2 ** attempt)
-                    print(f"⚠️ Rate limited. Retrying in {wait_time}s... (attempt {attempt + 1}/{self.max_retries})")
-                    time.sleep(wait_time)
+                    log.warning('gemini_rate_limited', retry_in_s=wait_time, attempt=attempt + 1, max_retries=self.max_retries)
+                    with metrics.timer('gemini.retry_sleep'):
+                        time.sleep(wait_time)
                     continue
 
                 # Log error
                 if 'API_KEY_INVALID' in error_msg or 'invalid api key' in error_msg.lower():
-                    print(f"❌ Error: Invalid API key. Please check your GEMINI_API_KEY in backend/.env")
+                    log.error('gemini_invalid_api_key', hint='Check GEMINI_API_KEY in backend/.env')
                 elif is_rate_limit:
-                    print(f"❌ Error: API quota exceeded: {error_msg}")
+                    log.error('gemini_quota_exceeded', error=error_msg)
                 else:
-                    print(f"❌ Error parsing JSON: {e}")
+                    log.error('gemini_json_error', error=str(e))
                 return None
\ No newline at end of file
@@ -0,0 +1,373 @@
+import math
+import os
+import threading
+from datetime import date as date_type
+from utils import fast_json
+from utils.cache import sqlite_connection
+from utils.logger import get_logger
+
+log = get_logger('hrv_anomaly')
+
+# Baselines: EWMA with a ~4-week span; the first samples use the running (Welford)
+# mean and variance until the span is reached
+BASELINE_ALPHA = 2 / (28 + 1)
+# No alerts until a user's baseline has this many samples
+MIN_BASELINE_SAMPLES = 7
+
+# A day is anomalous when its value is past the baseline by the larger of an absolute
+# margin and one standard deviation (noisy users need a bigger swing)
+HRV_SUPPRESSED_PCT = 10  # HRV below baseline by >10% suggests poor recovery
+RESTING_HR_RISE_BPM = 5
+SHORT_SLEEP_HOURS = 6.5
+# Consecutive anomalous days before an alert is raised
+ALERT_DAYS = 3
+
+HRV_SUPPRESSED = 'hrv_suppressed'
+RESTING_HR_RISING = 'resting_hr_rising'
+SHORT_SLEEP = 'short_sleep'
+# Suppressed HRV and rising resting HR together
+OVERTRAINING = 'overtraining'
+
+# Alert events kept for the feed (raised and cleared, all users)
+FEED_SIZE = 1000
+
+# Optional numeric fields of a sample
+SAMPLE_FIELDS = ('hrv_ms', 'resting_hr', 'sleep_hours')
+
+def sample_error(sample):
+    """Why a sample cannot be observed, or None when it is valid"""
+    if not isinstance(sample, dict):
+        return 'sample must be an object'
+    for field in SAMPLE_FIELDS:
+        value = sample.get(field)
+        if value is not None and (
+            isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value < 0
+        ):
+            return f'{field} must be a non-negative number'
+    sample_date = sample.get('date')
+    if sample_date is not None:
+        try:
+            date_type.fromisoformat(sample_date)
+        except (TypeError, ValueError):
+            return 'date must be an ISO date string (YYYY-MM-DD)'
+    return None
+
+def reading_error(reading):
+    """
+    sample_error for a reading that assess_recovery scores (/api/workout/today):
+    every metric and a positive baseline_hrv are required
+    """
+    error = sample_error(reading)
+    if error:
+        return error
+    for field in SAMPLE_FIELDS:
+        if reading.get(field) is None:
+            return f'{field} is required'
+    baseline = reading.get('baseline_hrv')
+    if isinstance(baseline, bool) or not isinstance(baseline, (int, float)) or not math.isfinite(baseline) or baseline <= 0:
+        return 'baseline_hrv must be a positive number'
+    return None
+
+class EwmaStat:
+    """Exponentially weighted mean and variance of one metric, O(1) per update"""
+    __slots__ = ('n', 'mean', 'var')
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.var = 0.0
+
+    def update(self, x):
+        self.n += 1
+        # 1/n while warming up is Welford's running mean/variance
+        alpha = max(BASELINE_ALPHA, 1 / self.n)
+        diff = x - self.mean
+        incr = alpha * diff
+        self.mean += incr
+        self.var = (1 - alpha) * (self.var + diff * incr)
+
+    def std(self):
+        return self.var ** 0.5
+
+    def to_list(self):
+        return [self.n, self.mean, self.var]
+
+    @classmethod
+    def from_list(cls, values):
+        stat = cls()
+        stat.n, stat.mean, stat.var = values
+        return stat
+
+class UserState:
+    """Per-user baselines, anomaly streaks and active alerts - constant size"""
+    __slots__ = ('hrv', 'resting_hr', 'sleep', 'last_date', 'streaks', 'active')
+
+    def __init__(self):
+        self.hrv = EwmaStat()
+        self.resting_hr = EwmaStat()
+        self.sleep = EwmaStat()
+        self.last_date = None
+        # Consecutive anomalous days per metric alert
+        self.streaks = {HRV_SUPPRESSED: 0, RESTING_HR_RISING: 0, SHORT_SLEEP: 0}
+        # Alert -> date it was raised
+        self.active = {}
+
+    def to_json(self):
+        return fast_json.dumps({
+            'hrv': self.hrv.to_list(),
+            'resting_hr': self.resting_hr.to_list(),
+            'sleep': self.sleep.to_list(),
+            'last_date': self.last_date,
+            'streaks': self.streaks,
+            'active': self.active
+        })
+
+    @classmethod
+    def from_json(cls, text):
+        data = fast_json.loads(text)
+        state = cls()
+        state.hrv = EwmaStat.from_list(data['hrv'])
+        state.resting_hr = EwmaStat.from_list(data['resting_hr'])
+        state.sleep = EwmaStat.from_list(data['sleep'])
+        state.last_date = data['last_date']
+        state.streaks = data['streaks']
+        state.active = data['active']
+        return state
+
+class HRVAnomalyDetector:
+    """
+    Online detector of multi-day recovery anomalies per user
+
+    Each sample ({'date', 'hrv_ms', 'resting_hr', 'sleep_hours'}) is compared with the
+    user's baselines and then folded into them. An alert is raised after ALERT_DAYS
+    consecutive anomalous days and cleared by the first normal one; both transitions
+    go to a bounded feed. Samples dated on or before the user's last sample are
+    ignored, so re-sending a day is harmless.
+
+    Per-user state and the feed live in a SQLite WAL database shared by every worker
+    process (like the job queue), so a user's samples may reach any worker and survive
+    worker recycling; each batch of samples is applied in one transaction.
+    """
+    def __init__(self, db_path='.hrv.sqlite3', feed_size=FEED_SIZE):
+        self.db_path = str(db_path)
+        self.feed_size = feed_size
+        self._local = threading.local()
+
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS hrv_users (
+                    user_id TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    active INTEGER NOT NULL
+                ) WITHOUT ROWID
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS hrv_alerts (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    event TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_hrv_alerts_user ON hrv_alerts (user_id, seq)")
+            # Running totals for snapshot(), kept in the observe transaction (one row)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS hrv_totals (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    users INTEGER NOT NULL,
+                    active_alerts INTEGER NOT NULL
+                )
+            """)
+            # Counted once for a database created before the totals table
+            conn.execute("""
+                INSERT OR IGNORE INTO hrv_totals (id, users, active_alerts)
+                SELECT 1, COUNT(*), COALESCE(SUM(active), 0) FROM hrv_users
+            """)
+
+    @classmethod
+    def from_env(cls):
+        """HEALTHFLOW_HRV_DB (default .hrv.sqlite3)"""
+        return cls(db_path=os.getenv('HEALTHFLOW_HRV_DB', '.hrv.sqlite3'))
+
+    def _connection(self):
+        return sqlite_connection(self._local, self.db_path)
+
+    def _load(self, conn, user_id):
+        row = conn.execute("SELECT state FROM hrv_users WHERE user_id = ?", (str(user_id),)).fetchone()
+        return UserState.from_json(row[0]) if row else None
+
+    def observe(self, user_id, sample):
+        """
+        Alert events caused by this sample ([] if none), or None for a stale sample
+        Raises ValueError for an invalid sample (see sample_error), leaving state untouched
+        """
+        return self.observe_many([(user_id, sample)])[0]
+
+    def observe_many(self, samples):
+        """
+        observe for a batch of (user_id, sample) in one transaction, one result each
+        Raises ValueError if any sample is invalid, before any is applied
+
+        >>> detector = HRVAnomalyDetector(':memory:')
+        >>> detector.observe('u1', {'date': '2026-01-01', 'hrv_ms': 55, 'resting_hr': 60})
+        []
+        >>> before = detector.snapshot(), detector.user_status('u1')
+        >>> detector.observe_many([('u1', {'date': '2026-01-02', 'hrv_ms': 50}), ('u2', {'hrv_ms': '40'})])
+        Traceback (most recent call last):
+        ValueError: hrv_ms must be a non-negative number
+        >>> (detector.snapshot(), detector.user_status('u1')) == before
+        True
+        >>> detector.observe('u1', {'date': '2026-01-01', 'hrv_ms': 20}) is None
+        True
+        >>> (detector.snapshot(), detector.user_status('u1')) == before
+        True
+        """
+        parsed = []
+        for user_id, sample in samples:
+            error = sample_error(sample)
+            if error:
+                raise ValueError(error)
+            date = sample.get('date')
+            if date is not None:
+                date = date_type.fromisoformat(date).isoformat()
+            parsed.append((user_id, date, sample.get('hrv_ms'), sample.get('resting_hr'), sample.get('sleep_hours')))
+
+        conn = self._connection()
+        results = []
+        states = {}
+        # Active alert count per user before this batch, None for a new user
+        previous_active = {}
+        changed = set()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for user_id, date, hrv, resting_hr, sleep in parsed:
+                if user_id not in states:
+                    state = self._load(conn, user_id)
+                    previous_active[user_id] = len(state.active) if state else None
+                    states[user_id] = state or UserState()
+                events = self._apply(states[user_id], user_id, date, hrv, resting_hr, sleep)
+                if events is not None:
+                    changed.add(user_id)
+                for event in events or []:
+                    cursor = conn.execute(
+                        "INSERT INTO hrv_alerts (user_id, event) VALUES (?, ?)",
+                        (str(user_id), fast_json.dumps(event))
+                    )
+                    event['seq'] = cursor.lastrowid
+                results.append(events)
+
+            new_users = active_delta = 0
+            for user_id in changed:
+                state = states[user_id]
+                conn.execute(
+                    "INSERT OR REPLACE INTO hrv_users (user_id, state, active) VALUES (?, ?, ?)",
+                    (str(user_id), state.to_json(), len(state.active))
+                )
+                if previous_active[user_id] is None:
+                    new_users += 1
+                active_delta += len(state.active) - (previous_active[user_id] or 0)
+            if new_users or active_delta:
+                conn.execute(
+                    "UPDATE hrv_totals SET users = users + ?, active_alerts = active_alerts + ? WHERE id = 1",
+                    (new_users, active_delta)
+                )
+            last_seq = max((event['seq'] for events in results for event in events or []), default=None)
+            if last_seq is not None and last_seq > self.feed_size:
+                conn.execute("DELETE FROM hrv_alerts WHERE seq <= ?", (last_seq - self.feed_size,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        for events in results:
+            for event in events or []:
+                log.info('hrv_alert', user_id=event['user_id'], alert=event['alert'], status=event['status'])
+        return results
+
+    def _apply(self, state, user_id, date, hrv, resting_hr, sleep):
+        """Fold one validated sample into state; alert events, or None if it is stale"""
+        if date is not None and state.last_date is not None and date <= state.last_date:
+            return None
+
+        warmed_up = state.hrv.n >= MIN_BASELINE_SAMPLES
+        # Compare with the baselines before this sample is part of them
+        anomalies = {
+            HRV_SUPPRESSED: hrv is not None and warmed_up and hrv < state.hrv.mean - max(
+                state.hrv.mean * HRV_SUPPRESSED_PCT / 100, state.hrv.std()
+            ),
+            RESTING_HR_RISING: resting_hr is not None and warmed_up and resting_hr > state.resting_hr.mean + max(
+                RESTING_HR_RISE_BPM, state.resting_hr.std()
+            ),
+            SHORT_SLEEP: sleep is not None and sleep < SHORT_SLEEP_HOURS
+        }
+        if date is not None:
+            state.last_date = date
+        if hrv is not None:
+            state.hrv.update(hrv)
+        if resting_hr is not None:
+            state.resting_hr.update(resting_hr)
+        if sleep is not None:
+            state.sleep.update(sleep)
+
+        for alert, anomalous in anomalies.items():
+            state.streaks[alert] = state.streaks[alert] + 1 if anomalous else 0
+        raised = {alert for alert, days in state.streaks.items() if days >= ALERT_DAYS}
+        if HRV_SUPPRESSED in raised and RESTING_HR_RISING in raised:
+            raised.add(OVERTRAINING)
+
+        events = []
+        for alert in sorted(raised - state.active.keys()):
+            state.active[alert] = date
+            events.append(self._event(user_id, alert, 'raised', date, state))
+        for alert in sorted(state.active.keys() - raised):
+            del state.active[alert]
+            events.append(self._event(user_id, alert, 'cleared', date, state))
+        return events
+
+    def _event(self, user_id, alert, status, date, state):
+        if alert == OVERTRAINING:
+            days = min(state.streaks[HRV_SUPPRESSED], state.streaks[RESTING_HR_RISING])
+        else:
+            days = state.streaks[alert]
+        return {
+            'user_id': user_id,
+            'alert': alert,
+            'status': status,
+            'date': date,
+            # Length of the anomalous streak (0 when cleared)
+            'days': days,
+            'baseline': self._baseline(state)
+        }
+
+    def _baseline(self, state):
+        return {
+            'hrv_ms': round(state.hrv.mean, 1),
+            'resting_hr': round(state.resting_hr.mean, 1),
+            'sleep_hours': round(state.sleep.mean, 1),
+            'samples': state.hrv.n
+        }
+
+    def alerts(self, since=0, user_id=None, limit=100):
+        """Feed events after sequence number since, oldest first"""
+        if user_id is None:
+            rows = self._connection().execute(
+                "SELECT seq, event FROM hrv_alerts WHERE seq > ? ORDER BY seq LIMIT ?", (since, limit)
+            ).fetchall()
+        else:
+            rows = self._connection().execute(
+                "SELECT seq, event FROM hrv_alerts WHERE user_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (str(user_id), since, limit)
+            ).fetchall()
+        return [{'seq': seq, **fast_json.loads(event)} for seq, event in rows]
+
+    def user_status(self, user_id):
+        """Active alerts (alert -> date raised) and baselines, or None for an unknown user"""
+        state = self._load(self._connection(), user_id)
+        if state is None:
+            return None
+        return {'active': dict(state.active), 'baseline': self._baseline(state)}
+
+    def snapshot(self):
+        users, active_alerts = self._connection().execute(
+            "SELECT users, active_alerts FROM hrv_totals WHERE id = 1"
+        ).fetchone()
+        return {'users': users, 'active_alerts': active_alerts}
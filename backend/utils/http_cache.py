@@ -0,0 +1,71 @@
+import gzip
+import hashlib
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Below this, compression costs more than it saves
+COMPRESS_MIN_BYTES = 512
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/plain'}
+
+def set_cache_control(response, ttl_hours, fallback_used):
+    """
+    Cache-Control for an agent result
+    Model answers stay valid for the server-side response cache TTL; fallback answers
+    must be revalidated, since the model answer may land in the server cache any moment
+    """
+    if fallback_used:
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.private = True
+        response.cache_control.max_age = int(ttl_hours * 3600)
+    return response
+
+def _choose_encoding(accept_encoding):
+    if brotli is not None and 'br' in accept_encoding:
+        return 'br'
+    if 'gzip' in accept_encoding:
+        return 'gzip'
+    return None
+
+def finalize_response(request, response):
+    """
+    Strong ETag, 304 Not Modified and gzip/brotli compression for API responses
+
+    The ETag is a BLAKE2b digest of the uncompressed body, suffixed with the content
+    coding for compressed variants (each variant is a different representation).
+    A matching If-None-Match - for any coding of the same body - turns the response
+    into an empty 304. The agent work has already run by then; what is saved is the
+    transfer and the client's parse of a multi-KB body.
+    """
+    if (response.status_code != 200 or response.direct_passthrough
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    body = response.get_data()
+    digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+    encoding = _choose_encoding(request.headers.get('Accept-Encoding', '')) if len(body) >= COMPRESS_MIN_BYTES else None
+    response.vary.add('Accept-Encoding')
+
+    if response.mimetype == 'application/json':
+        if_none_match = request.if_none_match
+        for tag in (digest, f'{digest}-gzip', f'{digest}-br'):
+            if if_none_match.contains(tag):
+                response.status_code = 304
+                response.set_data(b'')
+                response.headers.pop('Content-Type', None)
+                response.set_etag(tag)
+                return response
+        response.set_etag(f'{digest}-{encoding}' if encoding else digest)
+
+    if encoding == 'br':
+        response.set_data(brotli.compress(body, quality=5))
+    elif encoding == 'gzip':
+        response.set_data(gzip.compress(body, compresslevel=6))
+    else:
+        return response
+    response.headers['Content-Encoding'] = encoding
+    return response
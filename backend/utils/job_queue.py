@@ -0,0 +1,259 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from utils import fast_json
+from utils.cache import sqlite_connection
+from utils.metrics import metrics
+from utils.logger import get_logger, request_id_var
+
+log = get_logger('job_queue')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Idle workers and long-polls re-check the database this often, for jobs
+# submitted or finished by other worker processes
+POLL_INTERVAL_S = 0.5
+# Finished jobs are purged at most this often
+PURGE_INTERVAL_S = 60
+
+class QueueFull(Exception):
+    """Too many jobs waiting - the client should retry later"""
+
+class JobQueue:
+    """
+    Persistent job queue in SQLite (WAL) with a bounded pool of worker threads
+
+    Every worker process runs its own threads against the shared database; a job is
+    claimed inside a write transaction, so exactly one thread runs it. Running jobs
+    hold a lease: if their process dies (deploy, crash, OOM) the job is re-queued
+    once the lease expires, up to max_attempts times. Queued jobs survive restarts.
+
+    Handlers are registered per kind: handler(payload) -> (result, reusable). A
+    finished job is returned for later duplicate submissions (same dedupe key) only
+    when reusable - fallback answers are not, so a resubmit can get the model's.
+    """
+    def __init__(self, db_path='.jobs.sqlite3', workers=4, max_queued=1000, lease_s=300,
+                 ttl_hours=24, max_attempts=3):
+        self.db_path = str(db_path)
+        self.workers = workers
+        self.max_queued = max_queued
+        self.lease_s = lease_s
+        self.ttl_hours = ttl_hours
+        self.max_attempts = max_attempts
+        self.handlers = {}
+
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+        self._last_purge = 0.0
+
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    dedupe_key TEXT,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    reusable INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    request_id TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    lease_expires REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs (dedupe_key)")
+
+    @classmethod
+    def from_env(cls):
+        """
+        HEALTHFLOW_JOB_DB (default .jobs.sqlite3), HEALTHFLOW_JOB_WORKERS threads per
+        process (default 4), HEALTHFLOW_JOB_MAX_QUEUED (default 1000)
+        """
+        return cls(
+            db_path=os.getenv('HEALTHFLOW_JOB_DB', '.jobs.sqlite3'),
+            workers=int(os.getenv('HEALTHFLOW_JOB_WORKERS', 4)),
+            max_queued=int(os.getenv('HEALTHFLOW_JOB_MAX_QUEUED', 1000))
+        )
+
+    def _connection(self):
+        return sqlite_connection(self._local, self.db_path, row_factory=sqlite3.Row)
+
+    def register(self, kind, handler):
+        self.handlers[kind] = handler
+
+    def submit(self, kind, payload, dedupe_key=None, request_id=None):
+        """
+        Queue a job; returns (job, created)
+        A queued, running or reusable finished job with the same dedupe key is returned
+        instead of queueing a duplicate. Raises QueueFull when max_queued jobs are waiting.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f'Unknown job kind: {kind}')
+
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if dedupe_key is not None:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE dedupe_key = ? AND kind = ? "
+                    "AND (status IN (?, ?) OR (status = ? AND reusable = 1 AND finished_at > ?)) "
+                    "ORDER BY created_at DESC LIMIT 1",
+                    (dedupe_key, kind, QUEUED, RUNNING, DONE, now - self.ttl_hours * 3600)
+                ).fetchone()
+                if row is not None:
+                    conn.execute("COMMIT")
+                    return self._to_dict(row), False
+
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+            if queued >= self.max_queued:
+                raise QueueFull(f'{queued} jobs waiting')
+
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, kind, dedupe_key, payload, status, request_id, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, dedupe_key, fast_json.dumps(payload), QUEUED, request_id, now)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        self.ensure_started()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        log.info('job_queued', job_id=job_id, kind=kind)
+        return self.get(job_id), True
+
+    def get(self, job_id):
+        """Job as a dict, or None if unknown (or purged)"""
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def wait(self, job_id, timeout):
+        """Long-poll: the job once it has finished, or as it is after timeout seconds"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job['status'] in (DONE, FAILED) or remaining <= 0:
+                return job
+            with self._wakeup:
+                self._wakeup.wait(min(remaining, POLL_INTERVAL_S))
+
+    def _to_dict(self, row):
+        return {
+            'job_id': row['id'],
+            'kind': row['kind'],
+            'status': row['status'],
+            'attempts': row['attempts'],
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at'],
+            'result': fast_json.loads(row['result']) if row['result'] is not None else None,
+            'error': row['error']
+        }
+
+    def ensure_started(self):
+        """
+        Start this process's worker threads (idempotent, and again in a forked child -
+        threads do not survive fork). Called on every request, so queued jobs left over
+        from before a restart are picked up as soon as the server takes traffic
+        """
+        if self._started_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+            for i in range(self.workers):
+                threading.Thread(target=self._worker_loop, name=f'job-worker-{i}', daemon=True).start()
+            self._started_pid = os.getpid()
+
+    def _worker_loop(self):
+        while True:
+            try:
+                row = self._claim()
+            except sqlite3.Error as e:
+                log.warning('job_claim_failed', error=str(e))
+                row = None
+            if row is None:
+                with self._wakeup:
+                    self._wakeup.wait(POLL_INTERVAL_S)
+                continue
+            self._run(row)
+
+    def _claim(self):
+        """Next queued job, marked running under a lease; None if there is none"""
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Jobs of dead processes: retry, or give up after max_attempts
+            conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                "error = CASE WHEN attempts >= ? THEN 'worker lost' ELSE error END, "
+                "finished_at = CASE WHEN attempts >= ? THEN ? ELSE finished_at END "
+                "WHERE status = ? AND lease_expires < ?",
+                (self.max_attempts, FAILED, QUEUED, self.max_attempts, self.max_attempts, now, RUNNING, now)
+            )
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = ?, lease_expires = ?, attempts = attempts + 1 "
+                    "WHERE id = ?",
+                    (RUNNING, now, now + self.lease_s, row['id'])
+                )
+            elif now - self._last_purge > PURGE_INTERVAL_S:
+                self._last_purge = now
+                conn.execute(
+                    "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                    (DONE, FAILED, now - self.ttl_hours * 3600)
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def _run(self, row):
+        # Log lines of the job carry the ID of the request that submitted it
+        request_id_var.set(row['request_id'] or row['id'])
+        metrics.observe('job.queue_wait', time.time() - row['created_at'])
+        try:
+            with metrics.timer(f"job.{row['kind']}"):
+                result, reusable = self.handlers[row['kind']](fast_json.loads(row['payload']))
+            status, result_json, error = DONE, fast_json.dumps(result), None
+        except Exception as e:
+            log.error('job_failed', exc_info=True, job_id=row['id'], kind=row['kind'])
+            status, result_json, error, reusable = FAILED, None, str(e), False
+
+        # Only while this claim still owns the job: after its lease expired another
+        # worker may have re-claimed it (attempts moved on) and its result wins
+        try:
+            cursor = self._connection().execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, reusable = ?, finished_at = ? "
+                "WHERE id = ? AND status = ? AND attempts = ?",
+                (status, result_json, error, int(reusable), time.time(), row['id'], RUNNING, row['attempts'] + 1)
+            )
+            if cursor.rowcount == 0:
+                log.warning('job_result_stale', job_id=row['id'], kind=row['kind'])
+        except sqlite3.Error as e:
+            # The lease runs out and the job is retried; the worker keeps going
+            log.error('job_result_write_failed', job_id=row['id'], kind=row['kind'], error=str(e))
+        with self._wakeup:
+            self._wakeup.notify_all()
@@ -0,0 +1,25 @@
+from flask.json.provider import DefaultJSONProvider
+from utils.fast_json import dumps, dumps_bytes, loads
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by dumps_bytes/loads
+    Keeps DefaultJSONProvider's behavior (default hook, sort_keys, pretty output in
+    debug mode) but writes response bodies as bytes without a str round trip
+    """
+    def dumps(self, obj, **kwargs):
+        return dumps(
+            obj,
+            default=kwargs.get('default', self.default),
+            sort_keys=kwargs.get('sort_keys', self.sort_keys),
+            indent=bool(kwargs.get('indent'))
+        )
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = dumps_bytes(obj, default=self.default, sort_keys=self.sort_keys, indent=indent)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,160 @@
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from utils import fast_json
+
+# Correlates every log line written while handling one API request, across all agents
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+# Keep-probability for high-frequency events; override with
+# HEALTHFLOW_LOG_SAMPLE="cache_hit=0.01,cache_write=0.5"
+DEFAULT_SAMPLE_RATES = {
+    'cache_hit': 0.1,
+    'cache_write': 0.1
+}
+
+_configure_lock = threading.Lock()
+_listener = None
+_sample_rates = dict(DEFAULT_SAMPLE_RATES)
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, event, request_id, plus event fields"""
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None)
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return fast_json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Human-readable variant for local development"""
+    def format(self, record):
+        fields = ' '.join(f"{k}={v}" for k, v in getattr(record, 'fields', {}).items())
+        request_id = getattr(record, 'request_id', None)
+        line = f"{record.levelname:<7} {record.name} {record.getMessage()}"
+        if request_id:
+            line += f" [{request_id}]"
+        if fields:
+            line += f" {fields}"
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+class _BackgroundQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the background listener thread without formatting them
+    Callers only pay for a non-blocking queue put; when the queue is full the
+    record is dropped instead of blocking the worker thread
+    """
+    dropped = 0
+
+    def prepare(self, record):
+        record.request_id = request_id_var.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _BackgroundQueueHandler.dropped += 1
+
+def configure_logging():
+    """
+    Set up the shared 'healthflow' logger once per process
+    HEALTHFLOW_LOG_LEVEL (default INFO), HEALTHFLOW_LOG_FORMAT (json|text, default json)
+    """
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            return
+
+        stream_handler = logging.StreamHandler(sys.stdout)
+        if os.getenv('HEALTHFLOW_LOG_FORMAT', 'json').lower() == 'text':
+            stream_handler.setFormatter(TextFormatter())
+        else:
+            stream_handler.setFormatter(JsonFormatter())
+
+        log_queue = queue.Queue(maxsize=int(os.getenv('HEALTHFLOW_LOG_QUEUE_SIZE', 10000)))
+        root = logging.getLogger('healthflow')
+        root.setLevel(os.getenv('HEALTHFLOW_LOG_LEVEL', 'INFO').upper())
+        root.addHandler(_BackgroundQueueHandler(log_queue))
+        root.propagate = False
+
+        for pair in os.getenv('HEALTHFLOW_LOG_SAMPLE', '').split(','):
+            if '=' in pair:
+                event, rate = pair.split('=', 1)
+                _sample_rates[event.strip()] = float(rate)
+
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+        _listener.start()
+        # Flush whatever is still queued on interpreter exit
+        atexit.register(_listener.stop)
+
+def reset_after_fork():
+    """
+    Restart the background writer in a forked worker process
+    The parent's listener thread does not survive fork
+    """
+    global _listener
+    root = logging.getLogger('healthflow')
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    _listener = None
+    configure_logging()
+
+class StructuredLogger:
+    """
+    Thin wrapper over stdlib logging: log.info('cache_hit', key=...)
+    The event name is the message; keyword arguments become JSON fields
+    """
+    def __init__(self, name):
+        self._logger = logging.getLogger(f'healthflow.{name}')
+
+    def _log(self, level, event, fields, exc_info=False):
+        if not self._logger.isEnabledFor(level):
+            return
+        rate = _sample_rates.get(event)
+        if rate is not None:
+            if random.random() >= rate:
+                return
+            fields['sample_rate'] = rate
+        self._logger.log(level, event, extra={'fields': fields}, exc_info=exc_info)
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, exc_info=False, **fields):
+        self._log(logging.ERROR, event, fields, exc_info=exc_info)
+
+def get_logger(name):
+    configure_logging()
+    return StructuredLogger(name)
+
+def bind_request_context(func):
+    """
+    Wrap func so it runs with the caller's request ID when executed on a worker thread
+    """
+    context = contextvars.copy_context()
+
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
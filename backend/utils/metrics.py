@@ -0,0 +1,166 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+# Log-linear bucketing (HDR-style): 8 sub-buckets per power of two gives ~12% relative
+# error on quantiles, from 1µs up to hours, in a few hundred integer counters
+SUB_BUCKET_BITS = 3
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+# Set to a list while a request is being profiled (utils/profiling.py); every
+# observation made on behalf of that request is also appended to it
+stage_trace_var = ContextVar('stage_trace', default=None)
+
+def _bucket_index(micros):
+    if micros < SUB_BUCKETS:
+        return max(micros, 0)
+    exponent = micros.bit_length() - 1
+    mantissa = (micros >> (exponent - SUB_BUCKET_BITS)) & (SUB_BUCKETS - 1)
+    return SUB_BUCKETS + (exponent - SUB_BUCKET_BITS) * SUB_BUCKETS + mantissa
+
+def _bucket_upper_bound(index):
+    """Largest value (in µs) that lands in a bucket"""
+    if index < SUB_BUCKETS:
+        return index
+    exponent = (index - SUB_BUCKETS) // SUB_BUCKETS + SUB_BUCKET_BITS
+    mantissa = (index - SUB_BUCKETS) % SUB_BUCKETS
+    return ((SUB_BUCKETS + mantissa + 1) << (exponent - SUB_BUCKET_BITS)) - 1
+
+def _bucket_midpoint(index):
+    lower = _bucket_upper_bound(index - 1) + 1 if index > 0 else 0
+    return (lower + _bucket_upper_bound(index)) / 2
+
+class Histogram:
+    """
+    Latency histogram with per-thread shards
+
+    Each thread records into its own counters, so the hot path takes no lock;
+    shards are only merged when metrics are read.
+    """
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {'counts': {}, 'count': 0, 'sum': 0.0}
+            self._local.shard = shard
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def observe(self, seconds):
+        shard = self._shard()
+        index = _bucket_index(int(seconds * 1_000_000))
+        counts = shard['counts']
+        counts[index] = counts.get(index, 0) + 1
+        shard['count'] += 1
+        shard['sum'] += seconds
+
+    def snapshot(self):
+        """Merge all shards into (bucket counts, count, sum)"""
+        counts = {}
+        total = 0
+        total_sum = 0.0
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for index, n in list(shard['counts'].items()):
+                counts[index] = counts.get(index, 0) + n
+            total += shard['count']
+            total_sum += shard['sum']
+        return counts, total, total_sum
+
+    def quantiles(self, qs=(0.5, 0.9, 0.99)):
+        """
+        Approximate quantiles in seconds (bucket midpoints)
+        Returns a dict of quantile -> seconds, plus count and sum
+        """
+        counts, total, total_sum = self.snapshot()
+        result = {'count': total, 'sum': total_sum}
+        if not total:
+            for q in qs:
+                result[q] = 0.0
+            return result
+
+        ordered = sorted(counts.items())
+        for q in qs:
+            rank = q * total
+            seen = 0
+            for index, n in ordered:
+                seen += n
+                if seen >= rank:
+                    result[q] = _bucket_midpoint(index) / 1_000_000
+                    break
+        return result
+
+class MetricsRegistry:
+    """
+    Named latency histograms, one per pipeline stage
+    """
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, stage):
+        histogram = self._histograms.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(stage, Histogram())
+        return histogram
+
+    def observe(self, stage, seconds):
+        self.histogram(stage).observe(seconds)
+        trace = stage_trace_var.get()
+        if trace is not None:
+            trace.append((stage, seconds))
+
+    @contextmanager
+    def timer(self, stage):
+        """Time a block: `with metrics.timer('gemini.upstream'): ...`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timed(self, stage):
+        """Decorator version of timer()"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """p50/p90/p99 per stage, for JSON consumers"""
+        histograms = self._histograms.copy()
+        return {
+            stage: histograms[stage].quantiles()
+            for stage in sorted(histograms)
+        }
+
+    def render_prometheus(self):
+        """
+        Render all histograms as Prometheus summaries (text exposition format 0.0.4)
+        """
+        name = 'healthflow_stage_latency_seconds'
+        lines = [
+            f'# HELP {name} Latency per pipeline stage',
+            f'# TYPE {name} summary'
+        ]
+        for stage, stats in self.summary().items():
+            for q in (0.5, 0.9, 0.99):
+                lines.append(f'{name}{{stage="{stage}",quantile="{q}"}} {stats[q]:.6f}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {stats["sum"]:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {stats["count"]}')
+        return '\n'.join(lines) + '\n'
+
+# Process-wide registry used by the API, Gemini client, agents and Opik logger
+metrics = MetricsRegistry()
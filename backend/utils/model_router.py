@@ -0,0 +1,92 @@
+import os
+from contextvars import ContextVar
+from utils.gemini_client import GeminiClient, run_fallback
+from utils.logger import get_logger
+
+log = get_logger('model_router')
+
+# Cascade tiers, cheapest first: (tier, model, minimum ambiguity score)
+# 'rules' is the agent's deterministic logic - no model call at all
+TIERS = [
+    ('rules', None, 0.0),
+    ('lite', 'gemini-2.0-flash-lite', 0.25),
+    ('standard', 'gemini-2.0-flash', 0.6),
+    ('strong', 'gemini-2.0-pro', 0.8)
+]
+
+# HEALTHFLOW_ROUTING=0 sends every request to flash-lite, as before routing existed
+ROUTING_ENABLED = os.getenv('HEALTHFLOW_ROUTING', '1') != '0'
+DEFAULT_TIER = 'lite'
+
+# Set for requests shed by admission control (main.py): answered by the rules
+# wherever the agent has them, without waiting for a model slot
+rules_only_var = ContextVar('rules_only', default=False)
+
+class Ambiguity:
+    """
+    How much judgment a request needs, from 0 (fully decided by the rules) to 1
+    Agents add a weight for every signal that makes the rule-based answer unreliable
+    """
+    __slots__ = ('score', 'reasons')
+
+    def __init__(self, base=0.0):
+        self.score = base
+        self.reasons = []
+
+    def add(self, weight, reason):
+        self.score = min(self.score + weight, 1.0)
+        self.reasons.append(reason)
+        return self
+
+class ModelRouter:
+    """
+    Routes each agent request to the cheapest tier that can handle it
+
+    Clear-cut requests are answered by the agent's rule-based logic, routine ones by
+    flash-lite, and only ambiguous multi-constraint ones escalate to flash or pro.
+    A tier whose daily budget is spent or whose circuit is open hands the request
+    down to the next cheaper tier, ending at the rules.
+    """
+    def __init__(self):
+        self.clients = {
+            tier: GeminiClient(model_name=model)
+            for tier, model, _ in TIERS if model is not None
+        }
+        # The flash-lite client also serves cache lookups and warm-up
+        self.default = self.clients[DEFAULT_TIER]
+
+    def choose_tier(self, score, allow_rules=True):
+        """Tier name for an ambiguity score, after budget and circuit checks"""
+        if allow_rules and rules_only_var.get():
+            return 'rules'
+        if not ROUTING_ENABLED:
+            return DEFAULT_TIER
+
+        start = max(i for i, (_, _, threshold) in enumerate(TIERS) if score >= threshold)
+        for tier, _, _ in reversed(TIERS[1:start + 1]):
+            client = self.clients[tier]
+            if not client.budget.exhausted() and client.breaker.allow_request():
+                return tier
+        # Nothing to fall back to without rules: let flash-lite fail over as usual
+        return 'rules' if allow_rules else DEFAULT_TIER
+
+    def generate(self, ambiguity, prompt, system_instruction=None, fallback=None, deadline_s=None, on_success=None):
+        """
+        GeminiClient.generate_with_deadline on the routed tier, or fallback() for 'rules'
+        The result carries the tier it was routed to ('fallback' still marks rule-based
+        answers, whether routed there or served after a model failure)
+        """
+        tier = self.choose_tier(ambiguity.score, allow_rules=fallback is not None)
+        log.info('model_routed', tier=tier, ambiguity=round(ambiguity.score, 2), reasons=ambiguity.reasons)
+
+        if tier == 'rules':
+            # Guarded like the model path's fallback: a failing rule-based generator is
+            # an unsuccessful response, not an exception in the route
+            response = run_fallback(fallback) or {'success': False, 'error': 'Rule-based fallback failed'}
+            if rules_only_var.get():
+                response = {**response, 'load_shed': True}
+        else:
+            response = self.clients[tier].generate_with_deadline(
+                prompt, system_instruction, fallback=fallback, deadline_s=deadline_s, on_success=on_success
+            )
+        return {**response, 'tier': tier}
@@ -1,42 +1,78 @@
-from opik import Opik
-from opik.api_objects import trace
 import os
-from dotenv import load_dotenv
+import threading
 from datetime import datetime
 import json
+from utils.metrics import metrics
+from utils.logger import get_logger
+from utils import fast_json
+from utils.config import load_config
 
-load_dotenv()
+log = get_logger('opik')
+
+load_config()
+
+# One Opik client per process, shared by every agent's logger. Created (and the
+# opik package imported - about two seconds) on the first trace, not at startup.
+_client = None
+_client_failed = False
+_client_lock = threading.Lock()
+
+def _get_client(project, workspace, host):
+    global _client, _client_failed
+    if _client is None and not _client_failed:
+        with _client_lock:
+            if _client is None and not _client_failed:
+                try:
+                    from opik import Opik
+                    # Opik SDK automatically uses OPIK_API_KEY from environment
+                    _client = Opik(
+                        project_name=project,
+                        workspace=workspace,
+                        host=host
+                    )
+                    log.info('opik_enabled', project=project)
+                except Exception as e:
+                    _client_failed = True
+                    log.warning('opik_init_failed', error=str(e), hint='Continuing without observability logging')
+    return _client
+
+def preload_sdk():
+    """Import the opik package now rather than on the first trace (long-running servers)"""
+    api_key = os.getenv('OPIK_API_KEY')
+    if api_key and api_key != 'your_opik_key_here':
+        import opik  # noqa: F401
+
+def reset_client_after_fork():
+    """Drop a client inherited from the parent process (its connections do not survive fork)"""
+    global _client
+    _client = None
 
 class OpikLogger:
     def __init__(self):
         self.enabled = False
-        self.client = None
         self.project_name = "healthflow-ai"
 
         # Opik SDK reads credentials from environment variables
         # OPIK_API_KEY, OPIK_URL_OVERRIDE, OPIK_WORKSPACE, OPIK_PROJECT_NAME
         api_key = os.getenv('OPIK_API_KEY')
-        workspace = os.getenv('OPIK_WORKSPACE', 'default')
-        host = os.getenv('OPIK_URL_OVERRIDE')
+        self.workspace = os.getenv('OPIK_WORKSPACE', 'default')
+        self.host = os.getenv('OPIK_URL_OVERRIDE')
         project = os.getenv('OPIK_PROJECT_NAME', 'healthflow-ai')
 
         if api_key and api_key != 'your_opik_key_here':
-            try:
-                # Opik SDK automatically uses OPIK_API_KEY from environment
-                self.client = Opik(
-                    project_name=project,
-                    workspace=workspace,
-                    host=host
-                )
-                self.project_name = project
-                self.enabled = True
-                print(f"✅ Opik observability enabled (project: {project})")
-            except Exception as e:
-                print(f"⚠️ Opik initialization failed: {e}")
-                print("📋 Continuing without observability logging")
+            self.project_name = project
+            self.enabled = True
         else:
-            print("📋 Opik not configured - skipping observability logging")
+            log.info('opik_not_configured')
+
+    @property
+    def client(self):
+        """Shared Opik client, or None if disabled or it could not be created"""
+        if not self.enabled:
+            return None
+        return _get_client(self.project_name, self.workspace, self.host)
 
+    @metrics.timed('opik.log_agent_decision')
     def log_agent_decision(self, agent_name, input_data, output_data, reasoning, metadata=None):
         """
         Log agent decision to Opik using traces
@@ -77,10 +113,11 @@ class OpikLogger:
 
             return True
         except Exception as e:
-            print(f"⚠️ Opik logging error: {e}")
+            log.warning('opik_logging_error', agent=agent_name, error=str(e))
             # Don't fail the app if logging fails
             return False
 
+    @metrics.timed('opik.log_constraint_check')
     def log_constraint_check(self, constraints_satisfied, violations):
         """
         Log constraint satisfaction metrics
@@ -105,8 +142,9 @@ class OpikLogger:
             )
             trace_obj.end()
         except Exception as e:
-            print(f"⚠️ Metric logging error: {e}")
+            log.warning('opik_metric_logging_error', error=str(e))
 
+    @metrics.timed('opik.log_multi_agent_orchestration')
     def log_multi_agent_orchestration(self, agents_involved, workflow_input, workflow_output, metadata=None):
         """
         Log the entire multi-agent workflow orchestration
@@ -129,17 +167,22 @@ class OpikLogger:
             )
             trace_obj.end()
         except Exception as e:
-            print(f"⚠️ Orchestration logging error: {e}")
+            log.warning('opik_orchestration_logging_error', error=str(e))
 
     def _sanitize_for_json(self, data):
         """
         Convert data to JSON-serializable format
+        A single encoder pass with str() for the values it cannot handle: data that is
+        already serializable (the usual case) is returned as is, otherwise the encoded
+        result is parsed back rather than encoding twice
         """
-        if isinstance(data, dict):
-            return {k: self._sanitize_for_json(v) for k, v in data.items()}
-        elif isinstance(data, list):
-            return [self._sanitize_for_json(item) for item in data]
-        elif isinstance(data, (str, int, float, bool, type(None))):
+        converted = []
+
+        def default(value):
+            converted.append(True)
+            return str(value)
+
+        encoded = fast_json.dumps_bytes(data, default=default)
+        if not converted:
             return data
-        else:
-            return str(data)
+        return fast_json.loads(encoded)
@@ -0,0 +1,145 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+from pathlib import Path
+from utils.metrics import stage_trace_var
+from utils.logger import get_logger
+
+log = get_logger('profiling')
+
+PROFILE_HEADER = 'X-Profile'
+
+# Header trigger is opt-in: cProfile slows the request it is attached to
+HEADER_ENABLED = os.getenv('HEALTHFLOW_PROFILE_HEADER') == '1'
+# Fraction of requests profiled automatically and dumped to PROFILE_DIR
+SAMPLE_RATE = float(os.getenv('HEALTHFLOW_PROFILE_SAMPLE', '0') or 0)
+PROFILE_DIR = Path(os.getenv('HEALTHFLOW_PROFILE_DIR', '.profiles'))
+# Functions listed in the attached cProfile summary
+TOP_FUNCTIONS = 25
+
+# cProfile hooks the interpreter, not just the calling thread, on newer Pythons:
+# only one request per process runs under it, others get the stage breakdown only
+_cprofile_lock = threading.Lock()
+
+class RequestProfile:
+    """
+    Profiling state of one request
+
+    Always collects the per-stage breakdown (every metrics.timer/observe made for the
+    request, including on worker threads). With cprofile=True the request thread
+    also runs under cProfile.
+    """
+    __slots__ = ('request_id', 'sampled', 'stages', 'profiler', 'started', 'elapsed', '_token')
+
+    def __init__(self, request_id, cprofile, sampled):
+        self.request_id = request_id
+        self.sampled = sampled
+        self.stages = []
+        self.profiler = None
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self._token = stage_trace_var.set(self.stages)
+        if cprofile and _cprofile_lock.acquire(blocking=False):
+            try:
+                profiler = cProfile.Profile()
+                profiler.enable()
+            except Exception as e:
+                # e.g. another profiler already owns the interpreter hook
+                _cprofile_lock.release()
+                log.warning('cprofile_unavailable', request_id=request_id, error=str(e))
+            else:
+                self.profiler = profiler
+
+    def stop(self):
+        """
+        Stop collecting and return elapsed seconds; idempotent, so the teardown hook
+        can call it again after finish_profile (or instead of it, when the request
+        failed before after_request ran) and the cProfile lock is released exactly once
+        """
+        if self.elapsed is not None:
+            return self.elapsed
+        self.elapsed = time.perf_counter() - self.started
+        try:
+            if self.profiler is not None:
+                self.profiler.disable()
+        finally:
+            if self.profiler is not None:
+                _cprofile_lock.release()
+            stage_trace_var.reset(self._token)
+        return self.elapsed
+
+    def breakdown(self):
+        """Total seconds and call count per stage, slowest first"""
+        totals = {}
+        for stage, seconds in list(self.stages):
+            if stage.startswith('route.'):
+                continue
+            total, count = totals.get(stage, (0.0, 0))
+            totals[stage] = (total + seconds, count + 1)
+        return sorted(totals.items(), key=lambda item: item[1][0], reverse=True)
+
+    def top_functions(self):
+        if self.profiler is None:
+            return None
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        return out.getvalue()
+
+def start_profile(headers, request_id):
+    """
+    RequestProfile for this request, or None (the common case - nothing else runs)
+
+    X-Profile: stages    per-stage breakdown only
+    X-Profile: 1         breakdown plus cProfile
+    (header honored only with HEALTHFLOW_PROFILE_HEADER=1), or sampled at
+    HEALTHFLOW_PROFILE_SAMPLE with cProfile
+    """
+    mode = headers.get(PROFILE_HEADER) if HEADER_ENABLED else None
+    if mode:
+        return RequestProfile(request_id, cprofile=mode.lower() != 'stages', sampled=False)
+    if SAMPLE_RATE and random.random() < SAMPLE_RATE:
+        return RequestProfile(request_id, cprofile=True, sampled=True)
+    return None
+
+def finish_profile(profile, response, path):
+    """
+    Stop profiling and report it: a Server-Timing header (shown by browser dev tools)
+    on every profiled response, and for cProfiled or sampled requests a dump in
+    HEALTHFLOW_PROFILE_DIR (<request_id>.prof for snakeviz/pstats, <request_id>.json)
+    """
+    elapsed = profile.stop()
+    breakdown = profile.breakdown()
+
+    timings = [f'{stage};dur={total * 1000:.2f}' for stage, (total, _) in breakdown]
+    timings.append(f'total;dur={elapsed * 1000:.2f}')
+    response.headers['Server-Timing'] = ', '.join(timings)
+
+    if profile.profiler is None and not profile.sampled:
+        return
+
+    try:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        base = PROFILE_DIR / f"{time.strftime('%Y%m%dT%H%M%S')}-{profile.request_id}"
+        if profile.profiler is not None:
+            profile.profiler.dump_stats(f'{base}.prof')
+        with open(f'{base}.json', 'w') as f:
+            json.dump({
+                'request_id': profile.request_id,
+                'path': path,
+                'status': response.status_code,
+                'total_ms': elapsed * 1000,
+                'stages': {
+                    stage: {'total_ms': total * 1000, 'count': count}
+                    for stage, (total, count) in breakdown
+                },
+                'top_functions': profile.top_functions()
+            }, f, indent=2)
+        response.headers['X-Profile-Id'] = base.name
+        log.info('request_profiled', path=path, total_ms=round(elapsed * 1000, 1), dump=str(base))
+    except OSError as e:
+        log.warning('profile_dump_failed', error=str(e))
@@ -0,0 +1,173 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from utils.cache import sqlite_connection
+from utils.logger import get_logger
+
+log = get_logger('quota')
+
+# Requests per day per model on the free tier (see GeminiClient); override with
+# HEALTHFLOW_DAILY_QUOTA_<MODEL>, e.g. HEALTHFLOW_DAILY_QUOTA_GEMINI_2_0_PRO=50
+DAILY_QUOTAS = {
+    'gemini-2.0-flash-lite': 1000,
+    'gemini-2.0-flash': 20,
+    'gemini-2.0-pro': 25
+}
+
+def _quota_for(model_name):
+    env_name = 'HEALTHFLOW_DAILY_QUOTA_' + re.sub(r'[^A-Z0-9]', '_', model_name.upper())
+    override = os.getenv(env_name)
+    if override is not None:
+        try:
+            return int(override)
+        except ValueError:
+            pass
+    return DAILY_QUOTAS.get(model_name)
+
+def _today():
+    return time.strftime('%Y-%m-%d', time.gmtime())
+
+class QuotaStore:
+    """
+    Calls per model and UTC day in a SQLite WAL database shared by every worker
+    process (HEALTHFLOW_QUOTA_DB, default .quota.sqlite3), so the quota holds across
+    workers and restarts
+    """
+    def __init__(self, db_path='.quota.sqlite3'):
+        self.db_path = str(db_path)
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS quota_usage (
+                    model TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    used INTEGER NOT NULL,
+                    PRIMARY KEY (model, day)
+                ) WITHOUT ROWID
+            """)
+
+    def _connection(self):
+        return sqlite_connection(self._local, self.db_path)
+
+    def used(self, model_name, day):
+        row = self._connection().execute(
+            "SELECT used FROM quota_usage WHERE model = ? AND day = ?", (model_name, day)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def increment(self, model_name, day):
+        self._connection().execute(
+            "INSERT INTO quota_usage (model, day, used) VALUES (?, ?, 1) "
+            "ON CONFLICT (model, day) DO UPDATE SET used = used + 1",
+            (model_name, day)
+        )
+
+    def purge_before(self, day):
+        self._connection().execute("DELETE FROM quota_usage WHERE day < ?", (day,))
+
+_store = None
+_store_lock = threading.Lock()
+
+def _get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = QuotaStore(os.getenv('HEALTHFLOW_QUOTA_DB', '.quota.sqlite3'))
+    return _store
+
+# Routing re-reads a model's usage from the store at most this often; this process's
+# own calls update the cached value in between, other workers' within the interval
+USAGE_CACHE_S = 1.0
+
+class DailyBudget:
+    """
+    Upstream calls made to one model today (UTC), against its daily quota
+
+    Counted in the shared QuotaStore, so every worker process draws from one quota.
+    Every upstream attempt counts (retries and breaker probes included) - they all
+    count against the quota. If the store cannot be read or written the call is
+    let through and counted in this process only.
+    """
+    def __init__(self, name, limit, store=None):
+        self.name = name
+        self.limit = limit
+        self.store = store or _get_store()
+        self.day = _today()
+        # Calls the store failed to record
+        self.unrecorded = 0
+        # Usage as of _cached_until - USAGE_CACHE_S, for remaining()
+        self._cached_used = None
+        self._cached_until = 0.0
+        self._lock = threading.Lock()
+
+    def _roll(self):
+        today = _today()
+        if today != self.day:
+            with self._lock:
+                if today != self.day:
+                    self.day = today
+                    self.unrecorded = 0
+                    self._cached_used = None
+                    try:
+                        self.store.purge_before(today)
+                    except sqlite3.Error as e:
+                        log.warning('quota_purge_error', model=self.name, error=str(e))
+        return today
+
+    def _used(self, day):
+        try:
+            return self.store.used(self.name, day) + self.unrecorded
+        except sqlite3.Error as e:
+            log.warning('quota_read_error', model=self.name, error=str(e))
+            return self.unrecorded
+
+    def remaining(self):
+        """Calls left today, or None for a model without a known quota"""
+        if self.limit is None:
+            return None
+        day = self._roll()
+        now = time.monotonic()
+        used = self._cached_used
+        if used is None or now >= self._cached_until:
+            used = self._cached_used = self._used(day)
+            self._cached_until = now + USAGE_CACHE_S
+        return max(self.limit - used, 0)
+
+    def exhausted(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def record_call(self):
+        day = self._roll()
+        try:
+            self.store.increment(self.name, day)
+        except sqlite3.Error as e:
+            log.warning('quota_write_error', model=self.name, error=str(e))
+            with self._lock:
+                self.unrecorded += 1
+        with self._lock:
+            if self._cached_used is not None:
+                self._cached_used += 1
+
+    def snapshot(self):
+        day = self._roll()
+        return {'day': day, 'used': self._used(day), 'limit': self.limit}
+
+_budgets = {}
+_budgets_lock = threading.Lock()
+
+def get_budget(model_name):
+    """Shared budget per model name (every agent using a model draws from one quota)"""
+    with _budgets_lock:
+        budget = _budgets.get(model_name)
+        if budget is None:
+            budget = _budgets[model_name] = DailyBudget(model_name, _quota_for(model_name))
+        return budget
+
+def budget_states():
+    """Usage of every model's daily budget, for the health endpoint"""
+    with _budgets_lock:
+        return {name: budget.snapshot() for name, budget in _budgets.items()}
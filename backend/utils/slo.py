@@ -0,0 +1,28 @@
+import os
+
+# Latency budget (seconds) for the LLM part of each endpoint. When Gemini has not
+# answered within the budget the agent's rule-based fallback is served instead.
+# Override per endpoint with HEALTHFLOW_SLO_<ENDPOINT>_S (e.g. HEALTHFLOW_SLO_WORKOUT_S=12);
+# 0 disables the deadline for that endpoint.
+LATENCY_SLOS = {
+    'hrv': 4.0,
+    'medical': 6.0,
+    'nutrition': 4.0,
+    'workout': 8.0
+}
+
+# Hedged requests: fire a second upstream call once the first has been outstanding
+# longer than the observed p95. Off by default - it spends extra quota.
+HEDGE_ENABLED = os.getenv('HEALTHFLOW_HEDGE') == '1'
+# Upstream samples needed before the p95 is trusted as a hedge delay
+HEDGE_MIN_SAMPLES = 20
+
+def get_slo(endpoint):
+    """Deadline in seconds for an endpoint, or None for no deadline"""
+    override = os.getenv(f'HEALTHFLOW_SLO_{endpoint.upper()}_S')
+    if override is not None:
+        try:
+            return float(override) or None
+        except ValueError:
+            pass
+    return LATENCY_SLOS.get(endpoint)
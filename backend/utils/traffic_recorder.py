@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from utils.logger import get_logger
+
+log = get_logger('traffic_recorder')
+
+# Keys whose values identify a person: replaced by a stable pseudonym so repeat
+# users still show up as repeats in a replay
+IDENTIFYING_FIELDS = {
+    'name', 'first_name', 'last_name', 'email', 'phone', 'dob', 'date_of_birth',
+    'address', 'user_id', 'patient_id', 'patient_name', 'mrn', 'ssn'
+}
+
+# Free-text fields that may contain clinical notes: every word is pseudonymized,
+# line structure, case and punctuation are kept so section splitting behaves the same
+FREE_TEXT_FIELDS = {'document', 'notes'}
+
+WORD = re.compile(r'[A-Za-z]+|\d+')
+
+class TrafficRecorder:
+    """
+    Append-only JSON-lines log of API requests, for offline replay
+
+    One line per request: {"ts": <epoch seconds>, "method": ..., "path": ..., "body": ...}
+    (the {path, body} shape warm_cache.py --log also reads). Bodies are anonymized
+    before they are written. Lines are written with a single O_APPEND write, so
+    several worker processes can share one file.
+
+    Pseudonyms are keyed by HEALTHFLOW_RECORD_SALT (random per process if unset - set
+    it when several workers record, so the same input maps to the same pseudonym).
+    """
+    def __init__(self, path, salt=None):
+        self.path = path
+        self.salt = (salt or secrets.token_hex(16)).encode()
+        self._fd = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Recorder writing to HEALTHFLOW_RECORD_PATH, or None when recording is off"""
+        path = os.getenv('HEALTHFLOW_RECORD_PATH')
+        if not path:
+            return None
+        return cls(path, salt=os.getenv('HEALTHFLOW_RECORD_SALT'))
+
+    def _pseudonym(self, value):
+        return hashlib.blake2b(str(value).encode(), key=self.salt, digest_size=6).hexdigest()
+
+    def _pseudonymize_word(self, match):
+        word = match.group(0)
+        digest = self._pseudonym(word.lower())
+        if word.isdigit():
+            return ''.join(str(int(c, 16) % 10) for c in digest)[:len(word)].ljust(len(word), '0')
+        letters = ''.join(chr(ord('a') + int(c, 16)) for c in (digest * (len(word) // 12 + 1)))[:len(word)]
+        if word.isupper():
+            return letters.upper()
+        if word[0].isupper():
+            return letters.capitalize()
+        return letters
+
+    def anonymize(self, value, key=None):
+        """Copy of a request body with identifying values pseudonymized"""
+        if isinstance(value, dict):
+            return {k: self.anonymize(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.anonymize(v, key) for v in value]
+        if key in IDENTIFYING_FIELDS and value is not None:
+            return f"anon-{self._pseudonym(value)}"
+        if key in FREE_TEXT_FIELDS and isinstance(value, str):
+            return WORD.sub(self._pseudonymize_word, value)
+        return value
+
+    def _file(self):
+        # Re-open after fork so each worker has its own descriptor
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            self._pid = os.getpid()
+        return self._fd
+
+    def record(self, method, path, body):
+        line = json.dumps({
+            'ts': time.time(),
+            'method': method,
+            'path': path,
+            'body': self.anonymize(body)
+        }, separators=(',', ':')) + '\n'
+        try:
+            with self._lock:
+                os.write(self._file(), line.encode())
+        except OSError as e:
+            log.warning('traffic_record_failed', error=str(e))
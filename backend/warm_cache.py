@@ -0,0 +1,168 @@
+"""
+Offline cache warm-up for medical constraint extraction
+
+Enumerates the most common medical profiles (from data/common_profiles.py and/or
+observed request logs) and fills the Gemini response cache ahead of the morning peak,
+so /api/medical/parse is served from cache with no upstream latency.
+
+Usage:
+    python warm_cache.py                          # profiles from data/common_profiles.py
+    python warm_cache.py --log requests.jsonl     # add profiles observed in request logs
+    python warm_cache.py --rpm 10 --max-calls 300 # stay well inside the daily quota
+"""
+import argparse
+import json
+import time
+from collections import Counter
+
+from agents.medical_parser import MedicalParserAgent
+from data.common_profiles import enumerate_common_profiles
+from utils.logger import get_logger
+
+log = get_logger('warm_cache')
+
+def _profile_key(profile):
+    """Stable identity for a profile, used for de-duplication and frequency counts"""
+    return json.dumps({
+        'surgery': profile.get('surgery', 'None'),
+        'weeks_post_op': profile.get('weeks_post_op', 'N/A'),
+        'restrictions': profile.get('restrictions', []),
+        'medications': profile.get('medications', [])
+    }, sort_keys=True)
+
+def load_logged_profiles(log_path):
+    """
+    Read medical profiles from a JSON-lines request log
+    Accepts raw profile objects or {"path": "/api/medical/parse", "body": {...}} records
+    Returns a Counter of profile key -> number of times observed
+    """
+    counts = Counter()
+    with open(log_path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+
+            if 'body' in record:
+                if record.get('path', '/api/medical/parse') != '/api/medical/parse':
+                    continue
+                record = record['body']
+
+            if isinstance(record, dict) and 'surgery' in record:
+                counts[_profile_key(record)] += 1
+    return counts
+
+class RateLimiter:
+    """
+    Spaces upstream calls evenly so warm-up never bursts past the per-minute quota
+    """
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute
+        self.next_allowed = 0.0
+
+    def wait(self):
+        now = time.monotonic()
+        if now < self.next_allowed:
+            time.sleep(self.next_allowed - now)
+        self.next_allowed = max(now, self.next_allowed) + self.interval
+
+def warm(profiles, agent, rpm, max_calls, max_consecutive_failures=3):
+    """
+    Warm the cache for profiles (most frequent first)
+    Returns a dict of profile key -> 'hit' | 'warmed' | 'failed' | 'skipped'
+    """
+    limiter = RateLimiter(rpm)
+    results = {}
+    first_with_identity = {}
+    calls = 0
+    consecutive_failures = 0
+
+    for key in profiles:
+        profile = json.loads(key)
+
+        # Weeks within one protocol phase share a cached result - warm each phase once
+        identity = agent.cache_identity(profile)
+        if identity in first_with_identity:
+            outcome = results[first_with_identity[identity]]
+            results[key] = 'hit' if outcome == 'warmed' else outcome
+            continue
+        first_with_identity[identity] = key
+
+        if agent.is_cached(profile):
+            results[key] = 'hit'
+            continue
+
+        if calls >= max_calls or consecutive_failures >= max_consecutive_failures:
+            results[key] = 'skipped'
+            continue
+
+        limiter.wait()
+        outcome = agent.warm_cache(profile)
+        calls += 1
+        results[key] = outcome
+
+        if outcome == 'failed':
+            consecutive_failures += 1
+            if consecutive_failures >= max_consecutive_failures:
+                # Quota likely exhausted: the remaining profiles are reported as skipped
+                log.warning('warm_cache_quota_stop', consecutive_failures=consecutive_failures, calls=calls)
+        else:
+            consecutive_failures = 0
+
+        log.info('warm_cache_progress', calls=calls, max_calls=max_calls, outcome=outcome,
+                 surgery=profile['surgery'], weeks_post_op=profile['weeks_post_op'])
+
+    return results
+
+def report(results, weights):
+    """Print coverage summary, weighted by observed traffic when weights are available"""
+    outcomes = Counter(results.values())
+    total = len(results)
+    covered = outcomes['hit'] + outcomes['warmed']
+
+    print("=" * 60)
+    print("CACHE WARM-UP REPORT")
+    print("=" * 60)
+    print(f"Profiles:         {total}")
+    print(f"Already cached:   {outcomes['hit']}")
+    print(f"Warmed now:       {outcomes['warmed']}")
+    print(f"Failed:           {outcomes['failed']}")
+    print(f"Skipped (budget): {outcomes['skipped']}")
+    if total:
+        print(f"Profile coverage: {covered / total * 100:.1f}%")
+
+    total_weight = sum(weights.values())
+    if total_weight:
+        covered_weight = sum(weights[k] for k, v in results.items() if v in ('hit', 'warmed'))
+        print(f"Traffic coverage: {covered_weight / total_weight * 100:.1f}% of logged requests")
+    print("=" * 60)
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-warm the medical constraint cache')
+    parser.add_argument('--log', help='JSON-lines request log to mine for observed profiles')
+    parser.add_argument('--top', type=int, default=200, help='Most frequent logged profiles to include')
+    parser.add_argument('--no-config', action='store_true', help='Skip profiles from data/common_profiles.py')
+    parser.add_argument('--rpm', type=float, default=15, help='Max upstream requests per minute')
+    parser.add_argument('--max-calls', type=int, default=200, help='Max upstream calls for this run (daily quota headroom)')
+    args = parser.parse_args()
+
+    weights = Counter()
+    if args.log:
+        weights = Counter(dict(load_logged_profiles(args.log).most_common(args.top)))
+
+    # Logged profiles first (by frequency), then the configured ones
+    profiles = [key for key, _ in weights.most_common()]
+    if not args.no_config:
+        profiles += [_profile_key(p) for p in enumerate_common_profiles()]
+    profiles = list(dict.fromkeys(profiles))
+
+    agent = MedicalParserAgent()
+    results = warm(profiles, agent, args.rpm, args.max_calls)
+    report(results, weights)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+"""
+Production WSGI entry point
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from main import create_app, preload_sdks
+
+app = create_app()
+# Imported once in the gunicorn master and shared by every forked worker
+preload_sdks()